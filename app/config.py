@@ -20,6 +20,37 @@ class Settings:
     UPLOAD_DIR: str        = os.getenv("UPLOAD_DIR",   str(_BASE / "uploads"))
     OCR_LANG: str          = os.getenv("OCR_LANG", "deu+eng+fra+spa+ara+kor+chi_sim")
     RATE_LIMIT_ENABLED: bool = os.getenv("RATE_LIMIT_ENABLED", "false").lower() == "true"
+    PARSE_BUDGET_MS: int   = int(os.getenv("PARSE_BUDGET_MS", "250"))   # fatura başına ayrıştırma süresi
+    SQLITE_CACHE_KB: int   = int(os.getenv("SQLITE_CACHE_KB", "32000"))  # bağlantı başına page cache
+    GROUP_COMMIT_MS: float = float(os.getenv("GROUP_COMMIT_MS", "2"))    # batch toplama penceresi
+    GROUP_COMMIT_MAX: int  = int(os.getenv("GROUP_COMMIT_MAX", "64"))    # commit başına en fazla iş
+    DB_THREADS: int        = int(os.getenv("DB_THREADS", "8"))           # async route'lar için DB executor
+    INVOICE_SHARDS: int    = int(os.getenv("INVOICE_SHARDS", "1"))       # fatura DB dosyası sayısı (tenant hash)
+    LOOP_LAG_INTERVAL_MS: int  = int(os.getenv("LOOP_LAG_INTERVAL_MS", "500"))   # event loop ölçüm aralığı
+    LOOP_LAG_THRESHOLD_MS: int = int(os.getenv("LOOP_LAG_THRESHOLD_MS", "100"))  # bu gecikmenin üstü loglanır
+    RETENTION_DAYS: int    = int(os.getenv("RETENTION_DAYS", "90"))      # fatura dosyası saklama süresi
+    RETENTION_BATCH: int   = int(os.getenv("RETENTION_BATCH", "500"))    # transaction başına dosya
+    RETENTION_PAUSE_MS: int = int(os.getenv("RETENTION_PAUSE_MS", "50")) # batch'ler arası bekleme
+    RETENTION_UNLINK_THREADS: int = int(os.getenv("RETENTION_UNLINK_THREADS", "4"))
+    REAPER_BATCH: int      = int(os.getenv("REAPER_BATCH", "200"))       # silme transaction'ı başına fatura
+    REAPER_PAUSE_MS: int   = int(os.getenv("REAPER_PAUSE_MS", "50"))     # batch'ler arası bekleme
+    REAPER_INTERVAL_MIN: int = int(os.getenv("REAPER_INTERVAL_MIN", "10"))  # yarım kalan silmeleri sürdürme
+    BACKUP_DIR: str        = os.getenv("BACKUP_DIR", str(_BASE / "backups"))
+    BACKUP_HOUR: int       = int(os.getenv("BACKUP_HOUR", "4"))          # gece yedeği (retention'dan sonra)
+    BACKUP_KEEP: int       = int(os.getenv("BACKUP_KEEP", "7"))          # saklanan yedek sayısı
+    WAL_CHECKPOINT_S: int  = int(os.getenv("WAL_CHECKPOINT_S", "60"))    # PASSIVE checkpoint aralığı
+    WAL_TRUNCATE_MB: int   = int(os.getenv("WAL_TRUNCATE_MB", "16"))     # düşük yükte bunun üstü TRUNCATE
+    MAINT_IDLE_WRITES: int = int(os.getenv("MAINT_IDLE_WRITES", "10"))   # aralıkta bu kadar yazma = düşük yük
+    MAINT_BUSY_MS: int     = int(os.getenv("MAINT_BUSY_MS", "1000"))     # bakım adımlarının kilit bekleme sınırı
+    OPTIMIZE_INTERVAL_MIN: int = int(os.getenv("OPTIMIZE_INTERVAL_MIN", "60"))   # ANALYZE + incremental vacuum
+    VACUUM_PAGES: int      = int(os.getenv("VACUUM_PAGES", "2000"))      # çalıştırma başına geri verilen sayfa
+    ARCHIVE_DIR: str       = os.getenv("ARCHIVE_DIR", str(_BASE / "archive"))
+    ARCHIVE_HOT_YEARS: int = int(os.getenv("ARCHIVE_HOT_YEARS", "2"))    # bu yıl + önceki yıl sıcak shard'larda
+    ARCHIVE_BATCH: int     = int(os.getenv("ARCHIVE_BATCH", "1000"))     # arşive taşıma transaction'ı başına fatura
+    ARCHIVE_PAUSE_MS: int  = int(os.getenv("ARCHIVE_PAUSE_MS", "20"))    # batch'ler arası bekleme
+    ARCHIVE_CACHE_KB: int  = int(os.getenv("ARCHIVE_CACHE_KB", "2000"))  # arşiv bağlantısı başına page cache
+    OCR_WARMUP: bool       = os.getenv("OCR_WARMUP", "true").lower() == "true"   # açılışta OCR pipeline'ını ısıt
+    OCR_WARMUP_ROUNDS: int = int(os.getenv("OCR_WARMUP_ROUNDS", "1"))    # sentetik fişle tam pipeline turu
 
     def __post_init__(self):
         Path(self.UPLOAD_DIR).mkdir(parents=True, exist_ok=True)
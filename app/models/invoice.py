@@ -17,6 +17,8 @@ class InvoiceResult(BaseModel):
     qr_raw: Optional[str]          = None
     qr_parsed: Optional[Any]       = None
     raw_text: Optional[str]        = None
+    items: Optional[list]          = None
+    vat_lines: Optional[list]      = None
     needs_review: bool             = False
     review_reason: Optional[str]   = None
     message: str                   = "OK"
@@ -21,16 +21,17 @@ def admin_stats(admin=Depends(require_admin)):
         active_users  = c.execute("SELECT COUNT(*) FROM users WHERE is_active=1").fetchone()[0]
         plan_counts   = {row[0]: row[1] for row in
                          c.execute("SELECT plan, COUNT(*) FROM users GROUP BY plan").fetchall()}
-        total_invoices = 0
-        try:
-            total_invoices = c.execute("SELECT COUNT(*) FROM invoices").fetchone()[0]
-        except Exception:
-            pass
+    # Fatura sayısı shard'lardan paralel fan-out ile
+    from app.services.invoice_db import archive_counts, shard_counts
+    per_shard = shard_counts()
+    archived  = archive_counts()
     return {
         "total_users":    total_users,
         "active_users":   active_users,
         "plan_counts":    plan_counts,
-        "total_invoices": total_invoices,
+        "total_invoices": sum(per_shard) + sum(archived),
+        "shard_invoices": per_shard,
+        "archived_invoices": sum(archived),
     }
 
 
@@ -100,11 +101,13 @@ def admin_patch_user(user_id: str, body: PatchUser, admin=Depends(require_admin)
 def admin_delete_user(user_id: str, admin=Depends(require_admin)):
     if user_id == admin["id"]:
         raise HTTPException(400, "Kendi hesabınızı silemezsiniz.")
-    with _LOCK:
-        with _conn() as c:
-            c.execute("DELETE FROM users WHERE id=?", (user_id,))
-            c.execute("DELETE FROM refresh_tokens WHERE user_id=?", (user_id,))
-    return {"ok": True}
+    # Faturalar anında gizlenir, reaper arka planda siler (bkz. app/services/reaper.py)
+    from app.services import reaper
+    from app.services.user_db import delete_user
+    req = reaper.tombstone_tenant(user_id)
+    delete_user(user_id)
+    reaper.start()
+    return {"ok": True, "deletion_request": req["id"]}
 
 
 # ── POST /admin/email — toplu e-posta ────────────────────
@@ -124,3 +127,203 @@ def admin_bulk_email(body: BulkEmail, admin=Depends(require_admin)):
     for email in emails:
         send_async(email, body.subject, body.html)
     return {"sent": len(emails)}
+
+
+# ── Toplu yeniden ayrıştırma (raw_text → güncel parser) ──
+class ReparseIn(BaseModel):
+    dry_run: bool = True
+    chunk:   int  = 500
+    workers: Optional[int] = None
+
+@router.post("/reparse")
+def admin_reparse_start(body: ReparseIn, admin=Depends(require_admin)):
+    from app.services import reparse
+    job_id = reparse.create_job(dry_run=body.dry_run, chunk=body.chunk,
+                                workers=body.workers or reparse.DEFAULT_WORKERS)
+    reparse.start_job(job_id)
+    return reparse.get_job(job_id)
+
+
+@router.get("/reparse")
+def admin_reparse_list(admin=Depends(require_admin)):
+    from app.services import reparse
+    return reparse.list_jobs()
+
+
+@router.get("/reparse/{job_id}")
+def admin_reparse_status(job_id: str, admin=Depends(require_admin)):
+    from app.services import reparse
+    job = reparse.get_job(job_id)
+    if not job:
+        raise HTTPException(404, "Job bulunamadı.")
+    return job
+
+
+@router.get("/reparse/{job_id}/diff")
+def admin_reparse_diff(
+    job_id: str,
+    after:  int = Query(0, ge=0),
+    limit:  int = Query(200, ge=1, le=1000),
+    admin=Depends(require_admin),
+):
+    from app.services import reparse
+    return reparse.get_diffs(job_id, after=after, limit=limit)
+
+
+@router.post("/reparse/{job_id}/resume")
+def admin_reparse_resume(
+    job_id:  str,
+    workers: Optional[int] = Query(None, ge=1, le=64, description="Boş → job'ın worker sayısı"),
+    admin=Depends(require_admin),
+):
+    from app.services import reparse
+    job = reparse.get_job(job_id)
+    if not job:
+        raise HTTPException(404, "Job bulunamadı.")
+    if job["status"] == "done":
+        raise HTTPException(400, "Job zaten tamamlandı.")
+    reparse.start_job(job_id, workers=workers)
+    return reparse.get_job(job_id)
+
+
+@router.post("/reparse/{job_id}/cancel")
+def admin_reparse_cancel(job_id: str, admin=Depends(require_admin)):
+    from app.services import reparse
+    if not reparse.cancel_job(job_id):
+        raise HTTPException(400, "Job çalışmıyor.")
+    return {"ok": True}
+
+
+# ── Dosya saklama süresi (GDPR retention) ────────────────
+class RetentionIn(BaseModel):
+    days:  Optional[int] = None
+    batch: Optional[int] = None
+
+@router.post("/retention")
+def admin_retention_start(body: RetentionIn, admin=Depends(require_admin)):
+    """Yarım kalan job varsa onu sürdürür, yoksa yenisini başlatır."""
+    from app.services import retention
+    return retention.start(days=body.days, batch=body.batch)
+
+
+@router.get("/retention")
+def admin_retention_list(admin=Depends(require_admin)):
+    from app.services import retention
+    return {**retention.stats(), "jobs": retention.list_jobs()}
+
+
+@router.get("/retention/{job_id}")
+def admin_retention_status(job_id: str, admin=Depends(require_admin)):
+    from app.services import retention
+    job = retention.get_job(job_id)
+    if not job:
+        raise HTTPException(404, "Job bulunamadı.")
+    return job
+
+
+@router.post("/retention/{job_id}/cancel")
+def admin_retention_cancel(job_id: str, admin=Depends(require_admin)):
+    from app.services import retention
+    if not retention.cancel_job(job_id):
+        raise HTTPException(400, "Job çalışmıyor.")
+    return {"ok": True}
+
+
+# ── Hesap silme istekleri (GDPR Md.17 kanıtı) ────────────
+@router.get("/deletions")
+def admin_deletions(status: Optional[str] = None, limit: int = Query(50, ge=1, le=500),
+                    admin=Depends(require_admin)):
+    from app.services import reaper
+    return {**reaper.stats(), "requests": reaper.list_requests(limit, status)}
+
+
+@router.get("/deletions/{request_id}")
+def admin_deletion_status(request_id: str, admin=Depends(require_admin)):
+    from app.services import reaper
+    req = reaper.get_request(request_id)
+    if not req:
+        raise HTTPException(404, "Silme isteği bulunamadı.")
+    return req
+
+
+@router.post("/deletions/run")
+def admin_deletions_run(admin=Depends(require_admin)):
+    """Bekleyen silmeleri arka planda sürdür (dosyası silinemeyenler tekrar denenir)."""
+    from app.services import reaper
+    reaper.start()
+    return reaper.stats()
+
+
+# ── GET /admin/db/pool — bağlantı havuzu + group commit metrikleri
+@router.get("/db/pool")
+def admin_db_pool(admin=Depends(require_admin)):
+    from app.services import db, db_writer
+    return {"pools": db.stats(), "writers": db_writer.stats()}
+
+
+# ── DB bakımı: WAL / checkpoint lag / yedek ──────────────
+@router.get("/db/maintenance")
+def admin_db_maintenance(admin=Depends(require_admin)):
+    from app.services import maintenance
+    return maintenance.stats()
+
+
+@router.post("/db/backup")
+def admin_db_backup(admin=Depends(require_admin)):
+    """Online yedeği arka planda başlat; sonuç GET /admin/db/maintenance → backup."""
+    from app.config import settings
+    from app.services import maintenance
+    maintenance.start_backup()
+    return {"ok": True, "backup_dir": settings.BACKUP_DIR}
+
+
+# ── Fatura shard'ları ─────────────────────────────────────
+@router.get("/shards")
+def admin_shards(admin=Depends(require_admin)):
+    from app.services import sharding
+    return sharding.status()
+
+
+@router.post("/shards/rebalance")
+def admin_shards_rebalance(admin=Depends(require_admin)):
+    from app.services import sharding
+    st = sharding.status()
+    if st["rebalance"]["running"]:
+        raise HTTPException(409, "Taşıma zaten çalışıyor.")
+    sharding.start_rebalance()
+    return {"ok": True, "pending_tenants": st["pending_tenants"]}
+
+
+# ── Sıcak / soğuk depolama (yıl arşivleri) ───────────────
+@router.get("/archive")
+def admin_archive(admin=Depends(require_admin)):
+    from app.services import archive
+    return archive.status()
+
+
+@router.post("/archive/run")
+def admin_archive_run(admin=Depends(require_admin)):
+    """Vadesi gelen yılları arka planda arşivle; ilerleme GET /admin/archive → job."""
+    from app.services import archive
+    st = archive.status()
+    if st["job"]["running"]:
+        raise HTTPException(409, "Arşivleme zaten çalışıyor.")
+    archive.start()
+    return {"ok": True, "last_archivable": st["last_archivable"]}
+
+
+# ── GET /admin/loop — event loop gecikme metrikleri ───────
+@router.get("/loop")
+def admin_loop(admin=Depends(require_admin)):
+    from app.services import loop_monitor
+    return loop_monitor.stats()
+
+
+# ── POST /admin/search/rebuild — FTS index'ini yeniden kur ──
+@router.post("/search/rebuild")
+def admin_search_rebuild(admin=Depends(require_admin)):
+    from app.services import invoice_db
+    if not invoice_db.FTS_TOKENIZER:
+        raise HTTPException(status_code=503, detail="FTS5 bu SQLite sürümünde yok.")
+    n = invoice_db.rebuild_search_index()
+    return {"ok": True, "indexed": n, "tokenizer": invoice_db.FTS_TOKENIZER}
@@ -5,17 +5,13 @@ from typing import List, Optional
 import asyncio
 import os
 
-from app.services.image_processor import to_raw_png, prepare_for_ocr
-from app.services.ocr_engine import run_ocr
-from app.services.amount_parser import extract_total_amount
-from app.services.invoice_parser import parse_invoice
+from app.services.invoice_parser import parse_ocr_text
 from app.services.invoice_db import (
-    add_invoice, update_invoice, get_review_queue, get_invoice,
-    find_duplicate, find_recurring
+    update_invoice, get_review_queue, get_invoice,
 )
-from app.services.qr_reader import read_qr, parse_qr
 from app.models.invoice import InvoiceResult
-from app.services.user_db import check_quota, increment_usage, PLANS
+from app.services.user_db import PLANS
+from app.services import db_async
 
 router = APIRouter(prefix="/ocr", tags=["OCR"])
 
@@ -75,8 +71,25 @@ def _plan_allows_qr(user) -> bool:
     return PLANS.get(plan, PLANS["free"]).get("qr", False)
 
 
-async def _process(f: UploadFile, qr_allowed: bool = True,
-                   user_id: str = None) -> InvoiceResult:
+def _uid(request: Request) -> str:
+    """inject_user middleware'inin request.state'e koyduğu kullanıcı."""
+    user = getattr(request.state, "user", None)
+    if not user:
+        raise HTTPException(status_code=401, detail="Oturum açmanız gerekiyor.")
+    return user["id"]
+
+
+def _engines():
+    """
+    cv2 / numpy / pdf2image / pytesseract ilk yüklemede yüklenir (açılışı yavaşlatmasın);
+    import thread havuzunda → event loop bloklanmaz. Sonraki çağrılar sys.modules'tan.
+    """
+    from app.services import image_processor, ocr_engine, qr_reader
+    return image_processor, ocr_engine, qr_reader
+
+
+async def _analyze(f: UploadFile, qr_allowed: bool = True) -> tuple[str, dict]:
+    """Dosya → (filename, kayda hazır parsed dict). DB'ye yazmaz."""
     filename = _sanitize_filename(f.filename or "upload")
 
     # Uzantı kontrolü
@@ -94,34 +107,43 @@ async def _process(f: UploadFile, qr_allowed: bool = True,
     if len(raw) < 100:
         raise HTTPException(status_code=400, detail="Dosya boş veya bozuk.")
 
+    images, engine, qr = await run_in_threadpool(_engines)
+
     # Ham PNG (QR için — enhancement YOK)
-    raw_png  = await run_in_threadpool(to_raw_png, raw, filename)
+    raw_png  = await run_in_threadpool(images.to_raw_png, raw, filename)
 
     # QR / Barkod — plan izni varsa
-    qr_raw    = await run_in_threadpool(read_qr, raw_png) if qr_allowed else None
-    qr_parsed = _sanitize_qr_override(parse_qr(qr_raw)) if qr_raw else {}
+    qr_raw    = await run_in_threadpool(qr.read_qr, raw_png) if qr_allowed else None
+    qr_parsed = _sanitize_qr_override(qr.parse_qr(qr_raw)) if qr_raw else {}
 
-  # Enhancement → Super Resolution → OCR
-ocr_ready = await run_in_threadpool(prepare_for_ocr, raw_png)
-text      = await run_in_threadpool(run_ocr, ocr_ready)
+    # Enhancement → Super Resolution → OCR
+    ocr_ready = await run_in_threadpool(images.prepare_for_ocr, raw_png)
+    text      = await run_in_threadpool(engine.run_ocr, ocr_ready)
 
-parsed = parse_invoice(text)
-
-# 🔥 Yeni güçlü total extractor (çok dilli + akıllı)
-better_total = extract_total_amount(text)
-
-if better_total is not None:
-    parsed["total"] = better_total
+    # Alanlar + güçlü total extractor + ürün / KDV satırları (tek sefer, ingest'te)
+    parsed = await run_in_threadpool(parse_ocr_text, text)
 
     # QR override (sanitize edilmiş)
     for key in ("total", "date", "time", "invoice_number", "vendor", "vat_amount", "vat_rate", "company"):
         if qr_parsed.get(key) is not None:
             parsed[key] = qr_parsed[key]
 
-    needs_review  = not parsed.get("total")
-    review_reason = "Toplam tutar bulunamadı" if needs_review else None
-    inv_id        = add_invoice(parsed, filename, user_id)
+    needs_review  = not parsed.get("total") or bool(parsed.get("parse_timeout"))
+    review_reason = ("Toplam tutar bulunamadı" if not parsed.get("total")
+                     else "Ayrıştırma süre limiti aşıldı (kısmi sonuç)" if needs_review
+                     else None)
+    parsed.update(
+        raw_text      = text,
+        qr_raw        = qr_raw,
+        qr_parsed     = qr_parsed or None,
+        needs_review  = needs_review,
+        review_reason = review_reason,
+    )
+    return filename, parsed
+
 
+def _result(inv_id: str, filename: str, parsed: dict) -> InvoiceResult:
+    qr_raw = parsed.get("qr_raw")
     return InvoiceResult(
         invoice_id     = inv_id,
         filename       = filename,
@@ -135,19 +157,29 @@ if better_total is not None:
         category       = parsed.get("category"),
         payment_method = parsed.get("payment_method"),
         qr_raw         = qr_raw[:QR_MAX_STR] if qr_raw else None,
-        qr_parsed      = qr_parsed or None,
-        raw_text       = text[:5000],   # response boyutunu sınırla
-        needs_review   = needs_review,
-        review_reason  = review_reason,
+        qr_parsed      = parsed.get("qr_parsed"),
+        raw_text       = (parsed.get("raw_text") or "")[:5000],   # response boyutunu sınırla
+        items          = parsed.get("items") or None,
+        vat_lines      = parsed.get("vat_lines") or None,
+        needs_review   = parsed.get("needs_review"),
+        review_reason  = parsed.get("review_reason"),
         message        = "OCR tamamlandı",
     )
 
 
+async def _process(f: UploadFile, qr_allowed: bool = True,
+                   user_id: str = None) -> InvoiceResult:
+    filename, parsed = await _analyze(f, qr_allowed)
+    # Yazma group commit'i bekler → event loop'u bloklamasın
+    inv_id = await db_async.add_invoice(parsed, filename, user_id)
+    return _result(inv_id, filename, parsed)
+
+
 @router.post("/upload", response_model=InvoiceResult)
 async def upload(request: Request, file: UploadFile = File(...)):
     user = getattr(request.state, "user", None)
     if user:
-        allowed, used, limit = check_quota(user)
+        allowed, used, limit = await db_async.check_quota(user)
         if not allowed:
             plan_label = PLANS.get(user.get("plan","free"), {}).get("label","")
             raise HTTPException(
@@ -158,17 +190,17 @@ async def upload(request: Request, file: UploadFile = File(...)):
     result = await _process(file, qr_allowed=_plan_allows_qr(user),
                             user_id=user["id"] if user else None)
     if user:
-        increment_usage(user["id"])
+        await db_async.increment_usage(user["id"])
         # Kota %80 veya %95 dolunca uyarı e-postası gönder
-        _, used2, limit2 = check_quota(user)
+        _, used2, limit2 = await db_async.check_quota(user)
         if limit2 and limit2 > 0:
             pct = used2 / limit2
             if pct in (0.8, 0.95) or (0.799 < pct < 0.801) or (0.949 < pct < 0.951):
                 from app.services.email_service import send_quota_warning
-                from app.services.user_db import get_user_by_id
-                u = get_user_by_id(user["id"])
+                u = await db_async.get_user_by_id(user["id"])
                 if u:
-                    send_quota_warning(
+                    await run_in_threadpool(
+                        send_quota_warning,
                         u["email"],
                         u.get("full_name") or u["email"].split("@")[0],
                         used2, limit2, u.get("plan","free")
@@ -176,11 +208,11 @@ async def upload(request: Request, file: UploadFile = File(...)):
 
     # Duplikasyon + tekrarlayan fatura kontrolü
     uid = user["id"] if user else None
-    dup = find_duplicate(
+    dup = await db_async.find_duplicate(
         vendor         = result.vendor,
         date           = result.date,
         total          = result.total,
-        invoice_number = result.invoice_number,
+        invoice_number = result.invoice_no,
         user_id        = uid,
     )
     result_dict = result.model_dump()
@@ -194,10 +226,10 @@ async def upload(request: Request, file: UploadFile = File(...)):
         }
         if user:
             from app.services.email_service import send_duplicate_warning
-            from app.services.user_db import get_user_by_id
-            u2 = get_user_by_id(user["id"])
+            u2 = await db_async.get_user_by_id(user["id"])
             if u2:
-                send_duplicate_warning(
+                await run_in_threadpool(
+                    send_duplicate_warning,
                     u2["email"],
                     u2.get("full_name") or u2["email"].split("@")[0],
                     result.vendor or "?",
@@ -207,7 +239,7 @@ async def upload(request: Request, file: UploadFile = File(...)):
 
     # Tekrarlayan fatura analizi (3 ay ardışık gelmişse bildir)
     if result.vendor:
-        recurring = find_recurring(result.vendor, months=3, user_id=uid)
+        recurring = await db_async.find_recurring(result.vendor, months=3, user_id=uid)
         if len(recurring) >= 3:
             months_found = [r["month"] for r in recurring]
             result_dict["recurring_info"] = {
@@ -226,7 +258,7 @@ async def upload_multi(request: Request, files: List[UploadFile] = File(...)):
         raise HTTPException(status_code=400, detail="Tek seferde maksimum 50 dosya yükleyebilirsiniz.")
     user = getattr(request.state, "user", None)
     if user:
-        allowed, used, limit = check_quota(user)
+        allowed, used, limit = await db_async.check_quota(user)
         remaining = (limit - used) if limit != -1 else len(files)
         if not allowed:
             plan_label = PLANS.get(user.get("plan","free"), {}).get("label","")
@@ -237,35 +269,43 @@ async def upload_multi(request: Request, files: List[UploadFile] = File(...)):
             )
         if limit != -1 and len(files) > remaining:
             files = files[:remaining]
-    # Seri işle (concurrent race condition'ı önle)
-    results = []
-    errors  = []
-    qr_ok   = _plan_allows_qr(user)
-    uid     = user["id"] if user else None
+    # Seri işle (concurrent race condition'ı önle), sonra tek executemany ile yaz
+    analyzed = []
+    errors   = []
+    qr_ok    = _plan_allows_qr(user)
+    uid      = user["id"] if user else None
     for f in files:
         try:
-            r = await _process(f, qr_allowed=qr_ok, user_id=uid)
-            if user:
-                increment_usage(user["id"])
-            results.append(r)
+            analyzed.append(await _analyze(f, qr_allowed=qr_ok))
         except HTTPException as e:
             errors.append({"filename": f.filename, "error": e.detail})
         except Exception as e:
             errors.append({"filename": f.filename, "error": "İşleme hatası"})
+    ids = await db_async.add_invoices([(p, fn) for fn, p in analyzed], uid)
+    results = [_result(i, fn, p) for i, (fn, p) in zip(ids, analyzed)]
+    if user:
+        for _ in results:
+            await db_async.increment_usage(user["id"])
     return {"count": len(results), "invoices": results, "errors": errors}
 
 
 # ── İnceleme kuyruğu ─────────────────────────────────────
 @router.get("/review-queue")
-def review_queue(page: int = 1, per_page: int = 50):
-    """OCR'nin okuyamadığı / eksik bilgili faturalar."""
-    return get_review_queue(page=page, per_page=per_page)
+def review_queue(request: Request, page: int = 1, per_page: int = 50,
+                 cursor: Optional[str] = None, with_count: bool = True,
+                 fields: Optional[str] = None, legacy: bool = False):
+    """
+    Kullanıcının OCR'nin okuyamadığı / eksik bilgili faturaları (next_cursor / prev_cursor ile sayfalı).
+    fields=id,vendor,total,raw_excerpt → düz satırlar.
+    """
+    return get_review_queue(_uid(request), page=page, per_page=per_page, cursor=cursor,
+                            with_count=with_count, fields=fields, legacy=legacy)
 
 
 # ── Tek fatura getir ──────────────────────────────────────
 @router.get("/invoice/{inv_id}")
-def get_one(inv_id: str):
-    inv = get_invoice(inv_id)
+def get_one(inv_id: str, request: Request):
+    inv = get_invoice(inv_id, _uid(request))
     if not inv:
         raise HTTPException(status_code=404, detail="Fatura bulunamadı.")
     return inv
@@ -273,13 +313,13 @@ def get_one(inv_id: str):
 
 # ── Manuel düzeltme ───────────────────────────────────────
 @router.patch("/invoice/{inv_id}")
-def patch_invoice(inv_id: str, fields: dict = Body(...)):
+def patch_invoice(inv_id: str, request: Request, fields: dict = Body(...)):
     """
     Kullanıcı eksik / yanlış alanları elle düzeltir.
     Kabul edilen alanlar: vendor, date, time, total, vat_rate,
     vat_amount, invoice_number, category, payment_method
     """
-    ok = update_invoice(inv_id, fields)
+    ok = update_invoice(inv_id, fields, _uid(request))
     if not ok:
         raise HTTPException(status_code=404, detail="Fatura bulunamadı veya güncellenemedi.")
     return {"status": "ok", "invoice_id": inv_id, "updated": fields}
@@ -53,6 +53,9 @@ def view_share(
     date_from: Optional[str] = None,
     date_to:   Optional[str] = None,
     vendor:    Optional[str] = None,
+    cursor:    Optional[str] = Query(None, max_length=500),
+    fields:    Optional[str] = Query(None, max_length=300),
+    legacy:    bool          = Query(False),
 ):
     share = get_share_token(token)
     if not share:
@@ -70,7 +73,8 @@ def view_share(
 
     invoices = get_invoices_page(
         page=page, per_page=per_page,
-        user_id=user_id, **params
+        user_id=user_id, cursor=cursor, with_count=cursor is None,
+        fields=fields, legacy=legacy, **params
     )
 
     # Muhasebe defteri özeti
@@ -1,4 +1,4 @@
-from fastapi import APIRouter, Query
+from fastapi import APIRouter, Query, Request, HTTPException
 from fastapi.responses import StreamingResponse
 from datetime import date
 from typing import Optional
@@ -6,13 +6,17 @@ import time
 import io
 import csv
 
-from app.services.invoice_db import query_invoices, iter_rows, get_data, safe_float, get_review_queue
+from app.services.invoice_db import (
+    query_invoices, iter_rows, get_data, safe_float, get_review_queue, FACETS,
+    top_items, item_spend, search_invoices, FTS_FIELDS, get_ledger_page, iter_ledger_rows,
+)
 
 router = APIRouter(prefix="/stats", tags=["Stats"])
 
-# ─── Basit in-memory cache (60 sn TTL) ───────────────────
+# ─── Basit in-memory cache (60 sn TTL, tenant başına) ─────
 _cache: dict = {}
 _CACHE_TTL = 60
+_CACHE_MAX = 2048           # tenant sayısıyla büyümesin: dolunca en eski girdi atılır
 
 
 def _cache_key(*args) -> str:
@@ -24,6 +28,9 @@ def _cached(key: str, fn):
     if key in _cache and now - _cache[key]["ts"] < _CACHE_TTL:
         return _cache[key]["data"]
     result = fn()
+    _cache.pop(key, None)
+    if len(_cache) >= _CACHE_MAX:
+        _cache.pop(next(iter(_cache)))
     _cache[key] = {"ts": now, "data": result}
     return result
 
@@ -32,11 +39,21 @@ def _invalidate():
     _cache.clear()
 
 
+def _uid(request: Request) -> str:
+    """inject_user middleware'inin request.state'e koyduğu kullanıcı."""
+    user = getattr(request.state, "user", None)
+    if not user:
+        raise HTTPException(status_code=401, detail="Oturum açmanız gerekiyor.")
+    return user["id"]
+
+
 # ─── GET /stats/total ─────────────────────────────────────
 @router.get("/total")
-def total():
+def total(request: Request):
+    uid = _uid(request)
+
     def _calc():
-        r = query_invoices(per_page=1)
+        r = query_invoices(uid, per_page=1, include=FACETS)
         return {
             "count":       r["count"],
             "total_sum":   r["total_sum"],
@@ -44,12 +61,13 @@ def total():
             "by_vendor":   r["by_vendor"],
             "by_category": r["by_category"],
         }
-    return _cached("total", _calc)
+    return _cached(_cache_key("total", uid), _calc)
 
 
 # ─── GET /stats/summary  (kombine filtre + pagination) ────
 @router.get("/summary")
 def summary(
+    request:    Request,
     start:      Optional[date]  = Query(None),
     end:        Optional[date]  = Query(None),
     vendor:     Optional[str]   = Query(None, max_length=100),
@@ -60,8 +78,16 @@ def summary(
     max_amount: Optional[float] = Query(None, ge=0),
     page:       int             = Query(1, ge=1),
     per_page:   int             = Query(100, ge=1, le=500),
+    cursor:     Optional[str]   = Query(None, max_length=500),
+    with_count: bool            = Query(True),
+    include:    Optional[str]   = Query(None, max_length=100,
+                                        description="Facet'ler: vendors,categories"),
+    fields:     Optional[str]   = Query(None, max_length=300,
+                                        description="Düz satırlar: id,vendor,total,…"),
+    legacy:     bool            = Query(False, description="Eski iç içe (data) şekil"),
 ):
     r = query_invoices(
+        _uid(request),
         start=str(start) if start else None,
         end=str(end) if end else None,
         vendor=vendor,
@@ -72,6 +98,11 @@ def summary(
         max_amt=max_amount,
         page=page,
         per_page=per_page,
+        cursor=cursor,
+        with_count=with_count,
+        include=include,
+        fields=fields,
+        legacy=legacy,
     )
     return r
 
@@ -79,55 +110,137 @@ def summary(
 # ─── GET /stats/by-date ───────────────────────────────────
 @router.get("/by-date")
 def by_date(
+    request:  Request,
     start:    date = Query(...),
     end:      date = Query(...),
     page:     int  = Query(1, ge=1),
     per_page: int  = Query(100, ge=1, le=500),
+    cursor:   Optional[str] = Query(None, max_length=500),
+    with_count: bool = Query(True),
+    include:  Optional[str] = Query(None, max_length=100),
+    fields:   Optional[str] = Query(None, max_length=300),
+    legacy:   bool          = Query(False),
 ):
-    r = query_invoices(start=str(start), end=str(end), page=page, per_page=per_page)
+    r = query_invoices(_uid(request), start=str(start), end=str(end), page=page, per_page=per_page,
+                       cursor=cursor, with_count=with_count, include=include,
+                       fields=fields, legacy=legacy)
     return {"start": str(start), "end": str(end), **r}
 
 
 # ─── GET /stats/by-vendor ─────────────────────────────────
 @router.get("/by-vendor")
 def by_vendor(
+    request:  Request,
     vendor:   str = Query(..., max_length=100),
     page:     int = Query(1, ge=1),
     per_page: int = Query(100, ge=1, le=500),
+    cursor:   Optional[str] = Query(None, max_length=500),
+    with_count: bool = Query(True),
+    include:  Optional[str] = Query(None, max_length=100),
+    fields:   Optional[str] = Query(None, max_length=300),
+    legacy:   bool          = Query(False),
 ):
-    r = query_invoices(vendor=vendor, page=page, per_page=per_page)
+    r = query_invoices(_uid(request), vendor=vendor, page=page, per_page=per_page,
+                       cursor=cursor, with_count=with_count, include=include,
+                       fields=fields, legacy=legacy)
     return {"vendor": vendor, **r}
 
 
 # ─── GET /stats/by-category ───────────────────────────────
 @router.get("/by-category")
 def by_category(
+    request:  Request,
     category: str = Query(..., max_length=50),
     page:     int = Query(1, ge=1),
     per_page: int = Query(100, ge=1, le=500),
+    cursor:   Optional[str] = Query(None, max_length=500),
+    with_count: bool = Query(True),
+    include:  Optional[str] = Query(None, max_length=100),
+    fields:   Optional[str] = Query(None, max_length=300),
+    legacy:   bool          = Query(False),
 ):
-    r = query_invoices(category=category, page=page, per_page=per_page)
+    r = query_invoices(_uid(request), category=category, page=page, per_page=per_page,
+                       cursor=cursor, with_count=with_count, include=include,
+                       fields=fields, legacy=legacy)
     return {"category": category, **r}
 
 
 # ─── GET /stats/by-payment ────────────────────────────────
 @router.get("/by-payment")
 def by_payment(
+    request:  Request,
     method:   str = Query(..., max_length=50),
     page:     int = Query(1, ge=1),
     per_page: int = Query(100, ge=1, le=500),
+    cursor:   Optional[str] = Query(None, max_length=500),
+    with_count: bool = Query(True),
+    include:  Optional[str] = Query(None, max_length=100),
+    fields:   Optional[str] = Query(None, max_length=300),
+    legacy:   bool          = Query(False),
 ):
-    r = query_invoices(payment=method, page=page, per_page=per_page)
+    r = query_invoices(_uid(request), payment=method, page=page, per_page=per_page,
+                       cursor=cursor, with_count=with_count, include=include,
+                       fields=fields, legacy=legacy)
     return {"payment_method": method, **r}
 
 
 # ─── GET /stats/by-invoice-no ─────────────────────────────
 @router.get("/by-invoice-no")
-def by_invoice_no(invoice_no: str = Query(..., max_length=100)):
-    r = query_invoices(invoice_no=invoice_no, per_page=200)
+def by_invoice_no(request: Request, invoice_no: str = Query(..., max_length=100)):
+    r = query_invoices(_uid(request), invoice_no=invoice_no, per_page=200)
     return {"invoice_no": invoice_no, "count": r["count"], "invoices": r["invoices"]}
 
 
+# ─── GET /stats/search  (tam metin, bm25 sıralı) ─────────
+@router.get("/search")
+def search(
+    request:    Request,
+    q:          str           = Query(..., min_length=1, max_length=200),
+    field:      Optional[str] = Query(None, description="vendor | invoice_no | category | text"),
+    page:       int           = Query(1, ge=1, le=500),
+    per_page:   int           = Query(20, ge=1, le=100),
+    with_count: bool          = Query(True),
+):
+    if field and field not in FTS_FIELDS:
+        raise HTTPException(status_code=400, detail="Geçersiz arama alanı.")
+    r = search_invoices(_uid(request), q, field=field,
+                        page=page, per_page=per_page, with_count=with_count)
+    if r is None:
+        raise HTTPException(status_code=400, detail="Arama için en az 3 karakterlik bir kelime girin.")
+    return r
+
+
+# ─── GET /stats/items/top  (en çok harcanan ürünler) ──────
+@router.get("/items/top")
+def items_top(
+    request: Request,
+    start: Optional[date] = Query(None),
+    end:   Optional[date] = Query(None),
+    limit: int            = Query(20, ge=1, le=200),
+):
+    return top_items(
+        _uid(request),
+        date_from=str(start) if start else None,
+        date_to=str(end) if end else None,
+        limit=limit,
+    )
+
+
+# ─── GET /stats/items/spend  (tek ürün, aylık) ────────────
+@router.get("/items/spend")
+def items_spend(
+    request: Request,
+    name:  str            = Query(..., min_length=2, max_length=200),
+    start: Optional[date] = Query(None),
+    end:   Optional[date] = Query(None),
+):
+    return item_spend(
+        _uid(request), name,
+        date_from=str(start) if start else None,
+        date_to=str(end) if end else None,
+    )
+
+
 # ─── GET /stats/export/excel  ─────────────────────────────
 # openpyxl write_only = streaming writer — RAM sabit (N→∞)
 # Excel hard limit: 1.048.576 satır → aşıldığında CSV önerilir
@@ -135,6 +248,7 @@ _EXCEL_ROW_LIMIT = 1_048_575  # başlık satırı hariç
 
 @router.get("/export/excel")
 def export_excel(
+    request:    Request,
     start:      Optional[date]  = Query(None),
     end:        Optional[date]  = Query(None),
     vendor:     Optional[str]   = Query(None, max_length=100),
@@ -151,6 +265,7 @@ def export_excel(
         return JSONResponse({"error": "openpyxl kurulu değil"}, status_code=500)
 
     kwargs = dict(
+        user_id=_uid(request),
         start=str(start) if start else None,
         end=str(end) if end else None,
         vendor=vendor,
@@ -179,7 +294,7 @@ def export_excel(
 
     written = 0
     truncated = False
-    for row in iter_rows(**kwargs):
+    for row in iter_rows(**kwargs, blobs=("qr_raw",)):
         if written >= _EXCEL_ROW_LIMIT:
             truncated = True
             break
@@ -214,6 +329,7 @@ def export_excel(
 # ─── GET /stats/export/csv  (true streaming, sınır yok) ───
 @router.get("/export/csv")
 def export_csv(
+    request:    Request,
     start:      Optional[date]  = Query(None),
     end:        Optional[date]  = Query(None),
     vendor:     Optional[str]   = Query(None, max_length=100),
@@ -225,6 +341,7 @@ def export_csv(
     """HTTP chunked streaming CSV — 100M satırda RAM kullanımı sabit (~2 MB)."""
 
     kwargs = dict(
+        user_id=_uid(request),
         start=str(start) if start else None,
         end=str(end) if end else None,
         vendor=vendor,
@@ -242,7 +359,7 @@ def export_csv(
                          "Odeme", "QR", "Timestamp"])
         yield buf.getvalue()
 
-        for row in iter_rows(**kwargs):
+        for row in iter_rows(**kwargs, blobs=("qr_raw",)):
             buf = io.StringIO()
             writer = csv.writer(buf)
             writer.writerow([
@@ -267,8 +384,9 @@ def export_csv(
 
 # ─── GET /stats/export/review-queue-excel  (sadece inceleme bekleyenler) ───
 @router.get("/export/review-queue-excel")
-def export_review_queue_excel():
-    """needs_review=1 olan faturaları Excel olarak indir."""
+def export_review_queue_excel(request: Request):
+    """Kullanıcının needs_review=1 faturalarını Excel olarak indir."""
+    uid = _uid(request)
     try:
         import openpyxl
         from openpyxl.styles import PatternFill, Font, Alignment
@@ -296,10 +414,10 @@ def export_review_queue_excel():
         hdr_cells.append(cell)
     ws.append(hdr_cells)
 
-    page, per_page = 1, 1000
+    cursor, per_page = None, 1000
     written = 0
     while True:
-        result = get_review_queue(page=page, per_page=per_page)
+        result = get_review_queue(uid, per_page=per_page, cursor=cursor, with_count=False)
         rows = result.get("invoices", [])
         if not rows:
             break
@@ -313,9 +431,9 @@ def export_review_queue_excel():
                 row.get("review_reason") or "", row.get("timestamp") or "",
             ])
             written += 1
-        if page >= result.get("pages", 1):
+        cursor = result["next_cursor"]
+        if not cursor:
             break
-        page += 1
 
     if written == 0:
         summary = openpyxl.cell.WriteOnlyCell(ws, value="İnceleme bekleyen fatura yok.")
@@ -335,8 +453,9 @@ def export_review_queue_excel():
 
 # ─── GET /stats/export/review-queue-csv  (streaming, sınırsız) ───
 @router.get("/export/review-queue-csv")
-def export_review_queue_csv():
-    """needs_review=1 olan tüm faturaları CSV olarak akış halinde indir."""
+def export_review_queue_csv(request: Request):
+    """Kullanıcının needs_review=1 faturalarının tümünü CSV olarak akış halinde indir."""
+    uid = _uid(request)
     from datetime import date as _date
     today = _date.today().isoformat()
 
@@ -348,9 +467,9 @@ def export_review_queue_csv():
                          "Odeme", "Inceleme_Nedeni", "Timestamp"])
         yield buf.getvalue()
 
-        page, per_page = 1, 2000
+        cursor, per_page = None, 2000
         while True:
-            result = get_review_queue(page=page, per_page=per_page)
+            result = get_review_queue(uid, per_page=per_page, cursor=cursor, with_count=False)
             rows = result.get("invoices", [])
             if not rows:
                 break
@@ -366,9 +485,9 @@ def export_review_queue_csv():
                     row.get("review_reason") or "", row.get("timestamp") or "",
                 ])
                 yield buf2.getvalue()
-            if page >= result.get("pages", 1):
+            cursor = result["next_cursor"]
+            if not cursor:
                 break
-            page += 1
 
     fname = f"autotax_inceleme_bekleyen_{today}.csv"
     return StreamingResponse(
@@ -384,122 +503,27 @@ def export_review_queue_csv():
 # ─── GET /stats/ledger  (Muhasebe Defteri) ─────────────────────────────────
 @router.get("/ledger")
 def ledger(
+    request: Request,
     start:  Optional[str] = Query(None),
     end:    Optional[str] = Query(None),
     vendor: Optional[str] = Query(None),
     page:   int = Query(1,  ge=1),
     per_page: int = Query(50, ge=1, le=500),
+    cursor:   Optional[str] = Query(None, max_length=500),
+    with_count: bool = Query(True),
 ):
-    """Gelir + Gider muhasebe defteri. NET bakiyeyi de hesaplar."""
-    import sqlite3
-    from app.services.invoice_db import DB_PATH
-
-    conditions = []
-    params: list = []
-
-    if start:
-        conditions.append("date >= ?"); params.append(start)
-    if end:
-        conditions.append("date <= ?"); params.append(end)
-    if vendor:
-        conditions.append("vendor LIKE ?"); params.append(f"%{vendor}%")
-
-    where = ("WHERE " + " AND ".join(conditions)) if conditions else ""
-
-    with sqlite3.connect(str(DB_PATH)) as con:
-        con.row_factory = sqlite3.Row
-
-        # Toplam sayı
-        total = con.execute(
-            f"SELECT COUNT(*) FROM invoices {where}", params
-        ).fetchone()[0]
-
-        # Gelir / Gider özeti
-        agg = con.execute(f"""
-            SELECT
-                COALESCE(SUM(CASE WHEN invoice_type='income'  THEN total ELSE 0 END), 0) AS total_income,
-                COALESCE(SUM(CASE WHEN invoice_type='expense' THEN total ELSE 0 END), 0) AS total_expense,
-                COALESCE(SUM(CASE WHEN invoice_type='income'  THEN vat_amount ELSE 0 END), 0) AS vat_income,
-                COALESCE(SUM(CASE WHEN invoice_type='expense' THEN vat_amount ELSE 0 END), 0) AS vat_expense,
-                COUNT(CASE WHEN invoice_type='income'  THEN 1 END) AS count_income,
-                COUNT(CASE WHEN invoice_type='expense' THEN 1 END) AS count_expense
-            FROM invoices {where}
-        """, params).fetchone()
-
-        # Aylık özet
-        monthly = con.execute(f"""
-            SELECT
-                SUBSTR(date,1,7) AS month,
-                COALESCE(SUM(CASE WHEN invoice_type='income'  THEN total ELSE 0 END),0) AS income,
-                COALESCE(SUM(CASE WHEN invoice_type='expense' THEN total ELSE 0 END),0) AS expense,
-                COUNT(*) AS count
-            FROM invoices {where}
-            GROUP BY SUBSTR(date,1,7)
-            ORDER BY month DESC
-        """, params).fetchall()
-
-        # Sayfalı fatura listesi
-        offset = (page - 1) * per_page
-        rows = con.execute(
-            f"""SELECT id, filename, vendor, date, time, total, vat_amount,
-                       invoice_number, category, payment_method, invoice_type,
-                       needs_review, timestamp
-                FROM invoices {where}
-                ORDER BY date DESC, timestamp DESC
-                LIMIT ? OFFSET ?""",
-            params + [per_page, offset]
-        ).fetchall()
-
-    total_income  = round(float(agg["total_income"]),  2)
-    total_expense = round(float(agg["total_expense"]), 2)
-    net           = round(total_income - total_expense, 2)
-
-    return {
-        "count":         total,
-        "page":          page,
-        "per_page":      per_page,
-        "pages":         max(1, -(-total // per_page)),
-        "total_income":  total_income,
-        "total_expense": total_expense,
-        "vat_income":    round(float(agg["vat_income"]),  2),
-        "vat_expense":   round(float(agg["vat_expense"]), 2),
-        "count_income":  agg["count_income"],
-        "count_expense": agg["count_expense"],
-        "net":           net,
-        "net_label":     "KAR" if net >= 0 else "ZARAR",
-        "monthly": [
-            {
-                "month":   r["month"],
-                "income":  round(float(r["income"]),  2),
-                "expense": round(float(r["expense"]), 2),
-                "net":     round(float(r["income"]) - float(r["expense"]), 2),
-                "count":   r["count"],
-            }
-            for r in monthly
-        ],
-        "invoices": [
-            {
-                "id":             r["id"],
-                "vendor":         r["vendor"] or "",
-                "date":           r["date"] or "",
-                "time":           r["time"] or "",
-                "total":          r["total"],
-                "vat_amount":     r["vat_amount"],
-                "invoice_number": r["invoice_number"] or "",
-                "category":       r["category"] or "",
-                "payment_method": r["payment_method"] or "",
-                "invoice_type":   r["invoice_type"] or "expense",
-                "needs_review":   bool(r["needs_review"]),
-                "filename":       r["filename"] or "",
-            }
-            for r in rows
-        ],
-    }
+    """
+    Gelir + Gider muhasebe defteri. NET bakiyeyi de hesaplar.
+    Sayfalar (date, timestamp, id) cursor'ı ile ilerler; with_count=false →
+    sayım ve özetler atlanır (sonraki sayfalarda tekrar hesaplanmaz).
+    """
+    return get_ledger_page(_uid(request), start, end, vendor, page, per_page, cursor, with_count)
 
 
 # ─── GET /stats/export/ledger-excel  (Muhasebe defteri Excel) ───────────────
 @router.get("/export/ledger-excel")
 def export_ledger_excel(
+    request: Request,
     start:  Optional[str] = Query(None),
     end:    Optional[str] = Query(None),
     vendor: Optional[str] = Query(None),
@@ -515,7 +539,8 @@ def export_ledger_excel(
     from datetime import date as _date
     today = _date.today().isoformat()
 
-    data = ledger(start=start, end=end, vendor=vendor, page=1, per_page=1)
+    data = ledger(request, start=start, end=end, vendor=vendor, page=1, per_page=1,
+                  cursor=None, with_count=True)
 
     wb = openpyxl.Workbook(write_only=True)
     ws = wb.create_sheet("Muhasebe Defteri")
@@ -560,20 +585,8 @@ def export_ledger_excel(
         for h in ["Tür", "Tarih", "Firma", "Tutar", "KDV", "Kategori", "Ödeme", "Fatura No"]
     ])
 
-    # Tüm sayfalarda fatura yaz
-    import sqlite3
-    from app.services.invoice_db import DB_PATH
-    conditions, params = [], []
-    if start:  conditions.append("date >= ?"); params.append(start)
-    if end:    conditions.append("date <= ?"); params.append(end)
-    if vendor: conditions.append("vendor LIKE ?"); params.append(f"%{vendor}%")
-    where = ("WHERE " + " AND ".join(conditions)) if conditions else ""
-
-    with sqlite3.connect(str(DB_PATH)) as con:
-        con.row_factory = sqlite3.Row
-        rows = con.execute(
-            f"SELECT * FROM invoices {where} ORDER BY date DESC", params
-        ).fetchall()
+    # Tüm faturalar (sayfasız, sabit RAM)
+    rows = iter_ledger_rows(_uid(request), start, end, vendor)
 
     for r in rows:
         typ  = "GELİR" if r["invoice_type"] == "income" else "GİDER"
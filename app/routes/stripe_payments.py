@@ -82,7 +82,7 @@ async def stripe_webhook(request: Request):
     except stripe.error.SignatureVerificationError:
         raise HTTPException(status_code=400, detail="Webhook imzası geçersiz.")
 
-    from app.services.user_db import update_user_plan
+    from app.services.db_async import update_user_plan
 
     if event["type"] == "checkout.session.completed":
         session  = event["data"]["object"]
@@ -90,14 +90,14 @@ async def stripe_webhook(request: Request):
         plan     = session.get("metadata", {}).get("plan", "pro")
         sub_id   = session.get("subscription")
         if user_id:
-            update_user_plan(user_id, plan, sub_id)
+            await update_user_plan(user_id, plan, sub_id)
 
     elif event["type"] in ("customer.subscription.deleted", "customer.subscription.paused"):
         sub      = event["data"]["object"]
         meta     = sub.get("metadata", {})
         user_id  = meta.get("user_id")
         if user_id:
-            update_user_plan(user_id, "free", None)
+            await update_user_plan(user_id, "free", None)
 
     elif event["type"] == "customer.subscription.updated":
         sub      = event["data"]["object"]
@@ -106,7 +106,7 @@ async def stripe_webhook(request: Request):
         status   = sub.get("status")
         if user_id and status == "active":
             plan = meta.get("plan", "pro")
-            update_user_plan(user_id, plan, sub["id"])
+            await update_user_plan(user_id, plan, sub["id"])
 
     return {"status": "ok"}
 
@@ -118,8 +118,8 @@ async def get_plan(request: Request):
     user    = get_current_user(request)
     user_id = user["sub"]
 
-    from app.services.user_db import get_user_by_id
-    db_user = get_user_by_id(user_id)
+    from app.services.db_async import get_user_by_id
+    db_user = await get_user_by_id(user_id)
     plan      = db_user.get("plan", "free") if db_user else "free"
     plan_data = _PLANS.get(plan, _PLANS["free"])
     limits = {
@@ -145,8 +145,8 @@ async def cancel_subscription(request: Request):
     user    = get_current_user(request)
     user_id = user["sub"]
 
-    from app.services.user_db import get_user_by_id, update_user_plan
-    db_user = get_user_by_id(user_id)
+    from app.services.db_async import get_user_by_id
+    db_user = await get_user_by_id(user_id)
     sub_id  = db_user.get("stripe_subscription_id") if db_user else None
 
     if not sub_id:
@@ -2,29 +2,23 @@
 from fastapi import APIRouter, Request, Query
 from fastapi.responses import StreamingResponse
 from typing   import Optional
-import io, csv, re
+import io, csv, re, calendar
 from datetime import datetime
-from pathlib  import Path
 from app.routes.auth import get_current_user
-from app.config      import settings
+from app.services.invoice_db import fan_out, month_span, partitions, rollup_where
 
 router = APIRouter(prefix="/tax", tags=["Tax"])
 
-_MONTH_RE   = re.compile(r"^\d{4}-\d{2}$")
-_SQLITE_PATH = Path(settings.SQLITE_PATH)
+_MONTH_RE   = re.compile(r"^\d{4}-(0[1-9]|1[0-2])$")
 
 
 def _uid(request: Request) -> str:
-    return get_current_user(request)["sub"]
-
-
-def _inv_conn():
-    import sqlite3
-    c = sqlite3.connect(str(_SQLITE_PATH), check_same_thread=False)
-    c.row_factory = sqlite3.Row
-    c.execute("PRAGMA journal_mode=WAL")
-    c.execute("PRAGMA synchronous=NORMAL")
-    return c
+    # inject_user middleware'i kullanıcıyı request.state'e koyar
+    user = getattr(request.state, "user", None)
+    if not user:
+        from fastapi import HTTPException
+        raise HTTPException(401, "Oturum açmanız gerekiyor.")
+    return user["id"]
 
 
 def _validate_month(month: str) -> str:
@@ -37,70 +31,67 @@ def _validate_month(month: str) -> str:
 
 def _build_report(user_id: str, year: int, quarter: int = None,
                   month: str = None) -> dict:
-    params: list = [user_id]
-
-    # Dönem filtresi — tümü parametrik
-    if month:
-        _validate_month(month)
-        date_filter = "strftime('%Y-%m', date) = ?"
-        params.append(month)
-    elif quarter:
-        q_map = {1: ("01","03"), 2: ("04","06"), 3: ("07","09"), 4: ("10","12")}
-        m_start, m_end = q_map.get(quarter, ("01","12"))
-        date_filter = "date >= ? AND date <= ?"
-        params.append(f"{year}-{m_start}-01")
-        params.append(f"{year}-{m_end}-31")
-    else:
-        date_filter = "strftime('%Y', date) = ?"
-        params.append(str(year))
-
-    base = f"WHERE user_id=? AND ({date_filter}) AND total IS NOT NULL"
-
-    with _inv_conn() as c:
+    # Dönemler hep ay sınırında → aylık rollup'tan (invoice_db "AYLIK ROLLUP");
+    # fatura sayısından bağımsız, tenant + ay aralığı PK üzerinden SEARCH.
+    # Dönemin yılı arşivlendiyse arşiv dosyası da okunur: tutarlar kuruş olarak
+    # dosya başına toplanır, birleştirildikten sonra €'ya çevrilir
+    date_from, date_to = _period_range(year, quarter, month)
+    where, params = rollup_where(user_id, month_span(date_from, date_to))
+    base = "WHERE " + " AND ".join(where) + " AND priced > 0"
+    sums = ("SUM(priced) as count, SUM(gross_cents) as gross, SUM(priced_vat_cents) as vat, "
+            "SUM(gross_cents - priced_vat_cents) as net")
+
+    def _read(c):
         # Genel özet
-        summary = c.execute(
-            f"SELECT COUNT(*) as invoice_count, "
-            f"COALESCE(SUM(total),0) as gross_total, "
-            f"COALESCE(SUM(vat_amount),0) as total_vat, "
-            f"COALESCE(SUM(total - COALESCE(vat_amount,0)),0) as net_total "
-            f"FROM invoices {base}",
-            params
-        ).fetchone()
-
-        # KDV oranı bazlı gruplandırma
+        summary = c.execute(f"SELECT {sums} FROM invoice_rollup {base}", params).fetchone()
+        # KDV oranı bazlı gruplandırma (-1 = oran yok)
         by_rate = c.execute(
-            f"SELECT COALESCE(vat_rate,'Bilinmiyor') as vat_rate, "
-            f"COUNT(*) as count, COALESCE(SUM(total),0) as gross, "
-            f"COALESCE(SUM(vat_amount),0) as vat, "
-            f"COALESCE(SUM(total - COALESCE(vat_amount,0)),0) as net "
-            f"FROM invoices {base} GROUP BY vat_rate ORDER BY vat_rate",
+            f"SELECT CASE WHEN vat_rate = -1 THEN 'Bilinmiyor' ELSE vat_rate END as vat_rate, {sums} "
+            f"FROM invoice_rollup {base} GROUP BY vat_rate",
             params
         ).fetchall()
-
         # Aylık dağılım
         by_month = c.execute(
-            f"SELECT strftime('%Y-%m', date) as month, COUNT(*) as count, "
-            f"COALESCE(SUM(total),0) as gross, COALESCE(SUM(vat_amount),0) as vat "
-            f"FROM invoices {base} GROUP BY month ORDER BY month",
+            f"SELECT printf('%04d-%02d', month / 100, month % 100) as month, {sums} "
+            f"FROM invoice_rollup {base} GROUP BY 1",
             params
         ).fetchall()
-
-        # Kategori bazlı (ilk 20)
+        # Kategori bazlı (birleştirmeden sonra ilk 20)
         by_cat = c.execute(
-            f"SELECT COALESCE(category,'Diğer') as category, COUNT(*) as count, "
-            f"COALESCE(SUM(total),0) as gross, COALESCE(SUM(vat_amount),0) as vat "
-            f"FROM invoices {base} GROUP BY category ORDER BY gross DESC LIMIT 20",
+            f"SELECT COALESCE(NULLIF(k.label,''),'Diğer') as category, {sums} "
+            f"FROM invoice_rollup LEFT JOIN codes k ON k.field='category' AND k.code=cat_code "
+            f"{base} GROUP BY 1",
             params
         ).fetchall()
+        return summary, by_rate, by_month, by_cat
+
+    y0, y1 = int(date_from[:4]), int(date_to[:4])
+    totals = {"count": 0, "gross": 0, "vat": 0, "net": 0}
+    rates, months, cats = {}, {}, {}
+    for summary, by_rate, by_month, by_cat in fan_out(_read, partitions(user_id, y0, y1)):
+        for k in totals:
+            totals[k] += summary[k] or 0
+        for groups, rows, key in ((rates, by_rate, "vat_rate"), (months, by_month, "month"),
+                                  (cats, by_cat, "category")):
+            for r in rows:
+                g = groups.setdefault(r[key], dict.fromkeys(totals, 0))
+                for k in g:
+                    g[k] += r[k]
+
+    def _eur(key, value, g, cols=("count", "gross", "vat", "net")):
+        return {key: value, **{k: g[k] if k == "count" else g[k] / 100.0 for k in cols}}
 
     period_label = month or (f"Q{quarter}/{year}" if quarter else str(year))
     return {
         "period":      period_label,
         "generated":   datetime.utcnow().isoformat()[:19],
-        "summary":     dict(summary),
-        "by_vat_rate": [dict(r) for r in by_rate],
-        "by_month":    [dict(r) for r in by_month],
-        "by_category": [dict(r) for r in by_cat],
+        "summary":     {"invoice_count": totals["count"], "gross_total": totals["gross"] / 100.0,
+                        "total_vat": totals["vat"] / 100.0, "net_total": totals["net"] / 100.0},
+        "by_vat_rate": [_eur("vat_rate", k, g) for k, g in
+                        sorted(rates.items(), key=lambda kv: (isinstance(kv[0], str), kv[0]))],
+        "by_month":    [_eur("month", k, g, ("count", "gross", "vat")) for k, g in sorted(months.items())],
+        "by_category": [_eur("category", k, g, ("count", "gross", "vat")) for k, g in
+                        sorted(cats.items(), key=lambda kv: kv[1]["gross"], reverse=True)[:20]],
     }
 
 
@@ -116,6 +107,37 @@ def tax_report(
     return _build_report(_uid(request), year, quarter, month)
 
 
+def _period_range(year: int, quarter: int = None, month: str = None) -> tuple[str, str]:
+    """Dönem → (başlangıç, bitiş) ISO tarih aralığı (bitiş: ayın gerçek son günü)."""
+    if month:
+        _validate_month(month)
+        y, m = (int(x) for x in month.split("-"))
+        return f"{month}-01", f"{month}-{calendar.monthrange(y, m)[1]:02d}"
+    if quarter:
+        q_map = {1: ("01","03"), 2: ("04","06"), 3: ("07","09"), 4: ("10","12")}
+        m_start, m_end = q_map.get(quarter, ("01","12"))
+        return f"{year}-{m_start}-01", f"{year}-{m_end}-{calendar.monthrange(year, int(m_end))[1]:02d}"
+    return f"{year}-01-01", f"{year}-12-31"
+
+
+@router.get("/vat-split")
+def tax_vat_split(
+    request: Request,
+    year:    int = Query(default=None),
+    quarter: Optional[int] = Query(None, ge=1, le=4),
+    month:   Optional[str] = Query(None, description="YYYY-MM"),
+):
+    """Satır düzeyinde KDV oranı dağılımı (%7 / %19 ...) — UStVA için."""
+    from app.services.invoice_db import vat_split
+    if not year:
+        year = datetime.utcnow().year
+    date_from, date_to = _period_range(year, quarter, month)
+    return {
+        "period":  month or (f"Q{quarter}/{year}" if quarter else str(year)),
+        "by_rate": vat_split(_uid(request), date_from, date_to),
+    }
+
+
 @router.get("/report/csv")
 def tax_report_csv(
     request: Request,
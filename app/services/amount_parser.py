@@ -1,25 +1,14 @@
-import re
 from typing import Optional
 
-PRIORITY_WORDS = [
-    # English
-    "total", "amount due", "grand total",
+from app.services import money_tokens
+from app.services.money_tokens import money, parse_amount
 
-    # German
-    "gesamt", "gesamtbetrag", "betrag", "summe",
-    "endbetrag", "zu zahlen", "brutto",
+# Token'ın satırındaki bu KEYWORDS grupları önceliklidir
+# (total, amount due, gesamt, summe, montant, importe, toplam, ödenecek …)
+PRIORITY_GROUPS = {"total", "grand_total"}
 
-    # French
-    "total ttc", "montant", "payé",
-
-    # Spanish
-    "total", "importe", "importe total",
-
-    # Turkish
-    "toplam", "genel toplam", "tutar", "ödenecek"
-]
-
-money_pattern = r"\d{1,3}(?:[.,]\d{3})*(?:[.,]\d{2})"
+# Sadece son N satır (genelde total altta olur)
+TAIL_LINES = 40
 
 
 def normalize_amount(value: str) -> Optional[float]:
@@ -28,57 +17,22 @@ def normalize_amount(value: str) -> Optional[float]:
     1,234.56
     1234,56
     1234.56
-    hepsini doğru parse eder
+    hepsini doğru parse eder (money_tokens ile aynı kural)
     """
-    value = value.strip()
-
-    if "," in value and "." in value:
-        # Hangisi decimal?
-        if value.rfind(",") > value.rfind("."):
-            # 1.234,56
-            value = value.replace(".", "").replace(",", ".")
-        else:
-            # 1,234.56
-            value = value.replace(",", "")
-    elif "," in value:
-        value = value.replace(",", ".")
-    else:
-        value = value
-
-    try:
-        return float(value)
-    except ValueError:
-        return None
+    return parse_amount(value)
 
 
 def extract_total_amount(text: str) -> Optional[float]:
-    lines = text.lower().splitlines()
-
-    candidates = []
-    priority_candidates = []
-
-    # 🔥 sadece son 40 satır (genelde total altta olur)
-    lines = lines[-40:]
-
-    for line in lines:
-        matches = re.findall(money_pattern, line)
-
-        for m in matches:
-            value = normalize_amount(m)
-            if value is None:
-                continue
-
-            candidates.append(value)
-
-            if any(word in line for word in PRIORITY_WORDS):
-                priority_candidates.append(value)
+    toks = money(text)
+    if not toks:
+        return None
+    first = text.count("\n", 0, min(len(text), money_tokens.MAX_TEXT)) + 1 - TAIL_LINES
+    toks  = [t for t in toks if t.line >= first]
 
     # Önce keyword eşleşenler
-    if priority_candidates:
-        return max(priority_candidates)
+    priority = [t.value for t in toks if t.keywords & PRIORITY_GROUPS]
+    if priority:
+        return max(priority)
 
     # Yoksa en büyük değer (fallback)
-    if candidates:
-        return max(candidates)
-
-    return None
\ No newline at end of file
+    return max((t.value for t in toks), default=None)
@@ -0,0 +1,244 @@
+"""
+AutoTax.cloud — Yıl bazlı sıcak / soğuk fatura depolaması (arşiv)
+Sıcak shard'lar sadece son ARCHIVE_HOT_YEARS yılı tutar; daha eski yıllar yıl
+başına tek dosyaya (ARCHIVE_DIR/invoices.y<yıl>.db) taşınır. Sıcak dosyalar küçük
+kalır → günlük okuma / yazmanın çalışma kümesi page cache'e sığar; eski yıllar
+sadece tarih aralığı onlara değen sorgularda açılır (bkz. invoice_db "Arşiv").
+
+  • Yıl önce archive_years'a "copying" olarak yazılır → taşıma boyunca sorgular
+    arşiv dosyasını da okur, taşınan satır iki dosya arasında görünmez olmaz
+  • Shard başına ARCHIVE_BATCH'lik batch'ler shard kilidi altında: kopya arşivde
+    commit edilir, sonra sıcak kopya silinir (kopya idempotent → kesilirse sürer;
+    iki commit arasında çökme o batch'i sonraki çalıştırmaya kadar iki kez sayar)
+  • Sadece dosyası retention ile silinmiş (filename NULL) faturalar taşınır → dosya
+    yaşam döngüsü sıcakta tamamlanır; tarihsiz ve silinmekte olan tenant'ların
+    faturaları sıcakta kalır
+  • Sonra sıkıştırma: FTS boşaltılır, VACUUM (boş sayfa kalmaz), FTS yeniden kurulur
+    + optimize, ANALYZE. journal_mode=DELETE → tek dosya, salt okunur açılır,
+    değişmediği sürece gece yedeğinde hard link'lenir
+  • Aynı yıla sonradan düşen faturalar (eski fiş yüklemesi) sonraki çalıştırmada eklenir
+  • Job sonunda sıcak shard'larda ANALYZE + incremental vacuum (bkz. maintenance.py)
+
+Kullanım:
+    python -m app.services.archive              # durum
+    python -m app.services.archive --run        # vadesi gelen yılları arşivle
+    python -m app.services.archive --year 2021  # tek yıl
+"""
+import json
+import logging
+import sqlite3
+import threading
+import time
+from datetime import date, datetime
+
+from app.config import settings
+from app.services import maintenance, schema, sharding
+from app.services import invoice_db as idb
+
+logger = logging.getLogger("autotax.archive")
+
+_RUN_LOCK = threading.Lock()
+_progress = {"running": False, "year": None, "invoices": 0,
+             "started_at": None, "finished_at": None, "error": None}
+
+
+# ── Yıllar ────────────────────────────────────────────────
+def last_archivable_year(today: date = None) -> int:
+    """Bu yıldan (dahil) eskiler arşivlenebilir: ARCHIVE_HOT_YEARS yıl sıcakta kalır."""
+    return (today or date.today()).year - max(1, settings.ARCHIVE_HOT_YEARS)
+
+
+def _bounds(year: int) -> tuple[int, int]:
+    """Yılın ilk / son günü → gün numarası (invoices.day)."""
+    return idb.day_number(date(year, 1, 1)), idb.day_number(date(year, 12, 31))
+
+
+def due_years(today: date = None) -> list[int]:
+    """Sıcak shard'larda taşınabilir faturası olan arşivlik yıllar (idx_day üzerinden)."""
+    last = last_archivable_year(today)
+    years = set()
+    for sh in idb.SHARDS:
+        c = sh.conn()
+        first = c.execute("SELECT MIN(day) FROM invoices WHERE day IS NOT NULL").fetchone()[0]
+        if first is None:
+            continue
+        for year in range(date.fromordinal(first + idb._EPOCH).year, last + 1):
+            if year not in years and c.execute(
+                    f"SELECT 1 FROM invoices WHERE day BETWEEN ? AND ? "
+                    f"AND filename IS NULL AND {idb.LIVE} LIMIT 1", _bounds(year)).fetchone():
+                years.add(year)
+    return sorted(years)
+
+
+def _unfinished() -> list[int]:
+    return [y for (y,) in idb._conn().execute(
+        "SELECT year FROM archive_years WHERE status <> 'done'")]
+
+
+def _set(year: int, status: str, **fields) -> None:
+    """archive_years kaydı (yoksa oluştur)."""
+    now = datetime.now().isoformat()
+    cols = {"status": status, "updated_at": now, "error": None, **fields}
+    with idb._LOCK:
+        with idb._conn() as c:
+            c.execute("INSERT OR IGNORE INTO archive_years (year, status, created_at) VALUES (?,?,?)",
+                      (year, status, now))
+            c.execute(f"UPDATE archive_years SET {', '.join(f'{k}=?' for k in cols)} WHERE year=?",
+                      (*cols.values(), year))
+
+
+# ── Arşiv dosyası ─────────────────────────────────────────
+def _create_schema(c) -> None:
+    c.execute("PRAGMA journal_mode=DELETE")
+    c.executescript(idb._DDL)
+    if idb.FTS_TOKENIZER:
+        tok = "unicode61 remove_diacritics 2" if idb.FTS_TOKENIZER == "unicode61" else idb.FTS_TOKENIZER
+        c.executescript(idb._fts_ddl(tok))
+    c.executescript(idb._rollup_ddl())
+
+
+def _open(year: int) -> idb.Archive:
+    """Arşiv dosyasını (şema) hazırla ve kaydet → sorgular bu yılı okumaya başlar."""
+    path = idb.archive_path(year)
+    path.parent.mkdir(parents=True, exist_ok=True)
+    c = sqlite3.connect(path)
+    try:
+        schema.ensure(c, "invoices", idb.SCHEMA_VERSION, _create_schema)
+    finally:
+        c.close()
+    _set(year, "copying")
+    return idb.archives(year, year)[0]
+
+
+def _move_shard(sh, a: idb.Archive, batch: int, pause: float) -> int:
+    """Shard'daki yılın faturalarını arşive taşı; taşınan fatura sayısı."""
+    d0, d1 = _bounds(a.year)
+    moved = 0
+    dst = a.connect_rw()
+    try:
+        while True:
+            # Shard kilidi: kopya ile silme arasında bu faturalara yazma (güncelleme) girmez
+            with sh.lock, a.lock:
+                src = sh.conn()
+                ids = [r[0] for r in src.execute(
+                    f"SELECT id FROM invoices WHERE day BETWEEN ? AND ? "
+                    f"AND filename IS NULL AND {idb.LIVE} LIMIT ?", (d0, d1, batch))]
+                if not ids:
+                    break
+                with dst:
+                    sharding._copy(src, dst, ids)
+                with src:
+                    sharding._delete(src, ids)
+                idb._bump()
+            moved += len(ids)
+            _progress["invoices"] += len(ids)
+            if pause:
+                time.sleep(pause)           # yüklemelere nefes payı
+    finally:
+        dst.close()
+    return moved
+
+
+def _compact(a: idb.Archive) -> int:
+    """VACUUM + FTS yeniden kurulumu + ANALYZE; dosya boyutu (bayt)."""
+    c = a.connect_rw()
+    try:
+        with a.lock:
+            fts = idb._fts_tokenizer(c) is not None
+            if fts:
+                with c:
+                    c.execute("DELETE FROM invoices_fts")
+            c.execute("VACUUM")             # rowid'ler değişebilir → FTS ardından yeniden
+            if fts:
+                with c:
+                    last = 0
+                    while True:
+                        n, last = idb._fts_batch(c, last, 2_000)
+                        if not n:
+                            break
+                    c.execute("INSERT INTO invoices_fts(invoices_fts) VALUES ('optimize')")
+            c.execute("ANALYZE")
+            c.commit()
+    finally:
+        c.close()
+    return a.path.stat().st_size
+
+
+def archive_year(year: int) -> dict:
+    """Tek yılı arşivle (senkron, tekrar çağrılabilir — kesilirse kaldığı yerden)."""
+    if year > last_archivable_year():
+        raise ValueError(f"{year} sıcak yıllarda (ARCHIVE_HOT_YEARS={settings.ARCHIVE_HOT_YEARS})")
+    t0 = time.perf_counter()
+    batch = max(10, settings.ARCHIVE_BATCH)
+    pause = settings.ARCHIVE_PAUSE_MS / 1000
+    _progress["year"] = year
+    a = _open(year)
+    moved = sum(_move_shard(sh, a, batch, pause) for sh in idb.SHARDS)
+    _set(year, "compacting")
+    size = _compact(a)
+    total = a.conn().execute("SELECT COUNT(*) FROM invoices").fetchone()[0]
+    _set(year, "done", invoices=total, bytes=size, compacted_at=datetime.now().isoformat())
+    logger.info("archive %d: %d fatura taşındı, arşivde %d, %.1f MB, %d ms",
+                year, moved, total, size / 2**20, (time.perf_counter() - t0) * 1000)
+    return {"year": year, "moved": moved, "invoices": total, "bytes": size}
+
+
+# ── Job ───────────────────────────────────────────────────
+def run(years: list = None) -> dict:
+    """Vadesi gelen (veya verilen) yılları + yarım kalanları arşivle."""
+    if not _RUN_LOCK.acquire(blocking=False):
+        return status()
+    try:
+        _progress.update(running=True, year=None, invoices=0, error=None,
+                         started_at=datetime.now().isoformat(), finished_at=None)
+        moved = 0
+        for year in sorted(set(due_years() if years is None else years) | set(_unfinished())):
+            try:
+                moved += archive_year(year)["moved"]
+            except Exception as e:
+                logger.error("archive %d failed: %s", year, type(e).__name__)
+                _progress["error"] = f"{year}: {type(e).__name__}: {e}"[:500]
+                with idb._LOCK:
+                    with idb._conn() as c:
+                        c.execute("UPDATE archive_years SET error=? WHERE year=?",
+                                  (_progress["error"], year))
+        if moved:                           # boşalan sayfalar + planlayıcı istatistikleri
+            for sh in idb.SHARDS:
+                maintenance.optimize_pool(sh.pool)
+    finally:
+        _progress.update(running=False, year=None, finished_at=datetime.now().isoformat())
+        _RUN_LOCK.release()
+    return status()
+
+
+def start() -> None:
+    """run'ı arka plan thread'inde başlat (admin endpoint'i bloklamaz)."""
+    threading.Thread(target=run, daemon=True).start()
+
+
+def status() -> dict:
+    """Sıcak / arşiv yılları: fatura sayıları, dosya boyutları + son çalıştırma."""
+    years = [dict(r) for r in idb._conn().execute("SELECT * FROM archive_years ORDER BY year")]
+    hot = idb.shard_counts()
+    return {
+        "hot_years":       settings.ARCHIVE_HOT_YEARS,
+        "last_archivable": last_archivable_year(),
+        "hot_invoices":    sum(hot),
+        "hot_bytes":       sum(sh.path.stat().st_size for sh in idb.SHARDS if sh.path.exists()),
+        "archives":        years,
+        "job":             dict(_progress),
+    }
+
+
+# ── CLI: python -m app.services.archive ───────────────────
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="AutoTax fatura arşivi (yıl bazlı soğuk depolama)")
+    ap.add_argument("--run",  action="store_true", help="Vadesi gelen yılları arşivle")
+    ap.add_argument("--year", type=int, action="append", help="Sadece bu yıl (tekrar edilebilir)")
+    args = ap.parse_args()
+    schema.migrate()
+
+    logging.basicConfig(level=logging.INFO)
+    result = run(args.year) if args.run or args.year else status()
+    print(json.dumps(result, ensure_ascii=False, indent=2))
@@ -3,20 +3,15 @@ AutoTax.cloud — Bütçe Takibi
 Kategori bazlı aylık harcama limiti koyabilir,
 limitin %80 ve %100'ünde uyarı alabilirsiniz.
 """
-import sqlite3
-from pathlib  import Path
 from threading import Lock
 from datetime  import datetime
+from app.services import db, schema
 from app.services.user_db import _DB_PATH, _LOCK
-from app.config import settings
-
-_INV_DB = Path(settings.SQLITE_PATH)
+from app.services.invoice_db import LIVE, fan_out, month_number, partitions
 
 
 def _conn():
-    c = sqlite3.connect(str(_DB_PATH), check_same_thread=False, timeout=30)
-    c.row_factory = sqlite3.Row
-    return c
+    return db.pool(_DB_PATH).conn()
 
 
 _DDL = """
@@ -33,11 +28,13 @@ CREATE INDEX IF NOT EXISTS idx_budget_user ON budgets(user_id);
 """
 
 
+SCHEMA_VERSION = 1
+
+
 def _init_budget():
-    with _conn() as c:
-        c.executescript(_DDL)
+    schema.ensure(_conn(), "budget", SCHEMA_VERSION, lambda c: c.executescript(_DDL))
 
-_init_budget()
+schema.register("budget", _init_budget)
 
 
 # ── CRUD ──────────────────────────────────────────────────
@@ -75,6 +72,28 @@ def delete_budget(user_id: str, category: str) -> bool:
     return True
 
 
+def spent_by_category(user_id: str, month: str) -> dict:
+    """
+    Ay içindeki kategori bazlı harcama — tek sorgu (N+1 önlenir).
+    Yalnızca bu kullanıcının faturaları sorgulanır (IDOR önlenir).
+    Aylık rollup'tan (tenant + ay PK SEARCH) — ham fatura satırı okunmaz.
+    Ay arşivlenmiş bir yıldaysa o yılın arşiv dosyası da okunur.
+    """
+    m = month_number(month)
+    parts = fan_out(lambda ic: ic.execute(
+        "SELECT LOWER(NULLIF(k.label,'')) as cat, SUM(gross_cents) as spent "
+        "FROM invoice_rollup "
+        "LEFT JOIN codes k ON k.field='category' AND k.code=cat_code "
+        f"WHERE user_id=? AND month=? AND {LIVE} "
+        "GROUP BY 1",
+        (user_id, m)
+    ).fetchall(), partitions(user_id, m // 100, m // 100))
+    spent: dict = {}
+    for r in (r for part in parts for r in part):
+        spent[r["cat"]] = spent.get(r["cat"], 0) + r["spent"]
+    return {cat: cents / 100.0 for cat, cents in spent.items()}
+
+
 def get_budget_status(user_id: str, month: str = None) -> list[dict]:
     """
     Her kategori için bütçe vs harcama karşılaştırması.
@@ -87,18 +106,7 @@ def get_budget_status(user_id: str, month: str = None) -> list[dict]:
     if not budgets:
         return []
 
-    # Tek sorguyla tüm kategorilerin harcamalarını çek (N+1 önlenir)
-    # Yalnızca bu kullanıcının faturaları sorgulanır (IDOR önlenir)
-    with sqlite3.connect(str(_INV_DB), check_same_thread=False) as ic:
-        ic.row_factory = sqlite3.Row
-        rows = ic.execute(
-            "SELECT LOWER(category) as cat, COALESCE(SUM(total),0) as spent "
-            "FROM invoices "
-            "WHERE user_id=? AND strftime('%Y-%m',date)=? "
-            "GROUP BY LOWER(category)",
-            (user_id, month)
-        ).fetchall()
-    spent_map = {r["cat"]: float(r["spent"]) for r in rows}
+    spent_map = spent_by_category(user_id, month)
 
     result = []
     for b in budgets:
@@ -0,0 +1,180 @@
+"""
+AutoTax.cloud — Paylaşılan SQLite bağlantı yöneticisi
+Her veritabanı dosyası için tek bir havuz; her thread kendi uzun ömürlü
+bağlantısını kullanır (sqlite3 bağlantıları thread'ler arası paylaşılmaz).
+
+  • PRAGMA'lar bağlantı açılırken bir kez çalışır → 32 MB page cache korunur
+  • cached_statements ile hazırlanmış ifadeler bağlantı ömrü boyunca yeniden kullanılır
+  • close() havuzdaki bağlantıyı kapatmaz (eski `conn.close()` çağrıları zararsız)
+  • Periyodik sağlık kontrolü (SELECT 1) — bozuk bağlantı sessizce yenilenir
+  • Ölen thread'lerin bağlantıları bir sonraki açılışta kapatılır
+  • stats() → havuz metrikleri (admin endpoint'i)
+  • readonly=True → mode=ro URI, PRAGMA yazmaz (arşiv dosyaları, bkz. invoice_db "Arşiv")
+
+Kullanım:
+    from app.services import db
+    _POOL = db.pool(settings.SQLITE_PATH)
+    with _POOL.conn() as c:          # commit / rollback sqlite3 ile aynı
+        c.execute(...)
+"""
+import logging
+import sqlite3
+import threading
+import time
+import weakref
+from pathlib import Path
+
+from app.config import settings
+
+logger = logging.getLogger("autotax.db")
+
+STATEMENT_CACHE = 256      # bağlantı başına hazırlanmış ifade sayısı
+HEALTH_INTERVAL = 30.0     # sn — thread başına en fazla bu sıklıkta SELECT 1
+
+PRAGMAS = (
+    "PRAGMA journal_mode=WAL",      # concurrent reads
+    "PRAGMA synchronous=NORMAL",
+    f"PRAGMA cache_size=-{settings.SQLITE_CACHE_KB}",
+)
+
+
+class PooledConnection(sqlite3.Connection):
+    """Havuz bağlantısı — close() no-op, gerçek kapatma sadece havuzdan."""
+
+    def close(self):
+        pass
+
+    def _close(self):
+        super().close()
+
+
+class Pool:
+    def __init__(self, path: str, readonly: bool = False):
+        self.path    = Path(path)
+        self.readonly = readonly
+        self._local  = threading.local()
+        self._lock   = threading.Lock()
+        self._conns: dict = {}          # thread ident → (weakref(thread), conn)
+        self._metrics = {"opened": 0, "reused": 0, "reconnects": 0,
+                         "health_checks": 0, "health_failures": 0, "closed": 0}
+
+    # ── Bağlantı ──────────────────────────────────────────
+    def _open(self, factory=PooledConnection) -> sqlite3.Connection:
+        if self.readonly:
+            c = sqlite3.connect(f"{self.path.resolve().as_uri()}?mode=ro", uri=True,
+                                check_same_thread=False, timeout=30,
+                                cached_statements=STATEMENT_CACHE, factory=factory)
+            c.row_factory = sqlite3.Row
+            c.execute(f"PRAGMA cache_size=-{settings.ARCHIVE_CACHE_KB}")
+            return c
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        c = sqlite3.connect(str(self.path), check_same_thread=False, timeout=30,
+                            cached_statements=STATEMENT_CACHE, factory=factory)
+        c.row_factory = sqlite3.Row
+        if c.execute("PRAGMA page_count").fetchone()[0] == 0:
+            # Yeni dosya: boş sayfalar incremental vacuum'la geri verilebilsin (bkz. maintenance).
+            # Mevcut DB'de bu pragma her açılışta WAL'a yazar → sadece ilk açılışta
+            c.execute("PRAGMA auto_vacuum=INCREMENTAL")
+        for p in PRAGMAS:
+            c.execute(p)
+        return c
+
+    def conn(self) -> sqlite3.Connection:
+        """Bu thread'in bağlantısı (yoksa açılır)."""
+        c = getattr(self._local, "conn", None)
+        if c is not None:
+            if time.monotonic() - self._local.checked < HEALTH_INTERVAL or self._healthy(c):
+                self._metrics["reused"] += 1
+                return c
+            self._metrics["reconnects"] += 1
+            logger.warning("db pool %s: bağlantı yenileniyor", self.path.name)
+            self._discard(threading.get_ident())
+
+        c = self._open()
+        t = threading.current_thread()
+        with self._lock:
+            self._reap()
+            self._conns[t.ident] = (weakref.ref(t), c)
+            self._metrics["opened"] += 1
+        self._local.conn    = c
+        self._local.checked = time.monotonic()
+        return c
+
+    def connect(self) -> sqlite3.Connection:
+        """Havuz dışı, kapatılabilir bağlantı (uzun süren streaming okumaları için)."""
+        return self._open(factory=sqlite3.Connection)
+
+    def _healthy(self, c) -> bool:
+        self._metrics["health_checks"] += 1
+        try:
+            c.execute("SELECT 1").fetchone()
+            self._local.checked = time.monotonic()
+            return True
+        except sqlite3.Error:
+            self._metrics["health_failures"] += 1
+            return False
+
+    # ── Temizlik ──────────────────────────────────────────
+    def _discard(self, ident: int):
+        with self._lock:
+            entry = self._conns.pop(ident, None)
+        if entry:
+            self._close(entry[1])
+        if ident == threading.get_ident():
+            self._local.conn = None
+
+    def _close(self, c):
+        try:
+            c._close()
+        except sqlite3.Error:
+            pass
+        self._metrics["closed"] += 1
+
+    def _reap(self):
+        """Ölen thread'lerin bağlantılarını kapat (self._lock altında çağrılır)."""
+        for ident, (ref, c) in list(self._conns.items()):
+            t = ref()
+            if t is None or not t.is_alive():
+                del self._conns[ident]
+                self._close(c)
+
+    def close_all(self):
+        with self._lock:
+            conns, self._conns = list(self._conns.values()), {}
+        for _, c in conns:
+            self._close(c)
+        self._local = threading.local()
+
+    def stats(self) -> dict:
+        with self._lock:
+            self._reap()
+            open_ = len(self._conns)
+        return {"path": str(self.path), "open": open_, "readonly": self.readonly, **self._metrics}
+
+
+# ── Havuz kayıt defteri (dosya başına tek havuz) ─────────
+_POOLS: dict = {}
+_POOLS_LOCK = threading.Lock()
+
+
+def pool(path, readonly: bool = False) -> Pool:
+    key = str(Path(path).resolve())
+    with _POOLS_LOCK:
+        if key not in _POOLS:
+            _POOLS[key] = Pool(path, readonly)
+        return _POOLS[key]
+
+
+def pools() -> list[Pool]:
+    """Açılmış tüm DB dosyalarının havuzları (bakım job'ları için)."""
+    with _POOLS_LOCK:
+        return list(_POOLS.values())
+
+
+def stats() -> list[dict]:
+    return [p.stats() for p in pools()]
+
+
+def close_all():
+    for p in pools():
+        p.close_all()
@@ -0,0 +1,54 @@
+"""
+AutoTax.cloud — Async veri erişim katmanı
+`async def` route'lar ve middleware sqlite3'ü doğrudan çağırırsa her sorgu
+event loop'u durdurur (diğer tüm istekler bekler). Bu modül fatura / kullanıcı
+fonksiyonlarının awaitable karşılıklarını verir; çağrılar ayrılmış bir DB
+executor'ında çalışır (her worker thread'in havuzdan kendi bağlantısı var).
+
+  • DB_THREADS worker — Starlette'in genel threadpool'u ile yarışmaz
+  • Sync `def` route'lar zaten threadpool'da çalışır, onlar değişmez
+
+Kullanım:
+    from app.services import db_async
+    user = await db_async.get_user_by_id(uid)
+    dup  = await db_async.run(invoice_db.find_duplicate, vendor, date, total, user_id=uid)
+"""
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from app.config import settings
+from app.services import invoice_db, reaper, user_db
+
+_EXECUTOR = ThreadPoolExecutor(max_workers=settings.DB_THREADS, thread_name_prefix="db")
+
+
+async def run(fn, *args, **kwargs):
+    """Sync DB fonksiyonunu executor'da çalıştır, sonucu bekle."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_EXECUTOR, functools.partial(fn, *args, **kwargs))
+
+
+def awaitable(fn):
+    """Sync fonksiyon → aynı imzalı coroutine fonksiyonu."""
+    @functools.wraps(fn)
+    async def wrapper(*args, **kwargs):
+        return await run(fn, *args, **kwargs)
+    return wrapper
+
+
+# ── Faturalar ─────────────────────────────────────────────
+add_invoice          = awaitable(invoice_db.add_invoice)
+add_invoices         = awaitable(invoice_db.add_invoices)
+update_invoice       = awaitable(invoice_db.update_invoice)
+get_invoice          = awaitable(invoice_db.get_invoice)
+find_duplicate       = awaitable(invoice_db.find_duplicate)
+find_recurring       = awaitable(invoice_db.find_recurring)
+tombstone_tenant     = awaitable(reaper.tombstone_tenant)
+
+# ── Kullanıcılar ──────────────────────────────────────────
+get_user_by_id       = awaitable(user_db.get_user_by_id)
+check_quota          = awaitable(user_db.check_quota)
+increment_usage      = awaitable(user_db.increment_usage)
+update_user_plan     = awaitable(user_db.update_user_plan)
+delete_user          = awaitable(user_db.delete_user)
@@ -0,0 +1,159 @@
+"""
+AutoTax.cloud — Group-commit yazıcı
+Eşzamanlı küçük yazmaları (fatura ekleme / güncelleme) tek bir yazıcı
+thread'inde kısa transaction'larda birleştirir: N yazma → 1 commit (1 WAL sync).
+
+  • İlk iş geldikten sonra en fazla GROUP_COMMIT_MS kadar yeni iş toplanır;
+    GROUP_COMMIT_MAX işe ulaşılınca beklemeden yazılır
+  • Commit sürerken gelen işler bir sonraki batch'e girer (yük arttıkça batch büyür)
+  • Her iş kendi SAVEPOINT'inde çalışır → hata sadece o işi geri alır
+  • Çağıran, işinin commit'i tamamlanınca döner (sonuç veya istisna ile)
+  • Yazıcı thread'inin içinden çağrılırsa iş doğrudan çalışır (deadlock yok)
+
+Kullanım:
+    _WRITER = GroupWriter(_POOL, _LOCK, on_commit=_bump, name="invoices")
+    rowcount = _WRITER.run(lambda c: c.execute("UPDATE ...").rowcount)
+"""
+import atexit
+import logging
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from app.config import settings
+
+logger = logging.getLogger("autotax.db")
+
+_WRITERS: list = []
+
+
+class GroupWriter:
+    def __init__(self, pool, lock, on_commit=None, name: str = "writer",
+                 max_batch: int = None, max_wait_ms: float = None):
+        self.pool      = pool
+        self.lock      = lock
+        self.on_commit = on_commit
+        self.name      = name
+        self.max_batch = max_batch or settings.GROUP_COMMIT_MAX
+        self.max_wait  = (settings.GROUP_COMMIT_MS if max_wait_ms is None else max_wait_ms) / 1000
+        self._q: queue.Queue = queue.Queue()
+        self._thread   = None
+        self._start_lock = threading.Lock()
+        self._metrics  = {"jobs": 0, "batches": 0, "failed_jobs": 0,
+                          "failed_batches": 0, "max_batch": 0}
+        _WRITERS.append(self)
+
+    # ── Çağıran tarafı ────────────────────────────────────
+    def submit(self, fn) -> Future:
+        """fn(conn) → Future; fn açık transaction içinde çalışır, commit etmez."""
+        fut: Future = Future()
+        if threading.current_thread() is self._thread:
+            try:
+                fut.set_result(fn(self.pool.conn()))
+            except Exception as e:
+                fut.set_exception(e)
+            return fut
+        self._ensure_started()
+        self._q.put((fn, fut))
+        return fut
+
+    def run(self, fn):
+        """submit + commit'i bekle."""
+        return self.submit(fn).result()
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                t = threading.Thread(target=self._loop, name=f"group-commit-{self.name}", daemon=True)
+                t.start()
+                self._thread = t
+
+    # ── Yazıcı thread'i ───────────────────────────────────
+    def _loop(self):
+        while True:
+            job = self._q.get()
+            if job is None:
+                return
+            batch, stop = [job], False
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                try:
+                    nxt = self._q.get_nowait() if self.max_wait <= 0 else \
+                          self._q.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if nxt is None:
+                    stop = True
+                    break
+                batch.append(nxt)
+            self._commit(batch)
+            if stop:
+                return
+
+    def _commit(self, batch: list):
+        results = []
+        c = self.pool.conn()
+        try:
+            with self.lock:
+                c.execute("BEGIN IMMEDIATE")
+                for fn, fut in batch:
+                    c.execute("SAVEPOINT job")
+                    try:
+                        results.append((fut, fn(c), None))
+                        c.execute("RELEASE job")
+                    except Exception as e:
+                        c.execute("ROLLBACK TO job")
+                        c.execute("RELEASE job")
+                        results.append((fut, None, e))
+                c.commit()
+        except Exception as e:
+            try:
+                c.rollback()
+            except Exception:
+                pass
+            self._metrics["failed_batches"] += 1
+            logger.error("group commit %s: batch of %d failed: %s", self.name, len(batch), e)
+            for _, fut in batch:
+                fut.set_exception(e)
+            return
+
+        self._metrics["batches"] += 1
+        self._metrics["jobs"]    += len(batch)
+        self._metrics["max_batch"] = max(self._metrics["max_batch"], len(batch))
+        if self.on_commit:
+            try:
+                self.on_commit()
+            except Exception as e:
+                logger.warning("group commit %s: on_commit: %s", self.name, e)
+        for fut, res, err in results:
+            if err is not None:
+                self._metrics["failed_jobs"] += 1
+                fut.set_exception(err)
+            else:
+                fut.set_result(res)
+
+    # ── Yönetim ───────────────────────────────────────────
+    def close(self, timeout: float = 10.0):
+        """Kuyruktaki işleri yazıp thread'i durdur."""
+        if self._thread is not None and self._thread.is_alive():
+            self._q.put(None)
+            self._thread.join(timeout)
+
+    def stats(self) -> dict:
+        m = dict(self._metrics)
+        m["avg_batch"] = round(m["jobs"] / m["batches"], 2) if m["batches"] else 0
+        return {"name": self.name, "queued": self._q.qsize(),
+                "max_batch_size": self.max_batch, "max_wait_ms": self.max_wait * 1000, **m}
+
+
+def stats() -> list[dict]:
+    return [w.stats() for w in _WRITERS]
+
+
+@atexit.register
+def close_all():
+    for w in _WRITERS:
+        w.close()
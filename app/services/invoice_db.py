@@ -1,144 +1,802 @@
+import base64
+import calendar
+import heapq
+import re
 import sqlite3
 import json
+import time
+import unicodedata
 import uuid
-from datetime import datetime
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime
 from pathlib import Path
 from threading import Lock
 
 from app.config import settings
+from app.services import db, schema
+from app.services.db_writer import GroupWriter
 
 # ── Yollar ────────────────────────────────────────────────
 _JSON_PATH = Path(settings.DB_PATH)
 DB_PATH    = Path(settings.SQLITE_PATH)
 DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-_LOCK      = Lock()
+
+
+# ── Shard'lar ─────────────────────────────────────────────
+# Faturalar INVOICE_SHARDS dosyaya tenant (user_id) hash'iyle bölünür: her
+# shard'ın kendi WAL yazıcısı, kilidi ve group-commit kuyruğu var → farklı
+# tenant'ların yazmaları birbirini beklemez, bir tenant'ın uzun export'u
+# sadece kendi shard'ının checkpoint'ini tutar. Shard 0 = SQLITE_PATH (tek
+# dosyalı kurulumla aynı); anonim (user_id'siz) faturalar hep shard 0'da.
+# Tenant'a bağlı sorgular tek shard'a gider; genel / admin sorguları tüm
+# shard'larda paralel çalışıp birleştirilir (fan_out). Route'ların kullandığı
+# fatura okumaları (liste, özet, export, inceleme kuyruğu, detay, defter) user_id
+# ister (bkz. tenant()); tenant'sız okuma sadece admin / bakım işlerinde.
+SHARD_COUNT = max(1, settings.INVOICE_SHARDS)
+
+
+class Shard:
+    """Tek fatura DB dosyası: havuz + yazma kilidi + group-commit yazıcısı."""
+
+    def __init__(self, index: int):
+        self.index  = index
+        self.path   = shard_path(index)
+        self.pool   = db.pool(self.path)
+        self.lock   = Lock()
+        self.version = 0                # bu shard'daki her commit'te artar → tenant özet cache'i
+        # Fatura ekleme / güncelleme yazıcısı: eşzamanlı yazmalar tek commit'te (bkz. db_writer.py)
+        self.writer = GroupWriter(self.pool, self.lock, on_commit=lambda: _bump(self),
+                                  name="invoices" if index == 0 else f"invoices.s{index}")
+
+    def conn(self) -> sqlite3.Connection:
+        return self.pool.conn()
+
+
+def shard_path(index: int) -> Path:
+    """0 → invoices.db, n → invoices.s<n>.db (aynı dizinde)."""
+    return DB_PATH if index == 0 else DB_PATH.with_name(f"{DB_PATH.stem}.s{index}{DB_PATH.suffix}")
+
+
+SHARDS: list = [Shard(0)]       # _init_shards sonrası küçülen düzende boşaltılan shard'lar da listede
+_LOCK = SHARDS[0].lock          # shard 0 = ana DB (job / meta tabloları da burada)
+
+# Taşıma bekleyen tenant'lar: user_id → verisinin şu an bulunduğu shard.
+# Shard sayısı değişince doldurulur, sharding.rebalance() taşıdıkça boşalır.
+_PLACEMENT: dict = {}
+
+_FANOUT = None                  # paralel fan-out executor'ı (ilk kullanımda)
+_PARALLEL = True                # False → shard'lar sırayla (query_plans izleme için)
+
+
+def home_shard(user_id: str | None) -> int:
+    """Tenant'ın hedef shard'ı — crc32(user_id) mod INVOICE_SHARDS."""
+    if not user_id or SHARD_COUNT == 1:
+        return 0
+    return zlib.crc32(user_id.encode("utf-8")) % SHARD_COUNT
+
+
+def shard_for(user_id: str | None) -> Shard:
+    """Tenant'ın verisinin okunup yazıldığı shard (taşıma sürüyorsa eski yeri)."""
+    if not user_id:
+        return SHARDS[0]
+    idx = _PLACEMENT.get(user_id)
+    return SHARDS[home_shard(user_id) if idx is None else idx]
+
+
+def fan_out(fn, shards: list = None) -> list:
+    """fn(conn) her shard'da (birden fazlaysa paralel) → sonuçlar shard sırasıyla."""
+    global _FANOUT
+    shards = SHARDS if shards is None else shards
+    if len(shards) == 1 or not _PARALLEL:
+        return [fn(s.conn()) for s in shards]
+    if _FANOUT is None:
+        _FANOUT = ThreadPoolExecutor(max_workers=len(SHARDS), thread_name_prefix="shard")
+    return list(_FANOUT.map(lambda s: fn(s.conn()), shards))
+
+
+def _tenant_shards(user_id: str | None) -> list:
+    """user_id verilmişse sadece onun shard'ı, yoksa hepsi."""
+    return [shard_for(user_id)] if user_id else SHARDS
+
+
+class TenantError(ValueError):
+    """Tenant'sız (user_id'siz) fatura okuması — tüm tenant'ları okumaz, hata verir."""
+
+
+def tenant(user_id: str | None) -> str:
+    """
+    Tenant'a bağlı okuma API'sinin girişi: boş user_id'yi reddeder. Bu API'deki
+    her sorgu user_id=? ile başlar (idx_u_* index'leri), tek shard'a gider ve
+    maliyeti sadece o tenant'ın fatura sayısıyla büyür.
+    """
+    if not user_id:
+        raise TenantError("Fatura okuması için user_id gerekli.")
+    return user_id
+
+
+# ── Arşiv (soğuk yıllar) ──────────────────────────────────
+# ARCHIVE_HOT_YEARS'tan eski yıllar app/services/archive.py ile yıl başına tek
+# dosyaya (ARCHIVE_DIR/invoices.y<yıl>.db) taşınır → sıcak shard'lar sadece son
+# yılları tutar, çalışma kümesi page cache'e sığar. Arşiv dosyası o yılın tüm
+# tenant'larını tutar; şeması shard'larla aynı (kendi kod sözlüğü, FTS, rollup,
+# tombstone'lar) → aynı SQL değişmeden çalışır.
+#   • Okuma salt okunur (mode=ro) ayrı havuzdan; sorgular tarih aralığının değdiği
+#     yılları partitions() ile shard listesine ekler (fan_out / keyset / stream merge)
+#   • Yıl kaydı shard 0'daki archive_years'ta, her yönlendirmede okunur → başka
+#     process'in arşivlediği yıl hemen görünür
+#   • Arşivdeki fatura düzenlenmez (update_invoice, inceleme kuyruğu, mükerrer /
+#     tekrarlayan fatura kontrolleri sıcak veride); silme (GDPR) yazılabilir bağlantıyla
+ARCHIVE_DIR = Path(settings.ARCHIVE_DIR)
+
+
+class Archive:
+    """Tek arşiv yılı — okumada Shard yerine geçer (conn / pool)."""
+
+    def __init__(self, year: int):
+        self.year = year
+        self.path = archive_path(year)
+        self.pool = db.pool(self.path, readonly=True)
+        self.lock = Lock()              # bu process'teki yazmalar (arşiv job'ı, silme)
+        self.version = 0                # arşiv yazmaları global _bump() ile geçersiz kılar
+
+    def conn(self) -> sqlite3.Connection:
+        return self.pool.conn()
+
+    def connect_rw(self) -> sqlite3.Connection:
+        """Yazılabilir ayrı bağlantı (arşiv job'ı) — çağıran kapatır."""
+        c = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        c.row_factory = sqlite3.Row
+        return c
+
+    def run(self, fn):
+        """fn(conn) tek transaction'da (GDPR silme / tombstone) → fn'in sonucu."""
+        with self.lock:
+            c = self.connect_rw()
+            try:
+                with c:
+                    return fn(c)
+            finally:
+                c.close()
+
+
+def archive_path(year: int) -> Path:
+    return ARCHIVE_DIR / f"{DB_PATH.stem}.y{year}{DB_PATH.suffix}"
+
+
+ARCHIVES: dict = {}             # yıl → Archive (bu process'te açılanlar)
+_ARCHIVES_LOCK = Lock()
+
+
+def archives(first_year: int = None, last_year: int = None) -> list:
+    """Kayıtlı arşiv yılları (artan) — [first_year, last_year] ile kesişenler, None = sınırsız."""
+    years = [y for (y,) in _conn().execute("SELECT year FROM archive_years ORDER BY year")
+             if (first_year is None or y >= first_year) and (last_year is None or y <= last_year)]
+    with _ARCHIVES_LOCK:
+        for y in years:
+            if y not in ARCHIVES:
+                ARCHIVES[y] = Archive(y)
+        return [ARCHIVES[y] for y in years]
+
+
+def partitions(user_id: str | None = None, first_year: int = None, last_year: int = None) -> list:
+    """Sorgunun okuyacağı dosyalar: tenant'ın shard'ı (yoksa hepsi) + aralığa düşen arşiv yılları."""
+    return _tenant_shards(user_id) + archives(first_year, last_year)
+
+
+def _year(value) -> int | None:
+    """Filtre tarihi → yıl (boş → None = sınırsız)."""
+    return date.fromordinal(day_param(value) + _EPOCH).year if value else None
 
 
 # ── Şema + Indexler ───────────────────────────────────────
+# v2: para tamsayı kuruş (toplamlar kesin), tarih 1970-01-01'den beri gün
+# (+ sanal month = YYYYMM, year), düşük kardinaliteli metinler küçük tamsayı
+# kodu (codes sözlüğü, shard başına). Okuma ifadeleri (_LEGACY) eski alan
+# adlarını üretir → dict / JSON şekli ve çağıranlar değişmez.
 _DDL = """
 CREATE TABLE IF NOT EXISTS invoices (
     id             TEXT PRIMARY KEY,
     filename       TEXT,
     timestamp      TEXT,
     vendor         TEXT,
-    date           TEXT,
+    day            INTEGER,
     time           TEXT,
-    total          REAL,
+    total_cents    INTEGER,
     vat_rate       INTEGER,
-    vat_amount     REAL,
+    vat_cents      INTEGER,
     invoice_number TEXT,
-    category       TEXT,
-    payment_method TEXT,
-    qr_raw         TEXT,
-    qr_parsed      TEXT,
-    raw_text       TEXT,
+    cat_code       INTEGER,
+    pay_code       INTEGER,
     needs_review   INTEGER DEFAULT 0,
     review_reason  TEXT,
-    invoice_type   TEXT DEFAULT 'expense',
-    user_id        TEXT
+    type_code      INTEGER NOT NULL DEFAULT 0,
+    user_id        TEXT,
+    vendor_key     TEXT,
+    has_qr         INTEGER DEFAULT 0,
+    month          INTEGER GENERATED ALWAYS AS (CAST(strftime('%Y%m', day + 2440587.5) AS INTEGER)) VIRTUAL,
+    year           INTEGER GENERATED ALWAYS AS (month / 100) VIRTUAL
 );
-CREATE INDEX IF NOT EXISTS idx_date     ON invoices(date);
-CREATE INDEX IF NOT EXISTS idx_vendor   ON invoices(vendor COLLATE NOCASE);
-CREATE INDEX IF NOT EXISTS idx_category ON invoices(category);
-CREATE INDEX IF NOT EXISTS idx_total    ON invoices(total);
-CREATE INDEX IF NOT EXISTS idx_payment  ON invoices(payment_method);
+CREATE INDEX IF NOT EXISTS idx_day      ON invoices(day);
+CREATE INDEX IF NOT EXISTS idx_vkey     ON invoices(vendor_key);
+DROP INDEX IF EXISTS idx_vendor;         -- vendor_key eşitliği kullanılıyor
+CREATE INDEX IF NOT EXISTS idx_cat      ON invoices(cat_code);
+CREATE INDEX IF NOT EXISTS idx_total    ON invoices(total_cents);
+CREATE INDEX IF NOT EXISTS idx_payment  ON invoices(pay_code);
 CREATE INDEX IF NOT EXISTS idx_ts       ON invoices(timestamp DESC);
-CREATE INDEX IF NOT EXISTS idx_type     ON invoices(invoice_type);
-CREATE INDEX IF NOT EXISTS idx_uid      ON invoices(user_id);
+CREATE INDEX IF NOT EXISTS idx_type     ON invoices(type_code);
+
+-- Tenant (user_id) önde bileşik indexler: kullanıcı sorguları tek index'te SEARCH
+-- (idx_u_date ham satır raporları için covering; kolon sırası değiştirilmemeli)
+CREATE INDEX IF NOT EXISTS idx_u_date   ON invoices(user_id, day, cat_code, total_cents, vat_cents, vat_rate);
+CREATE INDEX IF NOT EXISTS idx_u_ts     ON invoices(user_id, timestamp, id);
+CREATE INDEX IF NOT EXISTS idx_u_type   ON invoices(user_id, type_code, day, total_cents, vat_cents);
+CREATE INDEX IF NOT EXISTS idx_u_invno  ON invoices(user_id, invoice_number);
+CREATE INDEX IF NOT EXISTS idx_u_vkey   ON invoices(user_id, vendor_key, day);
+DROP INDEX IF EXISTS idx_uid;            -- idx_u_* önekleri zaten kapsıyor
+DROP INDEX IF EXISTS idx_u_vendor;       -- → idx_u_vkey
+
+-- Kod sözlüğü: field = 'category' | 'payment'. Kodlar shard içinde yazma
+-- transaction'ında atanır (_code), hiç silinmez / yeniden kullanılmaz
+CREATE TABLE IF NOT EXISTS codes (
+    field TEXT    NOT NULL,
+    code  INTEGER NOT NULL,
+    label TEXT    NOT NULL,
+    PRIMARY KEY (field, code),
+    UNIQUE (field, label)
+) WITHOUT ROWID;
+
+-- Firma anahtarı sözlüğü (tenant başına farklı firmalar): alt dize aramaları
+-- önce bu küçük tabloda, sonra invoices'ta vendor_key IN (...) ile index'ten
+CREATE TABLE IF NOT EXISTS vendor_keys (
+    user_id    TEXT NOT NULL,
+    vendor_key TEXT NOT NULL,
+    PRIMARY KEY (user_id, vendor_key)
+) WITHOUT ROWID;
+CREATE TRIGGER IF NOT EXISTS trg_vkey_ins AFTER INSERT ON invoices
+WHEN NEW.vendor_key <> '' BEGIN
+    INSERT OR IGNORE INTO vendor_keys VALUES (COALESCE(NEW.user_id, ''), NEW.vendor_key);
+END;
+CREATE TRIGGER IF NOT EXISTS trg_vkey_upd AFTER UPDATE OF vendor_key, user_id ON invoices
+WHEN NEW.vendor_key <> '' BEGIN
+    INSERT OR IGNORE INTO vendor_keys VALUES (COALESCE(NEW.user_id, ''), NEW.vendor_key);
+END;
+
+-- Hacimli metin (OCR, QR) ayrı tabloda zlib sıkıştırılmış: invoices satırları küçük
+-- kalır, liste sorguları page cache'i bu metinle doldurmaz. Sadece detayda okunur.
+CREATE TABLE IF NOT EXISTS invoice_blobs (
+    invoice_id TEXT PRIMARY KEY,
+    raw_text   BLOB,
+    qr_raw     BLOB,
+    qr_parsed  BLOB
+);
+CREATE TRIGGER IF NOT EXISTS trg_blobs_del AFTER DELETE ON invoices BEGIN
+    DELETE FROM invoice_blobs WHERE invoice_id = OLD.id;
+END;
+
+-- Kullanıcının elle düzelttiği alanlar (PATCH /ocr/invoice): toplu yeniden
+-- ayrıştırma bunları ezmez, fark raporunda "atlandı" olarak gösterir (bkz. reparse.py)
+CREATE TABLE IF NOT EXISTS invoice_edits (
+    invoice_id TEXT NOT NULL,
+    field      TEXT NOT NULL,
+    edited_at  TEXT NOT NULL,
+    PRIMARY KEY (invoice_id, field)
+) WITHOUT ROWID;
+CREATE TRIGGER IF NOT EXISTS trg_edits_del AFTER DELETE ON invoices BEGIN
+    DELETE FROM invoice_edits WHERE invoice_id = OLD.id;
+END;
+
+-- İnceleme kuyruğu: tenant'ın needs_review=1 satırları (kısmi index, keyset sırası)
+DROP INDEX IF EXISTS idx_review;
+CREATE INDEX IF NOT EXISTS idx_u_review ON invoices(user_id, timestamp, id) WHERE needs_review=1;
+
+-- Ürün kalemleri + oran bazlı KDV satırları (ingest'te bir kez çıkarılır)
+-- user_id / day denormalize: aggregate sorguları sadece index'ten cevaplanır
+CREATE TABLE IF NOT EXISTS invoice_items (
+    invoice_id  TEXT NOT NULL,
+    user_id     TEXT,
+    day         INTEGER,
+    line_no     INTEGER NOT NULL,
+    name        TEXT NOT NULL,
+    name_key    TEXT NOT NULL,
+    price_cents INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_item_inv  ON invoice_items(invoice_id);
+CREATE INDEX IF NOT EXISTS idx_item_user ON invoice_items(user_id, name_key, day, price_cents);
+
+CREATE TABLE IF NOT EXISTS invoice_vat_lines (
+    invoice_id   TEXT NOT NULL,
+    user_id      TEXT,
+    day          INTEGER,
+    rate         REAL NOT NULL,
+    amount_cents INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_vatl_inv  ON invoice_vat_lines(invoice_id);
+CREATE INDEX IF NOT EXISTS idx_vatl_user ON invoice_vat_lines(user_id, day, rate, amount_cents, invoice_id);
+
+-- Silinmekte olan tenant'lar (GDPR Md.17, bkz. app/services/reaper.py): satırları
+-- live() koşuluyla tüm sorgulardan anında gizlenir, reaper batch'lerle siler
+CREATE TABLE IF NOT EXISTS tenant_tombstones (
+    user_id      TEXT PRIMARY KEY,
+    request_id   TEXT NOT NULL,
+    requested_at TEXT NOT NULL
+) WITHOUT ROWID;
 """
 
-_MIGRATE_DDL = """
-ALTER TABLE invoices ADD COLUMN invoice_type TEXT DEFAULT 'expense';
-CREATE INDEX IF NOT EXISTS idx_type ON invoices(invoice_type);
+# Sütun sırası — INSERT'ler isimli kolon listesiyle (month / year sanal, yazılmaz)
+_COLS = ("id", "filename", "timestamp", "vendor", "day", "time", "total_cents", "vat_rate",
+         "vat_cents", "invoice_number", "cat_code", "pay_code",
+         "needs_review", "review_reason", "type_code", "user_id", "vendor_key", "has_qr")
+_INSERT = (f"INSERT INTO invoices ({','.join(_COLS)}) "
+           f"VALUES ({','.join('?' * len(_COLS))})")
+_ITEM_INSERT = ("INSERT INTO invoice_items (invoice_id,user_id,day,line_no,name,name_key,price_cents) "
+                "VALUES (?,?,?,?,?,?,?)")
+_VATL_INSERT = ("INSERT INTO invoice_vat_lines (invoice_id,user_id,day,rate,amount_cents) "
+                "VALUES (?,?,?,?,?)")
+
+# Eski alan adı → v2 kolonlarından okuma ifadesi ({p} = tablo takma adı öneki)
+_LEGACY = {
+    "date":           "date({p}day + 2440587.5)",
+    "total":          "{p}total_cents / 100.0",
+    "vat_amount":     "{p}vat_cents / 100.0",
+    "category":       "(SELECT label FROM codes WHERE field='category' AND code={p}cat_code)",
+    "payment_method": "(SELECT label FROM codes WHERE field='payment' AND code={p}pay_code)",
+    "invoice_type":   "CASE {p}type_code WHEN 1 THEN 'income' ELSE 'expense' END",
+}
+TYPE_CODES = {"expense": 0, "income": 1}
+
+
+def _col(name: str, alias: str = "") -> str:
+    """Alan adı → SELECT ifadesi (v2'de kodlu / dönüştürülmüş alanlar eski adıyla)."""
+    p = f"{alias}." if alias else ""
+    expr = _LEGACY.get(name)
+    return f"{expr.format(p=p)} AS {name}" if expr else f"{p}{name}"
+
+
+def _cols(names, alias: str = "") -> str:
+    return ", ".join(_col(n, alias) for n in names)
+
+
+BLOB_FIELDS = ("raw_text", "qr_raw", "qr_parsed")
+
+
+def live(alias: str = "") -> str:
+    """Tombstone'lu (silinmekte olan) tenant'ların satırlarını dışlayan koşul."""
+    p = f"{alias}." if alias else ""
+    return f"COALESCE({p}user_id, '') NOT IN (SELECT user_id FROM tenant_tombstones)"
+
+
+LIVE = live()
+
+# Shard düzeni — sadece shard 0'da
+_SHARD_DDL = """
+CREATE TABLE IF NOT EXISTS shard_meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+CREATE TABLE IF NOT EXISTS shard_placement (
+    user_id TEXT PRIMARY KEY,
+    shard   INTEGER NOT NULL
+);
+-- Arşiv yılları (bkz. "Arşiv", app/services/archive.py): satır varsa o yıl sorgulara dahil
+CREATE TABLE IF NOT EXISTS archive_years (
+    year         INTEGER PRIMARY KEY,
+    status       TEXT NOT NULL,             -- copying | compacting | done
+    invoices     INTEGER NOT NULL DEFAULT 0,
+    bytes        INTEGER NOT NULL DEFAULT 0,
+    created_at   TEXT NOT NULL,
+    updated_at   TEXT,
+    compacted_at TEXT,
+    error        TEXT
+);
 """
 
 
 def _conn() -> sqlite3.Connection:
-    c = sqlite3.connect(str(DB_PATH), check_same_thread=False, timeout=30)
-    c.row_factory = sqlite3.Row
-    c.execute("PRAGMA journal_mode=WAL")   # concurrent reads
-    c.execute("PRAGMA synchronous=NORMAL")
-    c.execute("PRAGMA cache_size=-32000")  # 32 MB page cache
-    return c
+    """
+    Ana DB'nin (shard 0) thread bağlantısı — job / meta tabloları için.
+    Fatura sorguları shard_for(user_id).conn() veya fan_out() kullanır.
+    """
+    return SHARDS[0].conn()
+
+
+# Shard şeması (_DDL, FTS, rollup, v1 → v2) değişince artır — bkz. schema.py
+SCHEMA_VERSION = 4
 
 
 def _init():
+    """Açılış kurulumu (schema.migrate): shard listesi + sürümü eski shard'ların migration'ı."""
+    global FTS_TOKENIZER
     DB_PATH.parent.mkdir(parents=True, exist_ok=True)
+    prev = _init_shards()
+    for sh in SHARDS:
+        schema.ensure(sh.conn(), "invoices", SCHEMA_VERSION, lambda c, sh=sh: _init_shard(sh))
+    FTS_TOKENIZER = _fts_tokenizer(_conn())
+    _plan_placement(prev)
+    archives()                          # arşiv havuzları kayıtlı olsun (yedekler, istatistik)
+    _migrate_json()
+
+
+def _init_shards() -> int:
+    """
+    Shard listesini kur: INVOICE_SHARDS + (küçültmede) henüz boşaltılmamış eski
+    shard'lar. Kayıtlı önceki shard sayısını döndürür.
+    shard_meta: count = son planlanan INVOICE_SHARDS, files = veri olabilecek dosya sayısı.
+    """
     with _conn() as c:
-        # Önce migration — mevcut DB'ye kolon ekle
+        c.executescript(_SHARD_DDL)
+        meta = dict(c.execute("SELECT key, value FROM shard_meta").fetchall())
+        _PLACEMENT.update({r[0]: r[1] for r in
+                           c.execute("SELECT user_id, shard FROM shard_placement")})
+    prev  = int(meta.get("count", 1))
+    files = int(meta.get("files", prev))
+    SHARDS.extend(Shard(i) for i in range(1, max(SHARD_COUNT, files)))
+    return prev
+
+
+def _plan_placement(prev: int) -> None:
+    """
+    Shard sayısı değiştiyse hedef shard'ında olmayan tenant'ların şu anki yerini
+    kaydet: veri taşınana kadar okuma / yazma oradan devam eder (bkz. sharding.py).
+    """
+    if prev == SHARD_COUNT:
+        return
+    placed: dict = {}
+    for sh in SHARDS:
+        for (uid,) in sh.conn().execute(
+                "SELECT DISTINCT user_id FROM invoices WHERE user_id IS NOT NULL"):
+            if uid not in _PLACEMENT and home_shard(uid) != sh.index:
+                placed.setdefault(uid, sh.index)
+    with _LOCK:
+        with _conn() as c:
+            c.executemany("INSERT OR IGNORE INTO shard_placement (user_id, shard) VALUES (?,?)",
+                          list(placed.items()))
+            c.executemany("INSERT OR REPLACE INTO shard_meta (key, value) VALUES (?, ?)",
+                          [("count", str(SHARD_COUNT)), ("files", str(len(SHARDS)))])
+    _PLACEMENT.update(placed)
+    print(f"[AutoTax] fatura shard'ları {prev} → {SHARD_COUNT}: "
+          f"{len(_PLACEMENT)} tenant taşınmayı bekliyor (python -m app.services.sharding)")
+
+
+def _init_shard(sh: Shard) -> None:
+    """Şema + migration'lar (her shard dosyası için)."""
+    with sh.conn() as c:
         cols = [r[1] for r in c.execute("PRAGMA table_info(invoices)").fetchall()]
-        if cols and "invoice_type" not in cols:
-            try:
-                c.execute("ALTER TABLE invoices ADD COLUMN invoice_type TEXT DEFAULT 'expense'")
-                c.execute("CREATE INDEX IF NOT EXISTS idx_type ON invoices(invoice_type)")
+        v1 = bool(cols) and "total_cents" not in cols
+        backfill = legacy_text = False
+        if v1:
+            # Önce eski düzenin eksik kolonları — v2 kopyası bunları okur
+            if "invoice_type" not in cols:
+                try:
+                    c.execute("ALTER TABLE invoices ADD COLUMN invoice_type TEXT DEFAULT 'expense'")
+                    c.commit()
+                except Exception as e:
+                    print(f"[AutoTax] invoice_type migration: {e}")
+            if "user_id" not in cols:
+                try:
+                    c.execute("ALTER TABLE invoices ADD COLUMN user_id TEXT")
+                    c.commit()
+                except Exception as e:
+                    print(f"[AutoTax] user_id migration: {e}")
+            backfill = "vendor_key" not in cols
+            if backfill:
+                c.execute("ALTER TABLE invoices ADD COLUMN vendor_key TEXT")
                 c.commit()
-            except Exception as e:
-                print(f"[AutoTax] invoice_type migration: {e}")
-        if cols and "user_id" not in cols:
-            try:
-                c.execute("ALTER TABLE invoices ADD COLUMN user_id TEXT")
-                c.execute("CREATE INDEX IF NOT EXISTS idx_uid ON invoices(user_id)")
+            legacy_text = "raw_text" in cols
+            if legacy_text:
+                if "has_qr" not in cols:
+                    c.execute("ALTER TABLE invoices ADD COLUMN has_qr INTEGER DEFAULT 0")
+                _drop_legacy_fts(c)
                 c.commit()
-            except Exception as e:
-                print(f"[AutoTax] user_id migration: {e}")
-        # Sonra DDL (yeni tablo için)
+    if backfill:
+        _backfill_vendor_keys(sh)
+    if legacy_text:
+        _move_blobs(sh)
+    if v1:
+        _migrate_v2(sh)
+    with sh.conn() as c:
         c.executescript(_DDL)
-    _migrate_json()
+        if backfill:                    # v1 backfill'i trigger'sız yazdı
+            c.execute("INSERT OR IGNORE INTO vendor_keys SELECT DISTINCT COALESCE(user_id, ''), "
+                      "vendor_key FROM invoices WHERE vendor_key <> ''")
+        fts_new = _init_fts(c)
+        rollup_new = not c.execute(
+            "SELECT 1 FROM sqlite_master WHERE name='invoice_rollup'").fetchone()
+        c.executescript(_rollup_ddl())
+    if fts_new:
+        _rebuild_fts(sh)
+    if rollup_new:
+        _rebuild_rollup(sh)
+
+
+def _table_ddl(name: str) -> str:
+    """_DDL içinden tek tablonun CREATE TABLE ifadesi (migration transaction'ı için)."""
+    m = re.search(rf"CREATE TABLE IF NOT EXISTS {name} \(.*?\n\)[^;]*;", _DDL, re.S)
+    return m.group(0)
+
+
+# v1 → v2 kopyasının her satırda doğruladığı eşitlikler (eski değer o, yeni n)
+_V2_CHECK = """
+SELECT COUNT(*) FROM invoices_v1 o LEFT JOIN invoices n ON n.rowid = o.rowid
+WHERE n.id IS NOT o.id
+   OR (o.total IS NULL) <> (n.total_cents IS NULL)
+   OR ABS(o.total * 100 - n.total_cents) > 0.5
+   OR (o.vat_amount IS NULL) <> (n.vat_cents IS NULL)
+   OR ABS(o.vat_amount * 100 - n.vat_cents) > 0.5
+   OR (n.day IS NOT NULL AND date(n.day + 2440587.5) IS NOT SUBSTR(o.date, 1, 10))
+   OR (n.day IS NULL AND NULLIF(o.date, '') IS NOT NULL AND n.needs_review = 0)
+   OR (SELECT label FROM codes WHERE field='category' AND code=n.cat_code) IS NOT o.category
+   OR (SELECT label FROM codes WHERE field='payment'  AND code=n.pay_code) IS NOT o.payment_method
+   OR CASE n.type_code WHEN 1 THEN 'income' ELSE 'expense' END IS NOT COALESCE(o.invoice_type, 'expense')
+"""
+
+
+def _migrate_v2(sh: Shard) -> None:
+    """
+    v1 (REAL tutar, TEXT tarih / kategori / ödeme / tür) → v2 tabloları, tek transaction.
+    rowid'ler korunur (FTS index'i geçerli kalır). Kopya satır satır eski değerlerle
+    doğrulanır (_V2_CHECK); fark varsa geri alınır ve başlatma durur. Geçersiz
+    tarihli faturalar day=NULL ile inceleme kuyruğuna alınır (eski değer review_reason'da).
+    Rollup v2 anahtarlarıyla yeniden kurulur.
+    """
+    c = sh.conn()
+    c.create_function("v2_day", 1, day_number, deterministic=True)
+    c.create_function("v2_cents", 1, cents, deterministic=True)
+    t0 = time.monotonic()
+    with sh.lock:
+        try:
+            c.execute("BEGIN IMMEDIATE")
+            for (trg,) in c.execute("SELECT name FROM sqlite_master WHERE type='trigger' "
+                                    "AND tbl_name='invoices'").fetchall():
+                c.execute(f"DROP TRIGGER {trg}")
+            c.execute("DROP TABLE IF EXISTS invoice_rollup")
+            lines = [t for (t,) in c.execute(
+                "SELECT name FROM sqlite_master WHERE type='table' "
+                "AND name IN ('invoice_items', 'invoice_vat_lines')").fetchall()]
+            for t in ["invoices", *lines]:
+                c.execute(f"ALTER TABLE {t} RENAME TO {t}_v1")
+            for t in ("invoices", "codes", "invoice_items", "invoice_vat_lines"):
+                c.execute(_table_ddl(t))
+
+            for field, col in (("category", "category"), ("payment", "payment_method")):
+                c.execute(
+                    f"INSERT INTO codes (field, code, label) "
+                    f"SELECT ?, ROW_NUMBER() OVER (ORDER BY {col}), {col} "
+                    f"FROM (SELECT DISTINCT {col} FROM invoices_v1 WHERE {col} IS NOT NULL)",
+                    (field,))
+            bad_day = "(NULLIF(o.date, '') IS NOT NULL AND v2_day(o.date) IS NULL)"
+            c.execute(f"""
+                INSERT INTO invoices (rowid, {', '.join(_COLS)})
+                SELECT o.rowid, o.id, o.filename, o.timestamp, o.vendor, v2_day(o.date), o.time,
+                       v2_cents(o.total), o.vat_rate, v2_cents(o.vat_amount), o.invoice_number,
+                       (SELECT code FROM codes WHERE field='category' AND label=o.category),
+                       (SELECT code FROM codes WHERE field='payment'  AND label=o.payment_method),
+                       CASE WHEN {bad_day} THEN 1 ELSE o.needs_review END,
+                       CASE WHEN {bad_day} THEN 'Geçersiz tarih: ' || o.date ELSE o.review_reason END,
+                       CASE o.invoice_type WHEN 'income' THEN 1 ELSE 0 END,
+                       o.user_id, o.vendor_key, COALESCE(o.has_qr, 0)
+                FROM invoices_v1 o
+            """)
+            if "invoice_items" in lines:
+                c.execute("INSERT INTO invoice_items SELECT invoice_id, user_id, v2_day(date), "
+                          "line_no, name, name_key, v2_cents(price) FROM invoice_items_v1")
+            if "invoice_vat_lines" in lines:
+                c.execute("INSERT INTO invoice_vat_lines SELECT invoice_id, user_id, v2_day(date), "
+                          "rate, v2_cents(amount) FROM invoice_vat_lines_v1")
+
+            bad = c.execute(_V2_CHECK).fetchone()[0]
+            if bad:
+                raise RuntimeError(f"{bad} fatura v1 değerleriyle eşleşmiyor")
+            n, flagged = c.execute(
+                "SELECT COUNT(*), COUNT(CASE WHEN day IS NULL AND review_reason LIKE "
+                "'Geçersiz tarih: %' THEN 1 END) FROM invoices").fetchone()
+            for t in ["invoices", *lines]:
+                c.execute(f"DROP TABLE {t}_v1")
+            c.commit()
+        except Exception as e:
+            c.rollback()
+            raise RuntimeError(f"[AutoTax] şema v2 migration (shard {sh.index}): {e}") from e
+    print(f"[AutoTax] shard {sh.index}: {n} fatura şema v2'ye taşındı "
+          f"({time.monotonic() - t0:.1f} sn, {flagged} geçersiz tarih incelemede; "
+          f"yer kazanmak için VACUUM)")
+
+
+def _move_blobs(sh: Shard, batch: int = 500) -> int:
+    """raw_text / qr_* kolonlarını invoice_blobs'a sıkıştırarak taşı, sonra kolonları düşür."""
+    with sh.conn() as c:                # v1 düzeninde, _DDL'den önce çalışır
+        c.execute(_table_ddl("invoice_blobs"))
+    done, last = 0, 0
+    while True:
+        with sh.lock:
+            with sh.conn() as c:
+                rows = c.execute(
+                    "SELECT rowid, id, raw_text, qr_raw, qr_parsed FROM invoices "
+                    "WHERE rowid > ? ORDER BY rowid LIMIT ?", (last, batch)
+                ).fetchall()
+                if not rows:
+                    break
+                _put_blobs(c, [(r["id"], r["raw_text"], r["qr_raw"], r["qr_parsed"]) for r in rows],
+                           index=False)
+                c.executemany("UPDATE invoices SET has_qr=? WHERE rowid=?",
+                              [(1 if r["qr_raw"] else 0, r["rowid"]) for r in rows])
+        last  = rows[-1]["rowid"]
+        done += len(rows)
+    with sh.lock:
+        with sh.conn() as c:
+            for col in BLOB_FIELDS:
+                try:
+                    c.execute(f"ALTER TABLE invoices DROP COLUMN {col}")
+                except sqlite3.OperationalError:            # SQLite < 3.35
+                    c.execute(f"UPDATE invoices SET {col}=NULL")
+    print(f"[AutoTax] {done} faturanın metni invoice_blobs'a taşındı (yer kazanmak için VACUUM)")
+    return done
+
+
+def _backfill_vendor_keys(sh: Shard, batch: int = 2_000) -> int:
+    """Eski satırların vendor_key'ini doldur (rowid sırasıyla, batch başına bir transaction)."""
+    done, last = 0, 0
+    while True:
+        with sh.lock:
+            with sh.conn() as c:
+                rows = c.execute(
+                    "SELECT rowid, vendor FROM invoices WHERE rowid > ? AND vendor IS NOT NULL "
+                    "ORDER BY rowid LIMIT ?", (last, batch)
+                ).fetchall()
+                if not rows:
+                    break
+                c.executemany("UPDATE invoices SET vendor_key=? WHERE rowid=?",
+                              [(vendor_key(r["vendor"]), r["rowid"]) for r in rows])
+        last  = rows[-1]["rowid"]
+        done += len(rows)
+    print(f"[AutoTax] vendor_key backfill: {done} fatura")
+    return done
+
+
+JSON_IMPORT_BATCH = 1_000       # transaction başına eski JSON kaydı
 
 
 def _migrate_json():
-    """Eski JSON DB → SQLite (ilk çalışmada otomatik)."""
+    """
+    Eski JSON DB → SQLite (ilk çalışmada otomatik). Dosya akışla okunur (sabit
+    bellek, bkz. app/utils/json_stream.py); her batch tek executemany transaction'ı
+    ve aynı transaction'da ilerleme kaydı (shard_meta 'json_import': bayt konumu) →
+    kesilirse sonraki başlatmada kaldığı yerden sürer. Tamamlanınca .json.bak olur.
+    """
     if not _JSON_PATH.exists():
         return
+    from app.utils.json_stream import iter_json_array
     try:
+        size = _JSON_PATH.stat().st_size
         with _conn() as c:
-            if c.execute("SELECT COUNT(*) FROM invoices").fetchone()[0] > 0:
-                return           # zaten migrate edilmiş
-
-        with _JSON_PATH.open("r", encoding="utf-8") as f:
-            raw = json.load(f)
-        invs = raw.get("invoices", raw) if isinstance(raw, dict) else raw
-        if not invs:
-            return
-
-        rows = []
-        for inv in invs:
-            d = inv.get("data") or inv.get("parsed") or {}
-            rows.append(_record_to_row(
-                inv.get("id", str(uuid.uuid4())),
-                inv.get("filename", ""),
-                inv.get("timestamp", datetime.now().isoformat()),
-                d,
-            ))
-
-        with _conn() as c:
-            c.executemany(
-                "INSERT OR IGNORE INTO invoices VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
-                rows,
-            )
+            row = c.execute("SELECT value FROM shard_meta WHERE key='json_import'").fetchone()
+            if row is None and c.execute("SELECT COUNT(*) FROM invoices").fetchone()[0] > 0:
+                return           # zaten migrate edilmiş (ilerleme kaydı öncesi sürüm)
+        state = json.loads(row[0]) if row else {}
+        if state.get("size") != size:               # dosya değişmiş → baştan (id'ler tekrar eklenmez)
+            state = {"offset": 0, "count": state.get("count", 0)}
+        state["size"] = size
+
+        batch = []
+        for inv, offset in iter_json_array(_JSON_PATH, state["offset"], key="invoices"):
+            if isinstance(inv, dict):
+                batch.append(inv)
+            state["offset"] = offset
+            if len(batch) >= JSON_IMPORT_BATCH:
+                state["count"] += _import_batch(batch, state)
+                batch = []
+        state["count"] += _import_batch(batch, state)
 
         _JSON_PATH.rename(_JSON_PATH.with_suffix(".json.bak"))
-        print(f"[AutoTax] {len(rows)} fatura JSON'dan SQLite'a taşındı.")
+        print(f"[AutoTax] {state['count']} fatura JSON'dan SQLite'a taşındı.")
     except Exception as e:
         print(f"[AutoTax] Migrasyon hatası: {e}")
 
 
-def _record_to_row(inv_id, filename, timestamp, d, user_id=None):
+def _import_batch(invs: list, state: dict) -> int:
+    """Eski kayıtlar + ilerleme → tek transaction; mevcut id'ler atlanır. Eklenen sayı."""
+    with _LOCK:
+        with _conn() as c:
+            ids = [inv["id"] for inv in invs if inv.get("id")]
+            seen = {r[0] for r in c.execute(
+                f"SELECT id FROM invoices WHERE id IN ({','.join('?' * len(ids))})", ids)}
+            rows, blobs = [], []
+            for inv in invs:
+                inv_id = inv.get("id") or str(uuid.uuid4())
+                if inv_id in seen:
+                    continue
+                seen.add(inv_id)
+                d = inv.get("data") or inv.get("parsed") or {}
+                rows.append(_record_to_row(
+                    c, inv_id,
+                    inv.get("filename", ""),
+                    inv.get("timestamp", datetime.now().isoformat()),
+                    d,
+                ))
+                blobs.append(_record_to_blobs(inv_id, d))
+            c.executemany(_INSERT, rows)
+            _put_blobs(c, blobs)
+            c.execute("INSERT OR REPLACE INTO shard_meta (key, value) VALUES ('json_import', ?)",
+                      (json.dumps({**state, "count": state["count"] + len(rows)}),))
+        _bump()
+    return len(rows)
+
+
+def _code(c, field: str, label) -> int | None:
+    """Etiket → kod; yoksa c'nin açık yazma transaction'ında atanır (rollback'te geri alınır)."""
+    if label is None:
+        return None
+    sql = "SELECT code FROM codes WHERE field=? AND label=?"
+    row = c.execute(sql, (field, label)).fetchone()
+    if row is None:
+        c.execute("INSERT INTO codes (field, code, label) "
+                  "SELECT ?, COALESCE(MAX(code), 0) + 1, ? FROM codes WHERE field=?",
+                  (field, label, field))
+        row = c.execute(sql, (field, label)).fetchone()
+    return row[0]
+
+
+def _record_to_row(c, inv_id, filename, timestamp, d, user_id=None):
+    """Kayıt → v2 satırı (c: kod ataması için açık transaction). Geçersiz tarih → incelemeye."""
+    day = day_number(d.get("date"))
+    bad_date = day is None and bool(d.get("date"))
     return (
         inv_id, filename, timestamp,
-        d.get("vendor"),  d.get("date"),   d.get("time"),
-        _f(d.get("total")), _i(d.get("vat_rate")), _f(d.get("vat_amount")),
-        d.get("invoice_number"), d.get("category"), d.get("payment_method"),
+        d.get("vendor"),  day,   d.get("time"),
+        cents(d.get("total")), _i(d.get("vat_rate")), cents(d.get("vat_amount")),
+        d.get("invoice_number"),
+        _code(c, "category", d.get("category")), _code(c, "payment", d.get("payment_method")),
+        1 if d.get("needs_review") or bad_date else 0,
+        f"Geçersiz tarih: {d.get('date')}" if bad_date else d.get("review_reason"),
+        TYPE_CODES.get(d.get("invoice_type") or "expense", 0),
+        user_id,
+        vendor_key(d.get("vendor")) if d.get("vendor") is not None else None,
+        1 if d.get("qr_raw") else 0,
+    )
+
+
+def _record_to_blobs(inv_id, d) -> tuple:
+    return (
+        inv_id,
+        (d.get("raw_text") or "")[:5000],
         (d.get("qr_raw") or "")[:500],
         json.dumps(d.get("qr_parsed"), ensure_ascii=False) if d.get("qr_parsed") else None,
-        (d.get("raw_text") or "")[:5000],
-        1 if d.get("needs_review") else 0,
-        d.get("review_reason"),
-        d.get("invoice_type", "expense"),
-        user_id,
     )
 
 
+# ── Sıkıştırılmış metin (invoice_blobs) ──────────────────
+def _pack(text: str | None) -> bytes | None:
+    return zlib.compress(text.encode("utf-8"), 6) if text else None
+
+
+def _unpack(blob) -> str | None:
+    return zlib.decompress(blob).decode("utf-8") if blob else None
+
+
+def _put_blobs(c, blobs: list, index: bool = True) -> None:
+    """
+    [(invoice_id, raw_text, qr_raw, qr_parsed_json)] → invoice_blobs (açık transaction içinde).
+    index=True → OCR metni FTS index'ine de yazılır (fatura satırı önceden eklenmiş olmalı).
+    """
+    c.executemany(
+        "INSERT OR REPLACE INTO invoice_blobs (invoice_id, raw_text, qr_raw, qr_parsed) "
+        "VALUES (?,?,?,?)",
+        [(i, _pack(t), _pack(q), _pack(p)) for i, t, q, p in blobs],
+    )
+    if index and FTS_TOKENIZER:
+        c.executemany(_FTS_INSERT, [(t or None, i) for i, t, _, _ in blobs])
+
+
+def get_blobs(c, inv_id: str) -> dict:
+    """Tek faturanın açılmış metinleri → {"raw_text", "qr_raw", "qr_parsed"(dict)}."""
+    row = c.execute("SELECT raw_text, qr_raw, qr_parsed FROM invoice_blobs WHERE invoice_id=?",
+                    (inv_id,)).fetchone()
+    out = {k: _unpack(row[k]) if row else None for k in BLOB_FIELDS}
+    if out["qr_parsed"]:
+        try: out["qr_parsed"] = json.loads(out["qr_parsed"])
+        except Exception: out["qr_parsed"] = None
+    return out
+
+
 def _f(v):
     try: return float(v) if v is not None else None
     except (TypeError, ValueError): return None
@@ -149,18 +807,63 @@ def _i(v):
     except (TypeError, ValueError): return None
 
 
-def _row_to_dict(row) -> dict:
-    """Eski JSON formatıyla uyumlu çıktı (frontend değişmesin)."""
-    qp = None
-    if row["qr_parsed"]:
-        try: qp = json.loads(row["qr_parsed"])
-        except Exception: pass
-    return {
+# ── v2 değer dönüşümleri ──────────────────────────────────
+_EPOCH   = date(1970, 1, 1).toordinal()
+_ISO_DAY = re.compile(r"^(\d{4})-(\d{2})-(\d{2})")
+
+
+def cents(v) -> int | None:
+    """Tutar → tamsayı kuruş (toplamlar kesin)."""
+    f = _f(v)
+    return None if f is None else round(f * 100)
+
+
+def day_number(value) -> int | None:
+    """'YYYY-MM-DD…' / date → 1970-01-01'den beri gün; boş veya geçersiz tarih → None."""
+    if isinstance(value, date):
+        return value.toordinal() - _EPOCH
+    m = _ISO_DAY.match(value or "") if isinstance(value, str) else None
+    if not m:
+        return None
+    try:
+        return date(*map(int, m.groups())).toordinal() - _EPOCH
+    except ValueError:
+        return None
+
+
+def day_param(value) -> int:
+    """Filtre tarihi → gün numarası; geçersizse FieldError (→ 400)."""
+    n = day_number(value if isinstance(value, date) else str(value))
+    if n is None:
+        raise FieldError(f"Geçersiz tarih: {value}")
+    return n
+
+
+def month_number(month: str) -> int:
+    """'YYYY-MM' → YYYYMM (sanal month kolonu / rollup anahtarı)."""
+    m = re.fullmatch(r"(\d{4})-(\d{2})", month or "")
+    if not m or not 1 <= int(m.group(2)) <= 12:
+        raise FieldError(f"Geçersiz ay: {month}")
+    return int(m.group(1)) * 100 + int(m.group(2))
+
+
+def month_text(m: int | None) -> str | None:
+    """YYYYMM → 'YYYY-MM' (0 / None = tarihsiz)."""
+    return f"{m // 100:04d}-{m % 100:02d}" if m else None
+
+
+def _row_to_dict(row, blobs: dict = None) -> dict:
+    """
+    Eski JSON formatıyla uyumlu çıktı. raw_text / qr_* sadece blobs verilirse
+    (detay) eklenir; listelerde has_qr yeterli.
+    """
+    out = {
         "id":        row["id"],
         "timestamp": row["timestamp"],
         "filename":  row["filename"],
         "needs_review": bool(row["needs_review"]),
-        "invoice_type": row["invoice_type"] if "invoice_type" in row.keys() else "expense",
+        "invoice_type": row["invoice_type"] or "expense",
+        "has_qr":    bool(row["has_qr"]),
         "data": {
             "vendor":          row["vendor"],
             "date":            row["date"],
@@ -171,24 +874,153 @@ def _row_to_dict(row) -> dict:
             "invoice_number":  row["invoice_number"],
             "category":        row["category"],
             "payment_method":  row["payment_method"],
-            "qr_raw":          row["qr_raw"],
-            "qr_parsed":       qp,
-            "raw_text":        row["raw_text"],
         },
     }
+    if blobs is not None:
+        out["data"].update(blobs)
+    return out
+
+
+# ── Liste projeksiyonu (fields=) ──────────────────────────
+# fields verilirse SELECT sadece istenen kolonları okur ve satırlar düz
+# dict olarak döner (iç içe "data" yok). legacy=True → eski iç içe şekil.
+LIST_FIELDS  = ("id", "timestamp", "filename", "vendor", "date", "time", "total",
+                "vat_rate", "vat_amount", "invoice_number", "category", "payment_method",
+                "needs_review", "invoice_type", "has_qr")
+_BOOL_FIELDS = ("needs_review", "has_qr")
+_LIST_COLS   = _cols(LIST_FIELDS)
+
+
+class FieldError(ValueError):
+    """fields= içinde bilinmeyen alan."""
+
+
+def projection(fields, extra: tuple = ()) -> tuple | None:
+    """
+    "vendor,total" (veya liste) → ("id", "vendor", "total"); boşsa None (tüm alanlar).
+    extra → bu endpoint'e özgü hesaplanan alanlar (örn. raw_excerpt).
+    """
+    if not fields:
+        return None
+    names = [f.strip() for f in (fields.split(",") if isinstance(fields, str) else fields)]
+    names = [n for n in names if n]
+    bad = [n for n in names if n not in LIST_FIELDS and n not in extra]
+    if bad:
+        raise FieldError(f"Bilinmeyen alan: {', '.join(bad)}")
+    return tuple(dict.fromkeys(["id", *names]))
+
+
+def _flat_rows(rows, names: tuple) -> list[dict]:
+    """Düz serializer — sıra SELECT listesiyle aynı, sadece bool dönüşümü."""
+    bools = [n for n in _BOOL_FIELDS if n in names]
+    out = [dict(zip(names, r)) for r in rows]      # keyset _k* kolonları zip'te düşer
+    for d in out:
+        for n in bools:
+            d[n] = bool(d[n])
+    return out
+
+
+def _list_shape(fields, legacy: bool = False, extra: tuple = ()):
+    """→ (SELECT kolonları, seçilen alanlar | None, rows → list serializer)."""
+    names = projection(fields, extra)
+    if names is None or legacy:
+        return _LIST_COLS, names, lambda rows: [_row_to_dict(r) for r in rows]
+    cols = tuple(n for n in names if n in LIST_FIELDS)
+    return _cols(cols), names, lambda rows: _flat_rows(rows, cols)
+
+
+def _item_key(name: str) -> str:
+    """Ürün adı gruplama anahtarı — büyük/küçük harf ve boşluk farkları birleşir."""
+    return " ".join((name or "").casefold().split())[:200]
+
+
+# Firma adının sonundaki hukuki ekler (noktalar birleştirildikten sonra: "a.ş." → "as")
+_LEGAL_SUFFIXES = frozenset({
+    "gmbh", "mbh", "ag", "kg", "kgaa", "ohg", "ug", "ek", "ev", "co", "cie",
+    "ltd", "limited", "llc", "llp", "lp", "inc", "corp", "corporation", "plc",
+    "sa", "sas", "sarl", "srl", "spa", "bv", "nv", "oy", "ab", "as",
+    "sti", "san", "tic", "ve",
+})
+_VKEY_DOTS = re.compile(r"(?<=\w)\.(?=\w)")
+_VKEY_SEP  = re.compile(r"[\W_]+")
+
+
+def vendor_key(name: str) -> str:
+    """
+    Firma eşleştirme anahtarı: casefold + aksan/ı → i + noktalama → boşluk,
+    sondaki hukuki ekler atılır. "REWE Markt GmbH" / "Rewe  Markt" → "rewe markt",
+    "Şok Marketler Tic. A.Ş." → "sok marketler".
+    """
+    s = _VKEY_DOTS.sub("", (name or "").casefold().replace("ı", "i"))
+    s = "".join(ch for ch in unicodedata.normalize("NFKD", s) if not unicodedata.combining(ch))
+    words = _VKEY_SEP.sub(" ", s).split()
+    while len(words) > 1 and words[-1] in _LEGAL_SUFFIXES:
+        words.pop()
+    return " ".join(words)[:200]
+
+
+def vendor_filter(vendor: str, user_id: str = None) -> tuple[str, list]:
+    """
+    Alt dize firma filtresi → (SQL koşulu, parametreler). LIKE '%x%' yerine
+    vendor_keys sözlüğünde arar, invoices'a vendor_key IN (...) ile index'ten iner.
+    """
+    needle = vendor_key(vendor)
+    sub, params = "instr(vendor_key, ?) > 0", [needle]
+    if user_id:
+        sub = "user_id=? AND " + sub
+        params.insert(0, user_id)
+    return f"vendor_key IN (SELECT vendor_key FROM vendor_keys WHERE {sub})", params
+
+
+def _replace_lines(c, inv_id, user_id, date, items, vat_lines) -> None:
+    """Faturanın ürün / KDV satırlarını (açık transaction içinde) yeniden yaz."""
+    c.execute("DELETE FROM invoice_items     WHERE invoice_id=?", (inv_id,))
+    c.execute("DELETE FROM invoice_vat_lines WHERE invoice_id=?", (inv_id,))
+    day = day_number(date)
+    item_rows = [
+        (inv_id, user_id, day, n, it["name"][:200], _item_key(it["name"]), cents(it.get("price")))
+        for n, it in enumerate(items or [])
+        if it.get("name")
+    ]
+    vat_rows = [
+        (inv_id, user_id, day, _f(v.get("rate")), cents(v.get("amount")))
+        for v in (vat_lines or [])
+        if _f(v.get("rate")) is not None
+    ]
+    if item_rows:
+        c.executemany(_ITEM_INSERT, item_rows)
+    if vat_rows:
+        c.executemany(_VATL_INSERT, vat_rows)
 
 
 # ── YAZMA ─────────────────────────────────────────────────
+# Tekil yazmalar tenant'ın shard yazıcısı üzerinden: eşzamanlı çağrılar group
+# commit ile tek transaction'da birleşir, çağıran kendi satırı commit edilince döner.
+def _insert_many(c, records: list, user_id: str = None) -> list[str]:
+    """[(record, filename)] → tek transaction'da executemany (açık transaction içinde)."""
+    now  = datetime.now().isoformat()
+    ids  = [str(uuid.uuid4()) for _ in records]
+    c.executemany(_INSERT, [_record_to_row(c, i, fn, now, r, user_id)
+                            for i, (r, fn) in zip(ids, records)])
+    _put_blobs(c, [_record_to_blobs(i, r) for i, (r, _) in zip(ids, records)])
+    for i, (r, _) in zip(ids, records):
+        if r.get("items") or r.get("vat_lines"):
+            _replace_lines(c, i, user_id, r.get("date"), r.get("items"), r.get("vat_lines"))
+    return ids
+
+
 def add_invoice(record: dict, filename: str, user_id: str = None) -> str:
-    inv_id = str(uuid.uuid4())
-    row    = _record_to_row(inv_id, filename, datetime.now().isoformat(), record, user_id)
-    with _LOCK:
-        with _conn() as c:
-            c.execute(
-                "INSERT INTO invoices VALUES (?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?,?)",
-                row,
-            )
-    return inv_id
+    return shard_for(user_id).writer.run(lambda c: _insert_many(c, [(record, filename)], user_id))[0]
+
+
+def add_invoices(records: list, user_id: str = None) -> list[str]:
+    """Toplu ekleme: [(record, filename)] → id listesi (aynı sırayla), tek commit."""
+    if not records:
+        return []
+    return shard_for(user_id).writer.run(lambda c: _insert_many(c, records, user_id))
+
+
+_DUP_COLS = _cols(("id", "vendor", "date", "total", "timestamp"))
 
 
 def find_duplicate(vendor: str, date: str, total: float,
@@ -202,24 +1034,26 @@ def find_duplicate(vendor: str, date: str, total: float,
         return None
     if not vendor and not invoice_number:
         return None
-    with _conn() as c:
+    key = vendor_key(vendor)
+    with shard_for(user_id).conn() as c:
         # invoice_number ile tam eşleşme (en güvenilir)
         if invoice_number:
             row = c.execute(
-                "SELECT id,vendor,date,total,timestamp FROM invoices "
-                "WHERE invoice_number=? AND LOWER(vendor)=LOWER(?) AND user_id=? LIMIT 1",
-                [invoice_number, vendor or "", user_id]
+                f"SELECT {_DUP_COLS} FROM invoices "
+                f"WHERE invoice_number=? AND vendor_key=? AND user_id=? AND {LIVE} LIMIT 1",
+                [invoice_number, key, user_id]
             ).fetchone()
             if row:
                 return dict(row)
         # vendor + date + total ile yumuşak eşleşme (±%2 tutar toleransı)
-        if vendor and date and total:
-            tol = abs(total) * 0.02 or 0.01
+        day = day_number(date)
+        if vendor and day is not None and total:
+            tol = max(cents(abs(total) * 0.02), 1)
             row = c.execute(
-                "SELECT id,vendor,date,total,timestamp FROM invoices "
-                "WHERE LOWER(vendor)=LOWER(?) AND date=? "
-                "AND ABS(total - ?) <= ? AND user_id=? LIMIT 1",
-                [vendor, date, total, tol, user_id]
+                f"SELECT {_DUP_COLS} FROM invoices "
+                "WHERE vendor_key=? AND day=? "
+                f"AND ABS(total_cents - ?) <= ? AND user_id=? AND {LIVE} LIMIT 1",
+                [key, day, cents(total), tol, user_id]
             ).fetchone()
             if row:
                 return dict(row)
@@ -229,129 +1063,257 @@ def find_duplicate(vendor: str, date: str, total: float,
 def find_recurring(vendor: str, months: int = 3,
                    user_id: str = None) -> list[dict]:
     """
-    Aynı firmadan son N ayda düzenli fatura var mı kontrol et.
+    Aynı firmadan son N ayda (başlangıç ayı dahil) düzenli fatura var mı kontrol et.
     user_id zorunlu — verilmezse boş liste döner (anonim IDOR engeli).
+    Aylık rollup'tan okunur — firmanın fatura sayısından bağımsız.
     """
     if not vendor or not user_id:
         return []
-    with _conn() as c:
+    with shard_for(user_id).conn() as c:
         rows = c.execute(
-            """
-            SELECT strftime('%Y-%m', date) as month,
-                   COUNT(*) as cnt,
-                   AVG(total) as avg_total,
-                   MIN(total) as min_total,
-                   MAX(total) as max_total
-            FROM invoices
-            WHERE LOWER(vendor)=LOWER(?)
-              AND date >= date('now', ?)
-              AND user_id=?
+            f"""
+            SELECT month,
+                   SUM(cnt) as cnt,
+                   SUM(gross_cents) / 100.0 / NULLIF(SUM(priced), 0) as avg_total
+            FROM invoice_rollup
+            WHERE user_id=?
+              AND month >= CAST(strftime('%Y%m', 'now', ?) AS INTEGER)
+              AND vendor_key=?
+              AND {LIVE}
             GROUP BY month
             ORDER BY month DESC
             """,
-            [vendor, f"-{months} months", user_id]
+            [user_id, f"-{months} months", vendor_key(vendor)]
         ).fetchall()
-    return [dict(r) for r in rows]
+    return [{**dict(r), "month": month_text(r["month"])} for r in rows]
 
 
-def update_invoice(inv_id: str, fields: dict) -> bool:
+def encode_fields(c, fields: dict) -> dict:
+    """
+    Okuma adlarıyla gelen alanlar (date, total, category, …) → v2 sütunları.
+    c: kod ataması için açık yazma transaction'ı. Geçersiz tarih → FieldError.
+    """
+    out = {}
+    for k, v in fields.items():
+        if k == "vendor":
+            out["vendor"]     = v
+            out["vendor_key"] = vendor_key(v) if v is not None else None
+        elif k == "date":
+            out["day"] = day_param(v) if v not in (None, "") else None
+        elif k == "total":
+            out["total_cents"] = cents(v)
+        elif k == "vat_amount":
+            out["vat_cents"] = cents(v)
+        elif k == "category":
+            out["cat_code"] = _code(c, "category", v)
+        elif k == "payment_method":
+            out["pay_code"] = _code(c, "payment", v)
+        elif k == "invoice_type":
+            out["type_code"] = TYPE_CODES.get(v or "expense", 0)
+        else:
+            out[k] = v
+    return out
+
+
+def update_invoice(inv_id: str, fields: dict, user_id: str) -> bool:
+    """
+    Elle düzeltme — user_id koşuluyla (başka tenant'ın faturası güncellenmez).
+    Verilen alanlar invoice_edits'e yazılır → yeniden ayrıştırma onları ezmez.
+    """
+    tenant(user_id)
     allowed = {"vendor", "date", "time", "total", "vat_rate", "vat_amount",
                "invoice_number", "category", "payment_method", "needs_review", "review_reason"}
     updates = {k: v for k, v in fields.items() if k in allowed}
     if not updates:
         return False
+    edited = list(updates)
     # needs_review otomatik kapat — total girilmişse
     if "total" in updates and updates["total"]:
         updates.setdefault("needs_review", 0)
         updates.setdefault("review_reason", None)
-    set_clause = ", ".join(f"{k}=?" for k in updates)
-    vals       = list(updates.values()) + [inv_id]
-    with _LOCK:
-        with _conn() as c:
-            cur = c.execute(f"UPDATE invoices SET {set_clause} WHERE id=?", vals)
-            return cur.rowcount > 0
+    if updates.get("date"):
+        day_param(updates["date"])          # kuyruğa girmeden 400
 
+    def _write(c) -> int:
+        enc = encode_fields(c, updates)
+        set_clause = ", ".join(f"{k}=?" for k in enc)
+        cur = c.execute(f"UPDATE invoices SET {set_clause} WHERE id=? AND user_id=?",
+                        [*enc.values(), inv_id, user_id])
+        if not cur.rowcount:
+            return 0
+        if "day" in enc:
+            c.execute("UPDATE invoice_items     SET day=? WHERE invoice_id=?", (enc["day"], inv_id))
+            c.execute("UPDATE invoice_vat_lines SET day=? WHERE invoice_id=?", (enc["day"], inv_id))
+        now = datetime.now().isoformat()
+        c.executemany("INSERT OR REPLACE INTO invoice_edits (invoice_id, field, edited_at) "
+                      "VALUES (?,?,?)", [(inv_id, f, now) for f in edited])
+        return cur.rowcount
 
-def get_review_queue(page: int = 1, per_page: int = 50) -> dict:
-    """needs_review=1 olan faturalar — elle düzeltme kuyruğu."""
-    total_cnt = 0
-    with _conn() as c:
-        total_cnt = c.execute(
-            "SELECT COUNT(*) FROM invoices WHERE needs_review=1"
-        ).fetchone()[0]
-        pages  = max(1, (total_cnt + per_page - 1) // per_page)
-        page   = max(1, min(page, pages))
-        offset = (page - 1) * per_page
-        rows   = c.execute(
-            "SELECT * FROM invoices WHERE needs_review=1 "
-            "ORDER BY timestamp DESC LIMIT ? OFFSET ?",
-            [per_page, offset],
-        ).fetchall()
+    return shard_for(user_id).writer.run(_write) > 0
+
+
+# ── KEYSET (CURSOR) SAYFALAMA ─────────────────────────────
+# OFFSET derin sayfalarda önceki tüm satırları tarayıp atar. Cursor son görülen
+# satırın sıralama anahtarıdır → her sayfa index'te tek seek, O(per_page).
+TS_KEYS    = ("timestamp", "id")
+DATE_KEYS  = ("COALESCE(day,-1000000)", "timestamp", "id")
+_SCALARS   = (str, int, float, type(None))
+_KEY_TYPES = {DATE_KEYS[0]: (int,)}         # COALESCE(day, …) → her zaman tamsayı
+
+
+class CursorError(ValueError):
+    """Bozuk / başka listeye ait cursor token'ı."""
+
+
+def encode_cursor(direction: str, values) -> str:
+    raw = json.dumps([direction, list(values)], separators=(",", ":"), ensure_ascii=False)
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip("=")
+
+
+def decode_cursor(token: str, keys: tuple) -> tuple[str, list]:
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        direction, values = json.loads(raw)
+    except Exception:
+        raise CursorError("Geçersiz cursor.")
+    if direction not in ("next", "prev") or not isinstance(values, list) or len(values) != len(keys):
+        raise CursorError("Geçersiz cursor.")
+    # Değerler SQL bind parametresi olur: sadece skalerler (bool / dict / list → 400, 500 değil)
+    for key, v in zip(keys, values):
+        if isinstance(v, bool) or not isinstance(v, _KEY_TYPES.get(key, _SCALARS)):
+            raise CursorError("Geçersiz cursor.")
+    return direction, values
+
+
+
+def _keyset_page(shards: list, cols: str, where: list, params: list, keys: tuple,
+                 per_page: int, cursor: str = None, page: int = 1) -> tuple[list, dict]:
+    """
+    Anahtara göre DESC sıralı sayfa → (rows, {"next_cursor", "prev_cursor"}).
+    cursor yoksa ve page > 1 ise geriye dönük uyumluluk için OFFSET kullanılır.
+    Birden fazla shard'da her shard'dan ilk offset + per_page + 1 satır alınır
+    ve anahtara göre birleştirilir (cursor koşulu her shard'da aynı).
+    """
+    direction, values = decode_cursor(cursor, keys) if cursor else ("next", None)
+    where, params = list(where), list(params)
+    if values is not None:
+        op = "<" if direction == "next" else ">"
+        where.append(f"({', '.join(keys)}) {op} ({', '.join('?' * len(keys))})")
+        params += values
+    order  = ", ".join(f"{k} {'DESC' if direction == 'next' else 'ASC'}" for k in keys)
+    kcols  = ", ".join(f"{k} AS _k{i}" for i, k in enumerate(keys))
+    w      = ("WHERE " + " AND ".join(where)) if where else ""
+    offset = (max(1, page) - 1) * per_page if values is None else 0
+    sql    = f"SELECT {cols}, {kcols} FROM invoices {w} ORDER BY {order} LIMIT ? OFFSET ?"
+    key    = lambda r: [r[f"_k{i}"] for i in range(len(keys))]
+    if len(shards) == 1:
+        rows = shards[0].conn().execute(sql, params + [per_page + 1, offset]).fetchall()
+    else:
+        parts = fan_out(lambda c: c.execute(sql, params + [offset + per_page + 1, 0]).fetchall(),
+                        shards)
+        merged = heapq.merge(*parts, key=lambda r: ["" if v is None else v for v in key(r)],
+                             reverse=direction == "next")
+        rows = list(merged)[offset:offset + per_page + 1]
+
+    more = len(rows) > per_page
+    rows = rows[:per_page]
+    if direction == "prev":
+        rows.reverse()
+    has_next = more if direction == "next" else values is not None
+    has_prev = (values is not None or offset > 0) if direction == "next" else more
+    return rows, {
+        "next_cursor": encode_cursor("next", key(rows[-1])) if rows and has_next else None,
+        "prev_cursor": encode_cursor("prev", key(rows[0]))  if rows and has_prev else None,
+    }
+
+
+def get_review_queue(user_id: str, page: int = 1, per_page: int = 50,
+                     cursor: str = None, with_count: bool = True,
+                     fields=None, legacy: bool = False) -> dict:
+    """
+    Tenant'ın needs_review=1 faturaları — elle düzeltme kuyruğu (idx_u_review).
+    fields → düz satırlar (bkz. projection); "raw_excerpt" istenirse eklenir.
+    """
+    cols, names, serialize = _list_shape(fields, legacy, extra=("raw_excerpt",))
+    excerpt = names is None or "raw_excerpt" in names
+    where, params = ["user_id=?", "needs_review=1", LIVE], [tenant(user_id)]
+    shards = _tenant_shards(user_id)            # arşiv düzenlenmez → sadece sıcak shard
+    total_cnt = pages = None
+    if with_count:
+        total_cnt = sum(fan_out(lambda c: c.execute(
+            f"SELECT COUNT(*) FROM invoices WHERE {' AND '.join(where)}", params
+        ).fetchone()[0], shards))
+        pages = max(1, (total_cnt + per_page - 1) // per_page)
+        page  = max(1, min(page, pages))
+    rows, cursors = _keyset_page(shards, cols, where, params, TS_KEYS, per_page, cursor, page)
+    # Kart önizlemesi için OCR metninin başı (sadece bu sayfanın satırları)
+    ids = [r["id"] for r in rows] if excerpt else []
+    texts: dict = {}
+    if ids:
+        for part in fan_out(lambda c: c.execute(
+            f"SELECT invoice_id, raw_text FROM invoice_blobs "
+            f"WHERE invoice_id IN ({','.join('?' * len(ids))})", ids
+        ).fetchall(), shards):
+            texts.update(dict(part))
+    invoices = serialize(rows)
+    if excerpt:
+        for inv in invoices:
+            text = _unpack(texts.get(inv["id"])) or ""
+            (inv["data"] if "data" in inv else inv)["raw_excerpt"] = (
+                text[:200] + ("…" if len(text) > 200 else ""))
     return {
         "count":    total_cnt,
         "page":     page,
         "pages":    pages,
         "per_page": per_page,
-        "invoices": [_row_to_dict(r) for r in rows],
+        **cursors,
+        "invoices": invoices,
     }
 
 
-def get_invoice(inv_id: str) -> dict | None:
-    with _conn() as c:
-        row = c.execute("SELECT * FROM invoices WHERE id=?", (inv_id,)).fetchone()
-    return _row_to_dict(row) if row else None
+def get_invoice(inv_id: str, user_id: str) -> dict | None:
+    """Detay: sıkıştırılmış OCR / QR metni sadece burada açılır (tenant'ın shard'ı, sonra arşiv)."""
+    for sh in partitions(tenant(user_id)):
+        c = sh.conn()
+        row = c.execute(f"SELECT {_LIST_COLS} FROM invoices WHERE id=? AND user_id=? AND {LIVE}",
+                        (inv_id, user_id)).fetchone()
+        if row:
+            return _row_to_dict(row, get_blobs(c, inv_id))
+    return None
 
 
 # ── SORGULAMA (SQL — 10M kayıtta O(log n)) ────────────────
 def query_invoices(
+    user_id: str,
     start=None, end=None, vendor=None, category=None,
     payment=None, invoice_no=None, min_amt=None, max_amt=None,
     page: int = 1, per_page: int = 100,
+    cursor: str = None, with_count: bool = True, include=(),
+    fields=None, legacy: bool = False,
 ) -> dict:
-    where, params = _build_where(start, end, vendor, category,
+    """
+    Tenant'ın faturaları (filtre + sayfa + özet); sadece onun shard'ı + aralığa düşen arşivler.
+    with_count=False → COUNT ve toplamlar atlanır (None döner); cursor'la
+    ilerleyen sonraki sayfalar özetleri yeniden hesaplamaz.
+    include → istenen facet'ler ("vendors", "categories"); istenmeyenler None.
+    fields  → sadece bu kolonlar, düz satırlar (legacy=True → iç içe "data").
+    """
+    cols, _, serialize = _list_shape(fields, legacy)
+    where, params = _build_where(user_id, start, end, vendor, category,
                                  payment, invoice_no, min_amt, max_amt)
     w = ("WHERE " + " AND ".join(where)) if where else ""
+    facets = _facets(include)
+    parts = partitions(user_id, _year(start), _year(end))
 
-    with _conn() as c:
-        # Toplam + aggregate (tek geçiş, SQL'de)
-        agg = c.execute(
-            f"SELECT COUNT(*) cnt, "
-            f"COALESCE(SUM(total),0) ts, COALESCE(SUM(vat_amount),0) vs "
-            f"FROM invoices {w}", params
-        ).fetchone()
-
-        total_cnt = agg["cnt"]
-        total_sum = round(agg["ts"], 2)
-        vat_sum   = round(agg["vs"], 2)
-
-        # Firma bazlı (ilk 50)
-        by_vendor = {
-            r["v"]: round(r["t"], 2)
-            for r in c.execute(
-                f"SELECT COALESCE(vendor,'bilinmiyor') v, COALESCE(SUM(total),0) t "
-                f"FROM invoices {w} GROUP BY v ORDER BY t DESC LIMIT 50",
-                params,
-            )
-        }
-
-        # Kategori bazlı
-        by_category = {
-            r["c"]: round(r["t"], 2)
-            for r in c.execute(
-                f"SELECT COALESCE(category,'bilinmiyor') c, COALESCE(SUM(total),0) t "
-                f"FROM invoices {w} GROUP BY c ORDER BY t DESC",
-                params,
-            )
-        }
+    total_cnt = total_sum = vat_sum = by_vendor = by_category = pages = None
+    if with_count or facets:
+        total_cnt, total_sum, vat_sum, by_vendor, by_category = _summary(w, params, facets, parts)
+    if with_count:
+        pages = max(1, (total_cnt + per_page - 1) // per_page)
+        page  = max(1, min(page, pages))
 
-        # Sayfalı sonuçlar
-        pages  = max(1, (total_cnt + per_page - 1) // per_page)
-        page   = max(1, min(page, pages))
-        offset = (page - 1) * per_page
-        rows   = c.execute(
-            f"SELECT * FROM invoices {w} ORDER BY timestamp DESC LIMIT ? OFFSET ?",
-            params + [per_page, offset],
-        ).fetchall()
+    # Sayfalı sonuçlar
+    rows, cursors = _keyset_page(parts, cols, where, params, TS_KEYS, per_page, cursor, page)
 
     return {
         "count":       total_cnt,
@@ -362,50 +1324,478 @@ def query_invoices(
         "page":        page,
         "per_page":    per_page,
         "pages":       pages,
-        "invoices":    [_row_to_dict(r) for r in rows],
+        **cursors,
+        "invoices":    serialize(rows),
     }
 
 
-def _build_where(start, end, vendor, category, payment, invoice_no, min_amt, max_amt):
-    where, params = [], []
+# ── Özet + facet'ler (tek geçiş, tenant + filtre başına cache) ────
+# Anahtar parametreleri user_id'yi içerir → her tenant'ın kendi girdisi. Geçerlilik
+# okunan dosyaların sürümleriyle: group-commit yazıcısı sadece kendi shard'ının
+# sürümünü artırır → bir tenant'ın yüklemesi diğer shard'lardaki tenant'ların
+# cache'ini boşaltmaz. Toplu işler (taşıma, arşiv, reparse, silme) global _VERSION'ı artırır.
+FACETS      = ("vendors", "categories")
+_FACET_TTL  = 60           # sn — başka process'lerin yazdıkları için üst sınır
+_FACET_MAX  = 1024
+_facet_cache: dict = {}    # (where, params, facets, dosyalar) → (ts, sürümler, sonuç)
+_VERSION    = 0            # bu process'teki her toplu yazmada artar → tüm cache geçersiz
+
+
+def _bump(sh: "Shard" = None):
+    """Yazma sonrası özet cache'ini geçersiz kıl: sh verilirse sadece o shard'ı okuyanlar."""
+    global _VERSION
+    if sh is None:
+        _VERSION += 1
+    else:
+        sh.version += 1
+
+
+def _versions(parts: list) -> tuple:
+    return (_VERSION, *(p.version for p in parts))
+
+
+_FACET_NAMES = {"vendors": "vendors", "by_vendor": "vendors",
+                "categories": "categories", "by_category": "categories"}
+
+
+def _facets(include) -> tuple:
+    """include="vendors,categories" (veya liste) → geçerli facet adları."""
+    if isinstance(include, str):
+        include = include.split(",")
+    wanted = {_FACET_NAMES.get(x.strip().lower()) for x in include or ()}
+    return tuple(f for f in FACETS if f in wanted)
+
+
+def _summary(w: str, params: list, facets: tuple = (), parts: list = None) -> tuple:
+    """
+    COUNT + toplamlar + istenen facet'ler → shard (parts: + arşiv yılı) başına tek
+    SQL geçişi. Facet istenirse (firma, kategori) grupları bir kez okunur ve Python'da
+    indirgenir; aynı filtrenin sonraki sayfaları cache'ten döner.
+    """
+    parts = SHARDS if parts is None else parts
+    key = (w, tuple(params), facets, tuple(p.path.name for p in parts))
+    hit = _facet_cache.get(key)
+    now = time.monotonic()
+    versions = _versions(parts)
+    if hit and hit[1] == versions and now - hit[0] < _FACET_TTL:
+        return hit[2]
+
+    if not facets:
+        aggs = fan_out(lambda c: c.execute(
+            f"SELECT COUNT(*) cnt, "
+            f"COALESCE(SUM(total_cents),0) / 100.0 ts, COALESCE(SUM(vat_cents),0) / 100.0 vs "
+            f"FROM invoices {w}", params
+        ).fetchone(), parts)
+        result = (sum(a["cnt"] for a in aggs), round(sum(a["ts"] for a in aggs), 2),
+                  round(sum(a["vs"] for a in aggs), 2), None, None)
+    else:
+        total_cnt, total_sum, vat_sum = 0, 0.0, 0.0
+        vendors: dict = {}
+        cats:    dict = {}
+        groups = fan_out(lambda c: c.execute(
+            f"SELECT COALESCE(vendor,'bilinmiyor') v, "
+            f"COALESCE((SELECT label FROM codes WHERE field='category' AND code=cat_code),"
+            f"'bilinmiyor') c, "
+            f"COUNT(*) cnt, COALESCE(SUM(total_cents),0) / 100.0 t, "
+            f"COALESCE(SUM(vat_cents),0) / 100.0 vs "
+            f"FROM invoices {w} GROUP BY vendor, cat_code", params
+        ).fetchall(), parts)
+        for r in (r for part in groups for r in part):
+            total_cnt += r["cnt"]
+            total_sum += r["t"]
+            vat_sum   += r["vs"]
+            vendors[r["v"]] = vendors.get(r["v"], 0.0) + r["t"]
+            cats[r["c"]]    = cats.get(r["c"], 0.0) + r["t"]
+
+        def _top(d, n=None):
+            items = sorted(d.items(), key=lambda kv: kv[1], reverse=True)[:n]
+            return {k: round(v, 2) for k, v in items}
+
+        result = (
+            total_cnt, round(total_sum, 2), round(vat_sum, 2),
+            _top(vendors, 50) if "vendors" in facets else None,       # firma bazlı (ilk 50)
+            _top(cats)        if "categories" in facets else None,
+        )
+
+    if len(_facet_cache) >= _FACET_MAX:
+        _facet_cache.pop(next(iter(_facet_cache)))
+    _facet_cache[key] = (now, versions, result)
+    return result
+
+
+_CODE_OF = "(SELECT code FROM codes WHERE field='%s' AND label=?)"
+
+
+def _build_where(user_id, start, end, vendor, category, payment, invoice_no, min_amt, max_amt):
+    """Tenant koşulu önde (idx_u_* index'leri) + filtreler → (koşullar, parametreler)."""
+    where, params = ["user_id=?", LIVE], [tenant(user_id)]
     if start:
-        where.append("date >= ?"); params.append(str(start))
+        where.append("day >= ?"); params.append(day_param(start))
     if end:
-        where.append("date <= ?"); params.append(str(end))
+        where.append("day <= ?"); params.append(day_param(end))
     if vendor:
-        where.append("vendor LIKE ?"); params.append(f"%{vendor}%")
+        sql, p = vendor_filter(vendor, user_id)
+        where.append(sql); params.extend(p)
     if category:
-        where.append("category = ?"); params.append(category)
+        where.append(f"cat_code = {_CODE_OF % 'category'}"); params.append(category)
     if payment:
-        where.append("payment_method = ?"); params.append(payment)
+        where.append(f"pay_code = {_CODE_OF % 'payment'}"); params.append(payment)
     if invoice_no:
-        where.append("invoice_number LIKE ?"); params.append(f"%{invoice_no}%")
+        if FTS_TOKENIZER == "trigram" and len(invoice_no) >= 3:
+            # trigram ifadesi = alt dize eşleşmesi → LIKE ile aynı sonuç, index'ten
+            where.append("rowid IN (SELECT rowid FROM invoices_fts WHERE invoices_fts MATCH ?)")
+            params.append('invoice_number : "' + invoice_no.replace('"', '""') + '"')
+        else:
+            where.append("invoice_number LIKE ?"); params.append(f"%{invoice_no}%")
     if min_amt is not None:
-        where.append("total >= ?"); params.append(min_amt)
+        where.append("total_cents >= ?"); params.append(cents(min_amt))
     if max_amt is not None:
-        where.append("total <= ?"); params.append(max_amt)
+        where.append("total_cents <= ?"); params.append(cents(max_amt))
+    return where, params
+
+
+# ── TAM METİN ARAMA (FTS5) ────────────────────────────────
+# Kendi içeriğini tutan FTS5 tablosu (rowid = invoices.rowid). OCR metni
+# invoices'ta değil, sıkıştırılmış invoice_blobs'ta olduğundan index'e
+# _put_blobs yazar; firma / fatura no / kategori değişiklikleri ve silme
+# trigger'larla senkron. trigram tokenizer alt dize aramasını her yazı
+# sisteminde (Latin, Arapça, CJK) index'ten yapar; SQLite < 3.34'te unicode61
+# (aksansız, önek araması) kullanılır.
+# Not: invoices rowid'i INTEGER PRIMARY KEY değil → VACUUM sonrası
+# rebuild_search_index() çalıştırılmalı.
+FTS_COLUMNS = ("vendor", "invoice_number", "category", "raw_text")
+FTS_WEIGHTS = (4.0, 6.0, 2.0, 1.0)      # bm25 sütun ağırlıkları (fatura no en güçlü)
+FTS_FIELDS  = {"vendor": "vendor", "invoice_no": "invoice_number",
+               "category": "category", "text": "raw_text"}
+FTS_TOKENIZER = None                    # _init_fts sonrası "trigram" | "unicode61"
+
+_FTS_INSERT = (
+    "INSERT INTO invoices_fts(rowid, vendor, invoice_number, category, raw_text) "
+    f"SELECT rowid, vendor, invoice_number, {_col('category')}, ? FROM invoices WHERE id=?"
+)
+
+
+def _fts_ddl(tokenizer: str) -> str:
+    return f"""
+CREATE VIRTUAL TABLE IF NOT EXISTS invoices_fts USING fts5(
+    {", ".join(FTS_COLUMNS)}, tokenize='{tokenizer}'
+);
+CREATE TRIGGER IF NOT EXISTS trg_fts_del AFTER DELETE ON invoices BEGIN
+    DELETE FROM invoices_fts WHERE rowid = OLD.rowid;
+END;
+CREATE TRIGGER IF NOT EXISTS trg_fts_upd AFTER UPDATE OF vendor, invoice_number, cat_code ON invoices BEGIN
+    UPDATE invoices_fts SET vendor = NEW.vendor, invoice_number = NEW.invoice_number,
+                            category = {_LEGACY["category"].format(p="NEW.")}
+    WHERE rowid = NEW.rowid;
+END;
+"""
+
+
+def _drop_legacy_fts(c) -> None:
+    """invoices'ı content tablosu olarak kullanan eski FTS düzeni (raw_text kolonuna bağlı)."""
+    row = c.execute("SELECT sql FROM sqlite_master WHERE name='invoices_fts'").fetchone()
+    if row and "content='invoices'" in row[0]:
+        for trg in ("trg_fts_ins", "trg_fts_del", "trg_fts_upd"):
+            c.execute(f"DROP TRIGGER IF EXISTS {trg}")
+        c.execute("DROP TABLE invoices_fts")
+
+
+def _fts_tokenizer(c) -> str | None:
+    """Mevcut FTS tablosunun tokenizer'ı (tablo yoksa None)."""
+    row = c.execute("SELECT sql FROM sqlite_master WHERE name='invoices_fts'").fetchone()
+    if not row:
+        return None
+    return "trigram" if "trigram" in row[0] else "unicode61"
+
+
+def _init_fts(c) -> bool:
+    """FTS tablosu + trigger'lar. Tablo yeni oluşturulduysa True (→ rebuild_search_index)."""
+    global FTS_TOKENIZER
+    tok = _fts_tokenizer(c)
+    if tok:
+        FTS_TOKENIZER = tok
+        c.executescript(_fts_ddl(FTS_TOKENIZER))         # eksik trigger varsa
+        return False
+    for tok in ("trigram", "unicode61 remove_diacritics 2"):
+        try:
+            c.executescript(_fts_ddl(tok))
+            FTS_TOKENIZER = tok.split()[0]
+            return True
+        except sqlite3.OperationalError as e:
+            print(f"[AutoTax] FTS5 tokenizer {tok.split()[0]}: {e}")
+    return False
+
+
+def rebuild_search_index(batch: int = 500) -> int:
+    """FTS index'ini invoices + invoice_blobs'tan baştan kur (migration / VACUUM sonrası)."""
+    return sum(_rebuild_fts(sh, batch) for sh in SHARDS)
+
+
+def _rebuild_fts(sh: Shard, batch: int = 500) -> int:
+    if not FTS_TOKENIZER:
+        return 0
+    with sh.lock:
+        with sh.conn() as c:
+            c.execute("DELETE FROM invoices_fts")
+    done, last = 0, 0
+    while True:
+        with sh.lock:
+            with sh.conn() as c:
+                n, last = _fts_batch(c, last, batch)
+        if not n:
+            break
+        done += n
+    return done
+
+
+def _fts_batch(c, last: int, batch: int) -> tuple[int, int]:
+    """rowid > last olan en fazla batch faturayı FTS'e yaz (açık transaction) → (adet, son rowid)."""
+    rows = c.execute(
+        f"SELECT i.rowid, i.vendor, i.invoice_number, {_col('category', 'i')}, b.raw_text "
+        "FROM invoices i LEFT JOIN invoice_blobs b ON b.invoice_id = i.id "
+        "WHERE i.rowid > ? ORDER BY i.rowid LIMIT ?", (last, batch)
+    ).fetchall()
+    c.executemany(
+        "INSERT INTO invoices_fts(rowid, vendor, invoice_number, category, raw_text) "
+        "VALUES (?,?,?,?,?)",
+        [(r[0], r[1], r[2], r[3], _unpack(r[4])) for r in rows],
+    )
+    return len(rows), rows[-1][0] if rows else last
+
+
+# ── AYLIK ROLLUP ──────────────────────────────────────────
+# Rapor / bütçe / defter özetleri ham satırları her istekte GROUP BY'lamaz:
+# (tenant, ay, tür, kategori, firma, KDV oranı) başına sayı + tutar toplamları
+# invoice_rollup'ta tutulur. invoices'taki her INSERT / UPDATE / DELETE aynı
+# transaction'da trigger'larla yansır (sharding kopyası, reparse dahil).
+#   • NULL anahtar kolonları '' / 0 (vat_rate: -1) olarak saklanır — PK'da NULL eşleşmez
+#   • month YYYYMM tamsayı, tutarlar kuruş → artımlı toplamlar kesin
+#   • priced / priced_vat: total'i olan faturalar (vergi raporu sadece onları sayar)
+#   • Ay hassasiyetinde: tarih aralığı ay sınırına denk gelmiyorsa ham sorgu kullanılır
+ROLLUP_KEYS = ("user_id", "month", "type_code", "cat_code", "vendor_key", "vat_rate")
+ROLLUP_SUMS = ("cnt", "priced", "gross_cents", "vat_cents", "priced_vat_cents")
+
+
+def _rollup_exprs(r: str = "") -> tuple:
+    """Bir fatura satırının rollup anahtarı (r: NEW / OLD / boş = tablo)."""
+    p = f"{r}." if r else ""
+    return (f"COALESCE({p}user_id,'')", f"COALESCE({p}month,0)",
+            f"{p}type_code", f"COALESCE({p}cat_code,0)",
+            f"COALESCE({p}vendor_key,'')", f"COALESCE({p}vat_rate,-1)")
+
+
+def _rollup_values(r: str = "") -> tuple:
+    """ROLLUP_SUMS katkıları."""
+    p = f"{r}." if r else ""
+    return ("1", f"{p}total_cents IS NOT NULL", f"COALESCE({p}total_cents,0)",
+            f"COALESCE({p}vat_cents,0)",
+            f"CASE WHEN {p}total_cents IS NOT NULL THEN COALESCE({p}vat_cents,0) ELSE 0 END")
+
+
+def _rollup_ddl() -> str:
+    keys = ", ".join(ROLLUP_KEYS)
+    add = (f"INSERT INTO invoice_rollup VALUES ({', '.join(_rollup_exprs('NEW') + _rollup_values('NEW'))}) "
+           f"ON CONFLICT ({keys}) DO UPDATE SET "
+           + ", ".join(f"{s} = {s} + excluded.{s}" for s in ROLLUP_SUMS) + ";")
+    old = " AND ".join(f"{k} = {e}" for k, e in zip(ROLLUP_KEYS, _rollup_exprs("OLD")))
+    sub = (f"UPDATE invoice_rollup SET "
+           + ", ".join(f"{s} = {s} - ({v})" for s, v in zip(ROLLUP_SUMS, _rollup_values("OLD")))
+           + f" WHERE {old};\n    DELETE FROM invoice_rollup WHERE {old} AND cnt <= 0;")
+    return f"""
+CREATE TABLE IF NOT EXISTS invoice_rollup (
+    user_id          TEXT    NOT NULL,
+    month            INTEGER NOT NULL,
+    type_code        INTEGER NOT NULL,
+    cat_code         INTEGER NOT NULL,
+    vendor_key       TEXT    NOT NULL,
+    vat_rate         INTEGER NOT NULL,
+    cnt              INTEGER NOT NULL,
+    priced           INTEGER NOT NULL,
+    gross_cents      INTEGER NOT NULL,
+    vat_cents        INTEGER NOT NULL,
+    priced_vat_cents INTEGER NOT NULL,
+    PRIMARY KEY ({keys})
+) WITHOUT ROWID;
+CREATE TRIGGER IF NOT EXISTS trg_rollup_ins AFTER INSERT ON invoices BEGIN
+    {add}
+END;
+CREATE TRIGGER IF NOT EXISTS trg_rollup_del AFTER DELETE ON invoices BEGIN
+    {sub}
+END;
+CREATE TRIGGER IF NOT EXISTS trg_rollup_upd AFTER UPDATE OF
+    user_id, day, type_code, cat_code, vendor_key, vat_rate, total_cents, vat_cents ON invoices BEGIN
+    {sub}
+    {add}
+END;
+"""
+
+
+_ROLLUP_GROUP = (
+    f"SELECT {', '.join(f'{e} AS {k}' for k, e in zip(ROLLUP_KEYS, _rollup_exprs()))}, "
+    f"COUNT(*) AS cnt, COUNT(total_cents) AS priced, COALESCE(SUM(total_cents),0) AS gross_cents, "
+    f"COALESCE(SUM(vat_cents),0) AS vat_cents, "
+    f"COALESCE(SUM(CASE WHEN total_cents IS NOT NULL THEN vat_cents END),0) AS priced_vat_cents "
+    f"FROM invoices GROUP BY 1, 2, 3, 4, 5, 6"         # sıra no: isimler ham kolona çözülür
+)
+
+
+def rebuild_rollup() -> int:
+    """Rollup'ı tüm shard'larda invoices'tan baştan kur; rollup satırı sayısı."""
+    return sum(_rebuild_rollup(sh) for sh in SHARDS)
+
+
+def _rebuild_rollup(sh: Shard) -> int:
+    with sh.lock:
+        with sh.conn() as c:
+            c.execute("DELETE FROM invoice_rollup")
+            c.execute(f"INSERT INTO invoice_rollup {_ROLLUP_GROUP}")
+            return c.execute("SELECT COUNT(*) FROM invoice_rollup").fetchone()[0]
+
+
+_MONTH_START = re.compile(r"^(\d{4})-(\d{2})-01$")
+_MONTH_END   = re.compile(r"^(\d{4})-(\d{2})-(\d{2})$")
+
+
+def month_span(date_from: str = None, date_to: str = None) -> tuple | None:
+    """
+    Tarih aralığı ay sınırlarına denk geliyorsa rollup ay aralığı (başlangıç, bitiş;
+    YYYYMM, None = sınırsız), değilse None (→ ham satırlardan hesapla).
+    """
+    m_from = m_to = None
+    if date_from:
+        m = _MONTH_START.match(date_from)
+        if not m:
+            return None
+        m_from = int(m.group(1)) * 100 + int(m.group(2))
+    if date_to:
+        m = _MONTH_END.match(date_to)
+        if not m:
+            return None
+        y, mo, d = (int(x) for x in m.groups())
+        if not 1 <= mo <= 12 or d < calendar.monthrange(y, mo)[1]:
+            return None
+        m_to = y * 100 + mo
+    return m_from, m_to
+
+
+def rollup_where(user_id: str | None, span: tuple) -> tuple[list, list]:
+    """month_span → invoice_rollup koşulları (tarihli aralıkta tarihsiz 0 ay hariç)."""
+    where, params = [LIVE], []
+    if user_id:
+        where.append("user_id=?"); params.append(user_id)
+    if span[0]:
+        where.append("month >= ?"); params.append(span[0])
+    if span[1]:
+        where.append("month <= ?"); params.append(span[1])
+        if not span[0]:
+            where.append("month > 0")
     return where, params
 
 
+def fts_query(q: str, field: str = None) -> str | None:
+    """
+    Kullanıcı metni → FTS5 MATCH ifadesi. Her kelime tırnaklı ifade (operatör
+    enjeksiyonu yok), kelimeler AND. trigram'da 3 karakterden kısa kelimeler
+    index'lenemez → atlanır; hiç kelime kalmazsa None.
+    """
+    if not FTS_TOKENIZER:
+        return None
+    trigram = FTS_TOKENIZER == "trigram"
+    terms = [t for t in (q or "").split() if len(t) >= (3 if trigram else 1)][:10]
+    if not terms:
+        return None
+    expr = " AND ".join('"' + t.replace('"', '""') + '"' + ("" if trigram else "*") for t in terms)
+    col  = FTS_FIELDS.get(field) if field else None
+    return f"{col} : ({expr})" if col else expr
+
+
+def search_invoices(user_id: str, q: str, field: str = None,
+                    page: int = 1, per_page: int = 20, with_count: bool = True) -> dict | None:
+    """
+    Tenant bazlı, bm25 ile sıralı tam metin arama. Her sonuçta "score"
+    (küçük = daha iyi) ve OCR metninden "snippet" bulunur. Sorgu index'lenemiyorsa None.
+    Arşiv yılları da aranır; sonuçlar score'a göre birleştirilir (bm25 istatistikleri
+    dosya başına → dosyalar arası sıra yaklaşık).
+    """
+    match = fts_query(q, field)
+    if match is None:
+        return None
+    weights = ", ".join(str(w) for w in FTS_WEIGHTS)
+    base = ("FROM invoices_fts JOIN invoices i ON i.rowid = invoices_fts.rowid "
+            f"WHERE invoices_fts MATCH ? AND i.user_id=? AND {live('i')}")
+    page = max(1, page)
+    offset = (page - 1) * per_page
+    parts = partitions(user_id)
+
+    def _search(c, limit: int, skip: int) -> tuple:
+        n = c.execute(f"SELECT COUNT(*) {base}", (match, user_id)).fetchone()[0] if with_count else 0
+        return n, c.execute(
+            f"SELECT {_cols(LIST_FIELDS, 'i')}, "
+            f"bm25(invoices_fts, {weights}) AS score, "
+            f"snippet(invoices_fts, 3, '[', ']', '…', 48) AS snippet "
+            f"{base} ORDER BY score LIMIT ? OFFSET ?",
+            (match, user_id, limit, skip),
+        ).fetchall()
+
+    if len(parts) == 1:
+        found = [_search(parts[0].conn(), per_page + 1, offset)]
+        rows = found[0][1]
+    else:
+        found = fan_out(lambda c: _search(c, offset + per_page + 1, 0), parts)
+        rows = list(heapq.merge(*(r for _, r in found), key=lambda r: r["score"]))
+        rows = rows[offset:offset + per_page + 1]
+    total_cnt = pages = None
+    if with_count:
+        total_cnt = sum(n for n, _ in found)
+        pages = max(1, (total_cnt + per_page - 1) // per_page)
+    more = len(rows) > per_page
+    return {
+        "query":    q,
+        "count":    total_cnt,
+        "page":     page,
+        "pages":    pages,
+        "per_page": per_page,
+        "has_more": more,
+        "invoices": [{**_row_to_dict(r), "score": round(r["score"], 4), "snippet": r["snippet"]}
+                     for r in rows[:per_page]],
+    }
+
+
 # ── STREAMING EXPORT (RAM sabit, N→∞) ────────────────────
 def iter_rows(
+    user_id: str,
     start=None, end=None, vendor=None, category=None,
     payment=None, invoice_no=None, min_amt=None, max_amt=None,
-    chunk: int = 2_000,
+    chunk: int = 2_000, blobs: tuple = (),
 ):
-    """SQLite cursor'ı chunk'lar halinde iter — RAM asla şişmez.
+    """Tenant'ın faturaları üzerinde SQLite cursor'ı chunk'lar halinde iter — RAM asla şişmez.
+
+    blobs → ek olarak açılacak sıkıştırılmış alanlar (örn. ("qr_raw",));
+    verilirse satırlar dict olarak döner. Birden fazla shard'da her shard'ın
+    sıralı cursor'ı timestamp'e göre birleştirilir (heapq.merge, yine sabit RAM).
 
     Kullanım:
-        for row in iter_rows(...):
+        for row in iter_rows(user_id, ...):
             # row: sqlite3.Row  (sözlük gibi erişim)
     """
-    where, params = _build_where(start, end, vendor, category,
+    where, params = _build_where(user_id, start, end, vendor, category,
                                  payment, invoice_no, min_amt, max_amt)
     w = ("WHERE " + " AND ".join(where)) if where else ""
-    sql = f"SELECT * FROM invoices {w} ORDER BY timestamp DESC"
-
-    conn = _conn()
-    conn.row_factory = sqlite3.Row
+    blobs = [b for b in blobs if b in BLOB_FIELDS]
+    extra = "".join(f", (SELECT {b} FROM invoice_blobs WHERE invoice_id = invoices.id) AS {b}"
+                    for b in blobs)
+    sql = f"SELECT {_LIST_COLS}{extra} FROM invoices {w} ORDER BY timestamp DESC"
+    streams = [_iter_shard(sh, sql, params, chunk, blobs)
+               for sh in partitions(user_id, _year(start), _year(end))]
+    if len(streams) == 1:
+        yield from streams[0]
+    else:
+        yield from heapq.merge(*streams, key=lambda r: r["timestamp"] or "", reverse=True)
+
+
+def _iter_shard(sh, sql: str, params: list, chunk: int, blobs: list):
+    # Ayrı bağlantı: generator askıdayken thread'in paylaşılan bağlantısı kullanılabilsin
+    conn = sh.pool.connect()
     try:
         cur = conn.cursor()
         cur.arraysize = chunk
@@ -414,26 +1804,39 @@ def iter_rows(
             batch = cur.fetchmany(chunk)
             if not batch:
                 break
-            yield from batch
+            if not blobs:
+                yield from batch
+                continue
+            for r in batch:
+                yield {**dict(r), **{b: _unpack(r[b]) for b in blobs}}
     finally:
         conn.close()
 
 
 # ── BASIT YARDIMCILAR ─────────────────────────────────────
 def count() -> int:
-    with _conn() as c:
-        return c.execute("SELECT COUNT(*) FROM invoices").fetchone()[0]
+    return sum(shard_counts()) + sum(archive_counts())
+
+
+def shard_counts() -> list[int]:
+    """Shard başına fatura sayısı (paralel fan-out)."""
+    return fan_out(lambda c: c.execute(f"SELECT COUNT(*) FROM invoices WHERE {LIVE}").fetchone()[0])
 
 
-def load_all() -> list:
+def archive_counts() -> list[int]:
+    """Arşiv yılı başına fatura sayısı (archives() sırasıyla)."""
+    parts = archives()
+    return fan_out(lambda c: c.execute(f"SELECT COUNT(*) FROM invoices WHERE {LIVE}").fetchone()[0],
+                   parts) if parts else []
+
+
+def load_all(user_id: str) -> list:
     """Geriye dönük uyumluluk — sadece küçük veri setleri için."""
-    with _conn() as c:
-        return [_row_to_dict(r) for r in
-                c.execute("SELECT * FROM invoices ORDER BY timestamp DESC")]
+    return [_row_to_dict(r) for r in iter_rows(user_id)]
 
 
-def load_page(page: int = 1, per_page: int = 100) -> tuple:
-    res = query_invoices(page=page, per_page=per_page)
+def load_page(user_id: str, page: int = 1, per_page: int = 100) -> tuple:
+    res = query_invoices(user_id, page=page, per_page=per_page)
     return res["invoices"], res["count"]
 
 
@@ -448,65 +1851,70 @@ def safe_float(inv: dict, field: str) -> float:
 
 # ── MUHASEBECI PAYLAŞIM YARDIMCILARI ─────────────────────
 def get_invoices_page(
+    user_id: str,
     page: int = 1, per_page: int = 50,
-    user_id: str = None,
     date_from: str = None, date_to: str = None,
     vendor: str = None,
+    cursor: str = None, with_count: bool = True,
+    fields=None, legacy: bool = False,
 ) -> dict:
-    """Sayfalı fatura listesi — share.py ve diğerleri için."""
-    where, params = [], []
-    if user_id:
-        where.append("user_id=?"); params.append(user_id)
+    """Sayfalı fatura listesi — share.py ve diğerleri için (fields → düz satırlar)."""
+    cols, _, serialize = _list_shape(fields, legacy)
+    where, params = ["user_id=?", LIVE], [tenant(user_id)]
     if date_from:
-        where.append("date >= ?"); params.append(date_from)
+        where.append("day >= ?"); params.append(day_param(date_from))
     if date_to:
-        where.append("date <= ?"); params.append(date_to)
+        where.append("day <= ?"); params.append(day_param(date_to))
     if vendor:
-        where.append("vendor LIKE ?"); params.append(f"%{vendor}%")
+        sql, p = vendor_filter(vendor, user_id)
+        where.append(sql); params.extend(p)
     w = ("WHERE " + " AND ".join(where)) if where else ""
 
-    with _conn() as c:
-        total_cnt = c.execute(
+    shards = partitions(user_id, _year(date_from), _year(date_to))
+    total_cnt = pages = None
+    if with_count:
+        total_cnt = sum(fan_out(lambda c: c.execute(
             f"SELECT COUNT(*) FROM invoices {w}", params
-        ).fetchone()[0]
-        pages  = max(1, (total_cnt + per_page - 1) // per_page)
-        page   = max(1, min(page, pages))
-        offset = (page - 1) * per_page
-        rows   = c.execute(
-            f"SELECT * FROM invoices {w} ORDER BY timestamp DESC LIMIT ? OFFSET ?",
-            params + [per_page, offset],
-        ).fetchall()
+        ).fetchone()[0], shards))
+        pages = max(1, (total_cnt + per_page - 1) // per_page)
+        page  = max(1, min(page, pages))
+    rows, cursors = _keyset_page(shards, cols, where, params, TS_KEYS, per_page, cursor, page)
     return {
         "count":    total_cnt,
         "page":     page,
         "pages":    pages,
         "per_page": per_page,
-        "invoices": [_row_to_dict(r) for r in rows],
+        **cursors,
+        "invoices": serialize(rows),
     }
 
 
 def get_ledger(
-    user_id: str = None,
+    user_id: str,
     date_from: str = None, date_to: str = None,
 ) -> dict:
-    """Gelir/gider özeti — muhasebe defteri."""
-    where, params = [], []
-    if user_id:
-        where.append("user_id=?"); params.append(user_id)
-    if date_from:
-        where.append("date >= ?"); params.append(date_from)
-    if date_to:
-        where.append("date <= ?"); params.append(date_to)
+    """Gelir/gider özeti — muhasebe defteri (ay sınırlı aralıkta rollup'tan)."""
+    span = month_span(date_from, date_to)
+    if span is not None:
+        where, params = rollup_where(tenant(user_id), span)
+        table, cnt, total, vat = "invoice_rollup", "SUM(cnt)", "SUM(gross_cents)", "SUM(vat_cents)"
+    else:
+        where, params = ["user_id=?", LIVE], [tenant(user_id)]
+        if date_from:
+            where.append("day >= ?"); params.append(day_param(date_from))
+        if date_to:
+            where.append("day <= ?"); params.append(day_param(date_to))
+        table, cnt, total, vat = "invoices", "COUNT(*)", "SUM(total_cents)", "SUM(vat_cents)"
     w = ("WHERE " + " AND ".join(where)) if where else ""
 
-    with _conn() as c:
-        rows = c.execute(
-            f"SELECT invoice_type, COUNT(*) as cnt, "
-            f"COALESCE(SUM(total),0) as total_sum, "
-            f"COALESCE(SUM(vat_amount),0) as vat_sum "
-            f"FROM invoices {w} GROUP BY invoice_type",
-            params
-        ).fetchall()
+    parts = fan_out(lambda c: c.execute(
+        f"SELECT {_col('invoice_type')}, {cnt} as cnt, "
+        f"COALESCE({total},0) / 100.0 as total_sum, "
+        f"COALESCE({vat},0) / 100.0 as vat_sum "
+        f"FROM {table} {w} GROUP BY type_code",
+        params
+    ).fetchall(), partitions(user_id, _year(date_from), _year(date_to)))
+    rows = [r for part in parts for r in part]
 
     summary = {"income": {"count": 0, "total": 0.0, "vat": 0.0},
                "expense": {"count": 0, "total": 0.0, "vat": 0.0}}
@@ -515,8 +1923,8 @@ def get_ledger(
         if t not in summary:
             summary[t] = {"count": 0, "total": 0.0, "vat": 0.0}
         summary[t]["count"] += r["cnt"]
-        summary[t]["total"] += round(r["total_sum"], 2)
-        summary[t]["vat"]   += round(r["vat_sum"],   2)
+        summary[t]["total"] = round(summary[t]["total"] + r["total_sum"], 2)
+        summary[t]["vat"]   = round(summary[t]["vat"] + r["vat_sum"], 2)
 
     income  = summary.get("income",  {}).get("total", 0)
     expense = summary.get("expense", {}).get("total", 0)
@@ -527,70 +1935,314 @@ def get_ledger(
     }
 
 
-# ── GDPR: Fatura Silme ────────────────────────────────────
+
+def _ledger_where(user_id, date_from, date_to, vendor) -> tuple[list, list, tuple]:
+    """Defter filtresi → (where, params, (vendor_sql, vendor_params)) — rollup'ta da vendor uygulanır."""
+    where, params = ["user_id=?", LIVE], [tenant(user_id)]
+    if date_from:
+        where.append("day >= ?"); params.append(day_param(date_from))
+    if date_to:
+        where.append("day <= ?"); params.append(day_param(date_to))
+    vendor_sql, vendor_params = vendor_filter(vendor, user_id) if vendor else (None, [])
+    if vendor_sql:
+        where.append(vendor_sql); params.extend(vendor_params)
+    return where, params, (vendor_sql, vendor_params)
+
+
+def get_ledger_page(
+    user_id: str,
+    date_from: str = None, date_to: str = None, vendor: str = None,
+    page: int = 1, per_page: int = 50,
+    cursor: str = None, with_count: bool = True,
+) -> dict:
+    """
+    Muhasebe defteri: gelir/gider özeti + aylık özet + sayfalı fatura listesi.
+    Sayfalar (date, timestamp, id) cursor'ı ile ilerler; with_count=False →
+    sayım ve özetler atlanır (sonraki sayfalarda tekrar hesaplanmaz).
+    """
+    where, params, (vendor_sql, vendor_params) = _ledger_where(user_id, date_from, date_to, vendor)
+    # Kullanıcının shard'ı + aralığın değdiği arşiv yılları
+    shards = partitions(user_id, _year(date_from), _year(date_to))
+
+    # Özetler: aralık ay sınırındaysa aylık rollup'tan (vendor_key kolonu orada da var),
+    # değilse ham satırlardan. İkisinde de month YYYYMM (invoices'ta sanal kolon),
+    # tutarlar kuruş; type_code 1 = gelir
+    span = month_span(date_from, date_to)
+    if span is not None:
+        agg_cond, agg_params = rollup_where(user_id, span)
+        if vendor_sql:
+            agg_cond.append(vendor_sql); agg_params.extend(vendor_params)
+        table = "invoice_rollup"
+        n, amt, vat = "cnt", "gross_cents", "vat_cents"
+    else:
+        agg_cond, agg_params = where, params
+        table = "invoices"
+        n, amt, vat = "1", "total_cents", "vat_cents"
+    agg_where = ("WHERE " + " AND ".join(agg_cond)) if agg_cond else ""
+
+    def _aggregate(con):
+        # Gelir / Gider özeti + toplam sayı
+        agg = con.execute(f"""
+            SELECT
+                COALESCE(SUM(CASE WHEN type_code=1 THEN {amt} ELSE 0 END), 0) / 100.0 AS total_income,
+                COALESCE(SUM(CASE WHEN type_code=0 THEN {amt} ELSE 0 END), 0) / 100.0 AS total_expense,
+                COALESCE(SUM(CASE WHEN type_code=1 THEN {vat} ELSE 0 END), 0) / 100.0 AS vat_income,
+                COALESCE(SUM(CASE WHEN type_code=0 THEN {vat} ELSE 0 END), 0) / 100.0 AS vat_expense,
+                COALESCE(SUM(CASE WHEN type_code=1 THEN {n} END), 0) AS count_income,
+                COALESCE(SUM(CASE WHEN type_code=0 THEN {n} END), 0) AS count_expense,
+                COALESCE(SUM({n}), 0) AS total
+            FROM {table} {agg_where}
+        """, agg_params).fetchone()
+
+        # Aylık özet
+        monthly = con.execute(f"""
+            SELECT
+                NULLIF(month,0) AS month,
+                COALESCE(SUM(CASE WHEN type_code=1 THEN {amt} ELSE 0 END),0) / 100.0 AS income,
+                COALESCE(SUM(CASE WHEN type_code=0 THEN {amt} ELSE 0 END),0) / 100.0 AS expense,
+                SUM({n}) AS count
+            FROM {table} {agg_where}
+            GROUP BY 1
+            ORDER BY 1 DESC
+        """, agg_params).fetchall()
+        return agg["total"], agg, monthly
+
+    total = agg = None
+    monthly = []
+    if with_count:
+        # Shard'larda paralel, sonra toplanır
+        parts = fan_out(_aggregate, shards)
+        total = sum(p[0] for p in parts)
+        agg   = {k: sum(p[1][k] for p in parts) for k in parts[0][1].keys()}
+        months: dict = {}
+        for _, _, rows in parts:
+            for r in rows:
+                m = months.setdefault(r["month"], {"month": month_text(r["month"]), "income": 0.0,
+                                                   "expense": 0.0, "count": 0})
+                m["income"]  += r["income"]
+                m["expense"] += r["expense"]
+                m["count"]   += r["count"]
+        monthly = sorted(months.values(), key=lambda m: m["month"] or "", reverse=True)
+
+    # Sayfalı fatura listesi (keyset — OFFSET yok)
+    rows, cursors = _keyset_page(
+        shards,
+        _cols(("id", "filename", "vendor", "date", "time", "total", "vat_amount", "invoice_number",
+               "category", "payment_method", "invoice_type", "needs_review", "timestamp")),
+        where, params, DATE_KEYS, per_page, cursor, page,
+    )
+
+    summary = {}
+    if agg is not None:
+        total_income  = round(float(agg["total_income"]),  2)
+        total_expense = round(float(agg["total_expense"]), 2)
+        net           = round(total_income - total_expense, 2)
+        summary = {
+            "total_income":  total_income,
+            "total_expense": total_expense,
+            "vat_income":    round(float(agg["vat_income"]),  2),
+            "vat_expense":   round(float(agg["vat_expense"]), 2),
+            "count_income":  agg["count_income"],
+            "count_expense": agg["count_expense"],
+            "net":           net,
+            "net_label":     "KAR" if net >= 0 else "ZARAR",
+        }
+
+    return {
+        "count":         total,
+        "page":          page,
+        "per_page":      per_page,
+        "pages":         max(1, -(-total // per_page)) if total is not None else None,
+        **cursors,
+        **summary,
+        "monthly": [
+            {
+                "month":   r["month"],
+                "income":  round(float(r["income"]),  2),
+                "expense": round(float(r["expense"]), 2),
+                "net":     round(float(r["income"]) - float(r["expense"]), 2),
+                "count":   r["count"],
+            }
+            for r in monthly
+        ],
+        "invoices": [
+            {
+                "id":             r["id"],
+                "vendor":         r["vendor"] or "",
+                "date":           r["date"] or "",
+                "time":           r["time"] or "",
+                "total":          r["total"],
+                "vat_amount":     r["vat_amount"],
+                "invoice_number": r["invoice_number"] or "",
+                "category":       r["category"] or "",
+                "payment_method": r["payment_method"] or "",
+                "invoice_type":   r["invoice_type"] or "expense",
+                "needs_review":   bool(r["needs_review"]),
+                "filename":       r["filename"] or "",
+            }
+            for r in rows
+        ],
+    }
+
+
+def iter_ledger_rows(user_id: str, date_from: str = None, date_to: str = None,
+                     vendor: str = None, chunk: int = 2_000):
+    """Defterin tüm faturaları (Excel export) — tarihe göre yeni → eski, sabit RAM."""
+    where, params, _ = _ledger_where(user_id, date_from, date_to, vendor)
+    cols = _cols(("invoice_type", "date", "vendor", "total", "vat_amount", "category",
+                  "payment_method", "invoice_number"))
+    sql = (f"SELECT {cols}, COALESCE(day,-1000000) AS _day FROM invoices "
+           f"WHERE {' AND '.join(where)} ORDER BY day DESC")
+    streams = [_iter_shard(sh, sql, params, chunk, [])
+               for sh in partitions(user_id, _year(date_from), _year(date_to))]
+    if len(streams) == 1:
+        yield from streams[0]
+    else:
+        yield from heapq.merge(*streams, key=lambda r: r["_day"], reverse=True)
+
+
+# ── ÜRÜN / KDV SATIRI ANALİZİ (index-only) ───────────────
+def _line_where(user_id, date_from, date_to) -> tuple[str, list]:
+    where, params = ["user_id=?", LIVE], [user_id]
+    if date_from:
+        where.append("day >= ?"); params.append(day_param(date_from))
+    if date_to:
+        where.append("day <= ?"); params.append(day_param(date_to))
+    return "WHERE " + " AND ".join(where), params
+
+
+def _line_parts(user_id, date_from, date_to) -> list:
+    return partitions(user_id, _year(date_from), _year(date_to))
+
+
+def top_items(user_id: str, date_from: str = None, date_to: str = None,
+              limit: int = 20) -> list[dict]:
+    """En çok harcama yapılan ürünler (idx_item_user üzerinden)."""
+    w, params = _line_where(user_id, date_from, date_to)
+    parts = _line_parts(user_id, date_from, date_to)
+    sql = (f"SELECT name_key, MAX(name) as name, COUNT(*) as count, "
+           f"COALESCE(SUM(price_cents),0) as spent "
+           f"FROM invoice_items {w} GROUP BY name_key ORDER BY spent DESC")
+    if len(parts) == 1:
+        groups = [parts[0].conn().execute(f"{sql} LIMIT ?", params + [limit]).fetchall()]
+    else:                               # yıllar arası toplam → tüm gruplar birleştirilir
+        groups = fan_out(lambda c: c.execute(sql, params).fetchall(), parts)
+    items: dict = {}
+    for r in (r for part in groups for r in part):
+        it = items.setdefault(r["name_key"], {"name": r["name"], "count": 0, "spent": 0})
+        it["name"]   = max(it["name"], r["name"])
+        it["count"] += r["count"]
+        it["spent"] += r["spent"]
+    top = sorted(items.values(), key=lambda it: it["spent"], reverse=True)[:limit]
+    return [{"name": it["name"], "count": it["count"], "spent": round(it["spent"] / 100, 2)}
+            for it in top]
+
+
+def item_spend(user_id: str, name: str, date_from: str = None,
+               date_to: str = None) -> dict:
+    """Tek ürün için aylık harcama dağılımı."""
+    w, params = _line_where(user_id, date_from, date_to)
+    groups = fan_out(lambda c: c.execute(
+        f"SELECT strftime('%Y-%m', day + 2440587.5) as month, COUNT(*) as count, "
+        f"COALESCE(SUM(price_cents),0) as spent, COUNT(price_cents) as priced "
+        f"FROM invoice_items {w} AND name_key=? GROUP BY month",
+        params + [_item_key(name)],
+    ).fetchall(), _line_parts(user_id, date_from, date_to))
+    merged: dict = {}
+    for r in (r for part in groups for r in part):
+        m = merged.setdefault(r["month"], {"count": 0, "spent": 0, "priced": 0})
+        for k in m:
+            m[k] += r[k]
+    months = [{"month": k, "count": m["count"], "spent": round(m["spent"] / 100, 2),
+               "avg_price": round(m["spent"] / m["priced"] / 100 if m["priced"] else 0, 2)}
+              for k, m in sorted(merged.items(), key=lambda kv: kv[0] or "")]
+    return {
+        "name":   name,
+        "count":  sum(m["count"] for m in months),
+        "spent":  round(sum(m["spent"] for m in months), 2),
+        "months": months,
+    }
+
+
+def vat_split(user_id: str, date_from: str = None, date_to: str = None) -> list[dict]:
+    """KDV oranı bazlı toplamlar (ör. %7 / %19) — UStVA için satır düzeyinde."""
+    w, params = _line_where(user_id, date_from, date_to)
+    groups = fan_out(lambda c: c.execute(
+        f"SELECT rate, COUNT(*) as lines, COUNT(DISTINCT invoice_id) as invoices, "
+        f"COALESCE(SUM(amount_cents),0) as vat "
+        f"FROM invoice_vat_lines {w} GROUP BY rate",
+        params,
+    ).fetchall(), _line_parts(user_id, date_from, date_to))
+    rates: dict = {}
+    for r in (r for part in groups for r in part):     # fatura tek dosyada → DISTINCT toplanabilir
+        m = rates.setdefault(r["rate"], {"lines": 0, "invoices": 0, "vat": 0})
+        for k in m:
+            m[k] += r[k]
+    return [{"rate": rate, "lines": m["lines"], "invoices": m["invoices"],
+             "vat": round(m["vat"] / 100, 2)} for rate, m in sorted(rates.items())]
+
+
+# ── GDPR: Fatura Silme (tenant silme: bkz. app/services/reaper.py) ────────────────────────────────────
+def upload_path(filename: str) -> Path | None:
+    """
+    Kayıttaki dosya adı → diskteki yol. Göreli adlar UPLOAD_DIR altında çözülür
+    (çalışma dizininde değil); dizin dışına çıkan göreli yollar (../) None.
+    """
+    if not filename:
+        return None
+    p = Path(filename)
+    if p.is_absolute():
+        return p
+    root = Path(settings.UPLOAD_DIR).resolve()
+    path = (root / p).resolve()
+    return path if path.is_relative_to(root) else None
+
+
 def _unlink_file(filename: str) -> None:
     """Dosyayı diskten güvenli şekilde sil (hata olursa sessizce geç)."""
-    if not filename:
+    path = upload_path(filename)
+    if path is None:
         return
     try:
-        Path(filename).unlink(missing_ok=True)
+        path.unlink(missing_ok=True)
     except Exception:
         pass
 
 
-def delete_user_invoices(user_id: str) -> int:
-    """Kullanıcıya ait tüm faturaları ve dosyalarını sil. Silinen kayıt sayısını döndürür."""
-    with _LOCK:
-        with _conn() as c:
-            # GDPR Madde 17: önce dosya yollarını al, sonra diskten sil
-            rows = c.execute(
-                "SELECT filename FROM invoices WHERE user_id=?", (user_id,)
-            ).fetchall()
-            for row in rows:
-                _unlink_file(row[0])
-            cur = c.execute("DELETE FROM invoices WHERE user_id=?", (user_id,))
-    return cur.rowcount
+def delete_invoice(invoice_id: str, user_id: str) -> bool:
+    """Tek fatura sil — user_id koşuluyla (başka kullanıcı silemez). Sıcak shard'da yoksa arşivde."""
+    sh = shard_for(user_id)
+    with sh.lock:
+        with sh.conn() as c:
+            deleted = _delete_one(c, invoice_id, user_id)
+        _bump()
+    if deleted is None:
+        for a in archives():
+            deleted = a.run(lambda c: _delete_one(c, invoice_id, user_id))
+            if deleted is not None:
+                _bump()
+                break
+    return bool(deleted)
 
 
-def delete_invoice(invoice_id: str, user_id: str) -> bool:
-    """Tek fatura sil — user_id koşuluyla (başka kullanıcı silemez)."""
-    with _LOCK:
-        with _conn() as c:
-            row = c.execute(
-                "SELECT filename FROM invoices WHERE id=? AND user_id=?",
-                (invoice_id, user_id)
-            ).fetchone()
-            if not row:
-                return False
-            _unlink_file(row[0])
-            cur = c.execute(
-                "DELETE FROM invoices WHERE id=? AND user_id=?",
-                (invoice_id, user_id)
-            )
+def _delete_one(c, invoice_id: str, user_id: str) -> bool | None:
+    """Açık transaction'da sil; fatura bu dosyada yoksa None."""
+    row = c.execute(
+        "SELECT filename FROM invoices WHERE id=? AND user_id=?",
+        (invoice_id, user_id)
+    ).fetchone()
+    if not row:
+        return None
+    _unlink_file(row[0])
+    c.execute("DELETE FROM invoice_items     WHERE invoice_id=?", (invoice_id,))
+    c.execute("DELETE FROM invoice_vat_lines WHERE invoice_id=?", (invoice_id,))
+    cur = c.execute(
+        "DELETE FROM invoices WHERE id=? AND user_id=?",
+        (invoice_id, user_id)
+    )
     return cur.rowcount > 0
 
 
-def purge_old_invoice_files(days: int = 90) -> int:
-    """
-    90 günden eski fatura görsellerini diskten sil, DB kaydını koru.
-    (privacy.html taahhüdünü yerine getirir — GDPR veri minimizasyonu Md.5/1-e)
-    """
-    from datetime import timedelta
-    cutoff = (datetime.utcnow() - timedelta(days=days)).isoformat()
-    with _LOCK:
-        with _conn() as c:
-            rows = c.execute(
-                "SELECT id, filename FROM invoices WHERE created_at < ? AND filename IS NOT NULL",
-                (cutoff,)
-            ).fetchall()
-            count = 0
-            for row in rows:
-                _unlink_file(row[1])
-                c.execute("UPDATE invoices SET filename=NULL WHERE id=?", (row[0],))
-                count += 1
-    return count
-
-
-# Başlatma
-_init()
+# Başlatma: import DB'ye dokunmaz — main.py startup hook'u / CLI'lar schema.migrate() çağırır
+schema.register("invoices", _init)
 
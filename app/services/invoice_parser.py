@@ -1,7 +1,17 @@
 import re
+import time
+from functools import lru_cache
 from typing import Optional
 
+from app.services import money_tokens
 
+# ── ReDoS koruması ────────────────────────────────────────
+# OCR metni saldırgan kontrolünde olabilir. Tüm desenler sınırlı quantifier
+# kullanır ve girdi MAX_TEXT ile kırpılır → her alan O(n), n ≤ MAX_TEXT.
+MAX_TEXT = 20_000
+
+
+@lru_cache(maxsize=16)
 def normalize(text: str) -> str:
     text = re.sub(r"[^\x20-\x7E\u0600-\u06FF\uAC00-\uD7A3\u4E00-\u9FFF\u3400-\u4DBF]+", " ", text)
     text = re.sub(r"[\u0617-\u061A\u064B-\u0652]", "", text)
@@ -17,48 +27,32 @@ def normalize(text: str) -> str:
 
 
 # ─── TOTAL (öncelikli label'lı eşleşmeleri tercih et) ────
-def parse_total(text: str) -> Optional[float]:
-    t  = normalize(text)
-    ar = str.maketrans("٠١٢٣٤٥٦٧٨٩", "0123456789")
-    t  = t.translate(ar)
-
-    # Tier 1 — açık "grand total / toplam / gesamt" etiketi (en güvenilir)
-    tier1 = [
-        r"(?:grand total|total ttc|net à payer|amount due|amount paid)\s*[:\-]?\s*([\d.,]+)",
-        r"(?:gesamtbetrag|gesamt|endbetrag|zu zahlen)\s*[:\-]?\s*([\d.,]+)",
-        r"(?:genel toplam|ödenecek tutar|odenecek tutar)\s*[:\-]?\s*([\d.,]+)",
-        r"(?:المجموع الإجمالي|الإجمالي المستحق)\s*[:\-]?\s*([\d.,٠-٩]+)",
-        r"(?:총합계|결제금액)\s*[:\-]?\s*([\d.,]+)",
-        r"(?:应付金额|實付金額)\s*[:\-]?\s*([\d.,]+)",
-    ]
-    # Tier 2 — genel "total / tutar / 합계" etiketi
-    tier2 = [
-        r"(?:total|subtotal|amount)\s*[:\-]?\s*([\d.,]+)",
-        r"(?:toplam|tutar|ara toplam)\s*[:\-]?\s*([\d.,]+)",
-        r"(?:summe|betrag|montant|importe)\s*[:\-]?\s*([\d.,]+)",
-        r"(?:المجموع|الإجمالي)\s*[:\-]?\s*([\d.,٠-٩]+)",
-        r"(?:합계|총액)\s*[:\-]?\s*([\d.,]+)",
-        r"(?:总计|合计)\s*[:\-]?\s*([\d.,]+)",
-    ]
-    # Tier 3 — para birimi öneki/soneki (en az güvenilir)
-    tier3 = [
-        r"([\d.,]+)\s?(?:USD|EUR|GBP|SAR|AED|EGP|TRY|TL|KRW|CNY|₺|€|£|\$|₩|¥|﷼)",
-    ]
+# Etiket token'ın hemen solunda olmalı (araya en fazla ":" / "-" ve para birimi)
+_LABEL_END = r"\s*[:\-]?\s*(?:[a-z]{2,3}|[€$£₺₩¥﷼])?\s*[:\-]?\s*$"
+
+# Tier 1 — açık "grand total / toplam / gesamt" etiketi (en güvenilir)
+_TOTAL_TIER1 = re.compile(
+    r"(?:grand total|total ttc|net à payer|amount due|amount paid"
+    r"|gesamtbetrag|gesamt|endbetrag|zu zahlen"
+    r"|genel toplam|ödenecek tutar|odenecek tutar"
+    r"|المجموع الإجمالي|الإجمالي المستحق|총합계|결제금액|应付金额|實付金額)" + _LABEL_END)
+# Tier 2 — genel "total / tutar / 합계" etiketi
+_TOTAL_TIER2 = re.compile(
+    r"(?:total|subtotal|amount|toplam|tutar|ara toplam|summe|betrag|montant|importe"
+    r"|المجموع|الإجمالي|합계|총액|总计|合计)" + _LABEL_END)
 
-    def _extract(patterns):
-        for p in patterns:
-            for m in re.findall(p, t, re.IGNORECASE):
-                raw = str(m).translate(ar)
-                try:
-                    val = float(raw.replace(",", ".")) if not re.search(r"\d{1,3}\.\d{3},\d{2}$", raw) \
-                          else float(raw.replace(".", "").replace(",", "."))
-                    if 0 < val < 10_000_000:
-                        return val
-                except ValueError:
-                    pass
-        return None
 
-    return _extract(tier1) or _extract(tier2) or _extract(tier3)
+def parse_total(text: str) -> Optional[float]:
+    toks = [t for t in money_tokens.amounts(text) if 0 < t.value < 10_000_000]
+    for tier in (_TOTAL_TIER1, _TOTAL_TIER2):
+        for tok in toks:
+            if tier.search(tok.label):
+                return tok.value
+    # Tier 3 — para birimi öneki/soneki (en az güvenilir)
+    for tok in toks:
+        if tok.currency:
+            return tok.value
+    return None
 
 
 # ─── DATE ─────────────────────────────────────────────────
@@ -97,7 +91,7 @@ def parse_date(text: str) -> Optional[str]:
     m = re.search(r"(\d{4})年\s*(\d{1,2})月\s*(\d{1,2})日", t)
     if m: y,mo,d=m.groups(); return f"{y}-{int(mo):02d}-{int(d):02d}"
 
-    m = re.search(r"(\d{1,2})\s+([\u0600-\u06FF]+)\s+(\d{4})", t)
+    m = re.search(r"(\d{1,2})\s+([\u0600-\u06FF]{2,12})\s+(\d{4})", t)
     if m:
         d,mw,y=m.groups()
         if mw in MONTHS: return f"{y}-{MONTHS[mw]:02d}-{int(d):02d}"
@@ -108,7 +102,7 @@ def parse_date(text: str) -> Optional[str]:
         try: return f"{int(y):04d}-{int(mo):02d}-{int(d):02d}"
         except ValueError: pass
 
-    m = re.search(r"(\d{1,2})\s+([A-Za-zÀ-ÿ]+)\s+(\d{4})", t)
+    m = re.search(r"(\d{1,2})\s+([A-Za-zÀ-ÿ]{3,12})\s+(\d{4})", t)
     if m:
         d,mw,y=m.groups()
         if mw.lower() in MONTHS: return f"{y}-{MONTHS[mw.lower()]:02d}-{int(d):02d}"
@@ -173,42 +167,33 @@ def parse_invoice_number(text: str) -> Optional[str]:
 COMMON_VAT_RATES = {5, 7, 8, 10, 12, 16, 18, 19, 20, 21, 22, 23, 25}
 
 
+_VAT_LABEL = r"(?:vat|kdv|mwst|tva|iva|gst|부가세|增值税)"
+_VAT_RATE_LABEL  = re.compile(_VAT_LABEL + r"\s*(?:rate|oranı|satz|taux|tasa)?\s*[:\-]?\s*%?$")
+_VAT_RATE_TRAIL  = re.compile(r"\s?%\s*(?:vat|kdv|mwst|tva|iva|gst)")
+_VAT_AMOUNT_LABEL = re.compile(
+    r"(?:vat|kdv|mwst|tva|iva|gst|ضريبة القيمة المضافة|الضريبة|부가세|부가가치세|增值税|税额)"
+    r"\s*(?:%?\s?\d{1,2}(?:[.,]\d{1,2})?\s?%?)?" + _LABEL_END)
+
+
 def parse_vat_rate(text: str) -> Optional[int]:
-    t = normalize(text)
-    # Önce etiketli arama
-    for p in [
-        r"(?:vat|kdv|mwst|tva|iva|gst|부가세|增值税)\s*(?:rate|oranı|satz|taux|tasa)?\s*[:\-]?\s*(\d{1,2})\s?%",
-        r"(\d{1,2})\s?%\s*(?:vat|kdv|mwst|tva|iva|gst)",
-    ]:
-        m = re.search(p, t, re.IGNORECASE)
-        if m:
-            v = int(m.group(1))
-            if 0 < v <= 30: return v
+    rates = [t for t in money_tokens.tokenize(text)
+             if t.kind == "percent" and t.decimals == 0 and 0 < t.value <= 30]
+    # Önce etiketli arama ("MwSt 19%" / "19% MwSt")
+    for tok in rates:
+        if _VAT_RATE_LABEL.search(tok.label) or _VAT_RATE_TRAIL.match(tok.trail):
+            return int(tok.value)
     # Fallback: sadece bilinen KDV oranlarına eşleş
-    for m in re.finditer(r"(\d{1,2})\s?%", t):
-        v = int(m.group(1))
-        if v in COMMON_VAT_RATES:
-            return v
+    for tok in rates:
+        if int(tok.value) in COMMON_VAT_RATES:
+            return int(tok.value)
     return None
 
 
 def parse_vat_amount(text: str) -> Optional[float]:
-    ar = str.maketrans("٠١٢٣٤٥٦٧٨٩", "0123456789")
-    t  = normalize(text).translate(ar)
-    for p in [
-        # Yüzde işareti olmayan tutar (19% sonrasındaki asıl KDV tutarı)
-        r"(?:vat|kdv|mwst|tva|iva|gst)\s*\d{0,2}%?\s*[:\-]?\s*([\d.,]+(?!\s?%))",
-        r"(?:ضريبة القيمة المضافة|الضريبة)\s*[:\-]?\s*([\d.,]+)",
-        r"(?:부가세|부가가치세)\s*[:\-]?\s*([\d.,]+)",
-        r"(?:增值税|税额)\s*[:\-]?\s*([\d.,]+)",
-    ]:
-        for raw in re.findall(p, t, re.IGNORECASE):
-            try:
-                v = float(raw.replace(",", "."))
-                if v > 0 and v < 1_000_000:
-                    return v
-            except ValueError:
-                pass
+    # Yüzde token'ları hariç (19% sonrasındaki asıl KDV tutarı)
+    for tok in money_tokens.amounts(text):
+        if 0 < tok.value < 1_000_000 and _VAT_AMOUNT_LABEL.search(tok.label):
+            return tok.value
     return None
 
 
@@ -251,15 +236,72 @@ def parse_payment_method(text: str) -> Optional[str]:
     return None
 
 
-def parse_invoice(text: str) -> dict:
-    return {
-        "vendor":         parse_vendor(text),
-        "date":           parse_date(text),
-        "time":           parse_time(text),
-        "total":          parse_total(text),
-        "invoice_number": parse_invoice_number(text),
-        "vat_rate":       parse_vat_rate(text),
-        "vat_amount":     parse_vat_amount(text),
-        "category":       parse_category(text),
-        "payment_method": parse_payment_method(text),
-    }
+# Alan öncelik sırası — süre limiti dolarsa en önemli alanlar zaten hesaplanmıştır
+def _field_parsers():
+    return (
+        ("total",          parse_total),
+        ("date",           parse_date),
+        ("vendor",         parse_vendor),
+        ("vat_amount",     parse_vat_amount),
+        ("vat_rate",       parse_vat_rate),
+        ("invoice_number", parse_invoice_number),
+        ("time",           parse_time),
+        ("category",       parse_category),
+        ("payment_method", parse_payment_method),
+    )
+
+
+def _run_budgeted(parsers, text: str, deadline: float | None, out: dict) -> dict:
+    """Parser'ları sırayla çalıştır; deadline geçtiyse kalanları atla (kısmi sonuç)."""
+    for field, fn in parsers:
+        if deadline is not None and time.perf_counter() > deadline:
+            out.setdefault(field, None)
+            out.setdefault("parse_timeout", []).append(field)
+            continue
+        out[field] = fn(text)
+    return out
+
+
+def parse_invoice(text: str, budget_ms: float = None) -> dict:
+    """
+    budget_ms: fatura başına süre limiti. Limit dolunca kalan alanlar None döner
+    ve "parse_timeout" listesine yazılır. Çalışan tek bir regex kesilemez; bu yüzden
+    alan başına süre MAX_TEXT + sınırlı desenlerle doğrusal tutulur.
+    """
+    text     = (text or "")[:MAX_TEXT]
+    deadline = time.perf_counter() + budget_ms / 1000 if budget_ms else None
+    return _run_budgeted(_field_parsers(), text, deadline, {})
+
+
+def parse_ocr_text(text: str, budget_ms: float = None) -> dict:
+    """
+    OCR metninin tam ayrıştırması — upload pipeline'ı ve toplu re-parse ortak kullanır.
+    parse_invoice + amount_parser total'ı + ürün kalemleri + oran bazlı KDV satırları.
+    budget_ms verilmezse settings.PARSE_BUDGET_MS uygulanır (0 = limitsiz).
+    """
+    from app.config import settings
+    from app.services.amount_parser import extract_total_amount
+    from items import extract_items
+    from vat   import extract_vat
+
+    if budget_ms is None:
+        budget_ms = settings.PARSE_BUDGET_MS
+    text     = (text or "")[:MAX_TEXT]
+    deadline = time.perf_counter() + budget_ms / 1000 if budget_ms else None
+
+    parsed = _run_budgeted(_field_parsers(), text, deadline, {})
+    extra  = _run_budgeted((
+        ("better_total", extract_total_amount),
+        ("items",        extract_items),
+        ("vat_lines",    extract_vat),
+    ), text, deadline, {})
+    if extra.get("better_total") is not None:
+        parsed["total"] = extra["better_total"]
+    parsed["items"]     = extra.get("items") or []
+    parsed["vat_lines"] = extra.get("vat_lines") or []
+    skipped = parsed.get("parse_timeout", []) + [
+        f for f in extra.get("parse_timeout", []) if f != "better_total"
+    ]
+    if skipped:
+        parsed["parse_timeout"] = skipped
+    return parsed
@@ -0,0 +1,183 @@
+"""
+AutoTax.cloud — Event loop gecikme (lag) izleme
+Uygulama içinde: arka plan görevi her LOOP_LAG_INTERVAL_MS'de uyanır; planlanan
+ile gerçek uyanma arasındaki fark event loop'un bloklandığı süredir. Eşiği
+aşan gecikmeler loglanır, metrikler /api/admin/loop'tan okunur.
+
+CLI (CI'da çalıştırılır): async route'ları ve middleware'i yavaşlatılmış bir
+DB, OCR motoru ve ayrıştırıcı ile eşzamanlı çağırır; asyncio debug modunun "slow callback" tespitiyle
+eşiği aşan tek bir bloklama bile exit code 1 verir. Geçici bir depolama
+dizininde (boş DB'ler, test kullanıcısı) çalışır → prod ortam değişkenleriyle
+çalıştırılsa bile gerçek DB'lere dokunmaz.
+
+Kullanım:
+    python -m app.services.loop_monitor                 # kontrol (eşik 50 ms)
+    python -m app.services.loop_monitor --threshold 20 --db-delay 100 --ocr-delay 100
+"""
+import asyncio
+import logging
+import sys
+import time
+
+from app.services.sandbox import isolated_storage
+
+logger = logging.getLogger("autotax.loop")
+
+_metrics = {"samples": 0, "max_ms": 0.0, "last_ms": 0.0, "over_threshold": 0}
+_task = None
+
+
+async def _watch(interval: float, threshold: float):
+    while True:
+        t0 = time.perf_counter()
+        await asyncio.sleep(interval)
+        lag = (time.perf_counter() - t0 - interval) * 1000
+        _metrics["samples"] += 1
+        _metrics["last_ms"]  = round(lag, 2)
+        if lag > _metrics["max_ms"]:
+            _metrics["max_ms"] = round(lag, 2)
+        if lag > threshold:
+            _metrics["over_threshold"] += 1
+            logger.warning("event loop %.0f ms bloklandı (eşik %.0f ms)", lag, threshold)
+
+
+def start():
+    """Çalışan event loop'ta izleyiciyi başlat (startup event'inden çağrılır)."""
+    from app.config import settings
+    global _task
+    if _task is None or _task.done():
+        _task = asyncio.get_running_loop().create_task(_watch(
+            settings.LOOP_LAG_INTERVAL_MS / 1000, settings.LOOP_LAG_THRESHOLD_MS))
+
+
+def stop():
+    global _task
+    if _task is not None:
+        _task.cancel()
+        _task = None
+
+
+def stats() -> dict:
+    from app.config import settings
+    return {"interval_ms": settings.LOOP_LAG_INTERVAL_MS,
+            "threshold_ms": settings.LOOP_LAG_THRESHOLD_MS, **_metrics}
+
+
+# ── CLI: bloklama kontrolü ────────────────────────────────
+class _SlowCallbacks(logging.Handler):
+    """asyncio debug modunun "Executing <...> took X seconds" uyarılarını toplar."""
+
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.records: list[str] = []
+
+    def emit(self, record):
+        msg = record.getMessage()
+        if msg.startswith("Executing "):
+            self.records.append(msg)
+
+
+async def _exercise(app, token: str, rounds: int, png: bytes):
+    import httpx
+    hdr = {"Authorization": f"Bearer {token}"}
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://check") as client:
+        calls = []
+        for _ in range(rounds):
+            calls += [
+                client.get("/api/health", headers=hdr),            # inject_user middleware
+                client.get("/api/stripe/plan", headers=hdr),       # async route
+                client.get("/api/ocr/review-queue?per_page=5", headers=hdr),
+                client.get("/api/stats/summary?per_page=5", headers=hdr),
+                client.post("/api/ocr/upload", headers=hdr,       # görüntü → OCR → parse → kayıt
+                            files={"file": ("receipt.png", png, "image/png")}),
+            ]
+        responses = await asyncio.gather(*calls)
+    return [r.status_code for r in responses]
+
+
+def check(threshold_ms: float = 50, db_delay_ms: float = 100, rounds: int = 5,
+          ocr_delay_ms: float = 100) -> list[str]:
+    """
+    Her DB bağlantı alımını db_delay_ms geciktirir (yavaş disk / kilit benzetimi);
+    OCR motoru ve fiş ayrıştırması da ocr_delay_ms sürer (uzun fiş benzetimi).
+    Bu çağrılar event loop thread'inde olursa slow callback olarak yakalanır.
+    OCR motoru sabit fiş metni döner → tesseract kurulu olmadan da çalışır.
+    Yapılandırılmış DB'lere şema + test kullanıcısı yazar — CLI (main) bunu geçici
+    dizinde çalıştırır.
+    """
+    from app.services import db, ocr_engine, schema
+    from app.services.warmup import RECEIPT_LINES, synthetic_receipt
+    from app.routes import ocr as ocr_route
+    from app.routes.auth import _make_access
+    from app.services.user_db import create_user, get_user_by_email
+    import main
+
+    schema.migrate()                # ASGITransport lifespan'ı çalıştırmaz → startup hook'u yok
+    email = "loop-monitor@autotax.local"
+    user  = get_user_by_email(email) or create_user(email, "loop-monitor-check", "Loop Monitor")
+    token = _make_access(user["id"], user["email"], user.get("plan", "free"))
+    png   = synthetic_receipt()
+
+    original = db.Pool.conn
+    run_ocr  = ocr_engine.run_ocr
+    parse    = ocr_route.parse_ocr_text
+
+    def slow_conn(self):
+        time.sleep(db_delay_ms / 1000)
+        return original(self)
+
+    def slow_ocr(png_bytes):
+        time.sleep(ocr_delay_ms / 1000)
+        return "\n".join(RECEIPT_LINES)
+
+    def slow_parse(text, *args, **kwargs):
+        time.sleep(ocr_delay_ms / 1000)
+        return parse(text, *args, **kwargs)
+
+    handler = _SlowCallbacks()
+    db.Pool.conn = slow_conn
+    ocr_engine.run_ocr = slow_ocr
+    ocr_route.parse_ocr_text = slow_parse
+    loop = asyncio.new_event_loop()
+    loop.set_debug(True)
+    loop.slow_callback_duration = threshold_ms / 1000
+    try:
+        # Isınma aynı loop'ta, aynı eşzamanlılıkla: ilk istekteki import / şema derleme
+        # ve anyio thread havuzunun büyümesi (loop başına) uygulama bloklaması değildir
+        loop.run_until_complete(_exercise(main.app, token, rounds, png))
+
+        logging.getLogger("asyncio").addHandler(handler)
+        codes = loop.run_until_complete(_exercise(main.app, token, rounds, png))
+    finally:
+        loop.close()
+        db.Pool.conn = original
+        ocr_engine.run_ocr = run_ocr
+        ocr_route.parse_ocr_text = parse
+        logging.getLogger("asyncio").removeHandler(handler)
+
+    failures = [f"HTTP {c}" for c in codes if c >= 500]
+    failures += handler.records
+    return failures
+
+
+def main(argv=None) -> int:
+    import argparse
+    ap = argparse.ArgumentParser(description="AutoTax event loop bloklama kontrolü")
+    ap.add_argument("--threshold", type=float, default=50, help="İzin verilen en uzun bloklama (ms)")
+    ap.add_argument("--db-delay",  type=float, default=100, help="DB bağlantısı başına yapay gecikme (ms)")
+    ap.add_argument("--ocr-delay", type=float, default=100, help="OCR / ayrıştırma başına yapay gecikme (ms)")
+    ap.add_argument("--rounds",    type=int,   default=5)
+    args = ap.parse_args(argv)
+
+    with isolated_storage("autotax-loop-"):
+        failures = check(args.threshold, args.db_delay, args.rounds, args.ocr_delay)
+    for line in failures:
+        print("FAIL", line)
+    print(f"{len(failures)} bloklama (eşik {args.threshold:.0f} ms, DB gecikmesi {args.db_delay:.0f} ms, "
+          f"OCR gecikmesi {args.ocr_delay:.0f} ms)")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
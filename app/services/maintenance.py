@@ -0,0 +1,332 @@
+"""
+AutoTax.cloud — SQLite bakımı: online yedek, WAL checkpoint, ANALYZE, incremental vacuum
+main.py'deki APScheduler örneğine schedule() ile eklenir; tüm adımlar açılmış
+her DB dosyası (fatura shard'ları + users.db, bkz. db.pools) için ayrı ayrı çalışır.
+
+  • checkpoint — her WAL_CHECKPOINT_S'de PASSIVE (kimseyi beklemez). Aralıkta
+    yazma az (≤ MAINT_IDLE_WRITES) ve WAL > WAL_TRUNCATE_MB ise TRUNCATE: WAL
+    dosyası sıfırlanır. Uzun okumalar (iter_rows export'u) checkpoint'i geride
+    bırakırsa lag_frames büyür ve loglanır; okuma bitince ilk sakin turda kapanır
+  • optimize — OPTIMIZE_INTERVAL_MIN'de bir sınırlı ANALYZE (analysis_limit) +
+    auto_vacuum=INCREMENTAL DB'lerde incremental_vacuum(VACUUM_PAGES)
+  • backup — gece BACKUP_HOUR'da SQLite online backup API'siyle BACKUP_DIR/<zaman>/;
+    tek adımlık kopya WAL okuma anlık görüntüsünden yapılır → yazmalar durmaz.
+    Son yedekten beri değişmeyen dosyalar önceki yedeğe hard link'lenir (artımlı),
+    BACKUP_KEEP'ten eski yedekler silinir. Yüklenen fatura dosyaları dahil değildir
+  • Tüm adımlar ayrı, kısa ömürlü bağlantıda; kilit beklemesi MAINT_BUSY_MS ile sınırlı
+  • Salt okunur havuzlar (arşiv yılları, bkz. app/services/archive.py) sadece yedeklenir:
+    WAL'leri yok, ANALYZE + sıkıştırma arşivlenirken bir kez yapılır
+
+Mevcut (auto_vacuum=NONE) DB'ler incremental vacuum'a tek seferlik, yazmaları
+durduran VACUUM'la geçer (--convert). VACUUM invoices rowid'lerini değiştirebilir →
+arama index'i ardından yeniden kurulur.
+
+Kullanım:
+    python -m app.services.maintenance               # WAL / boyut durumu
+    python -m app.services.maintenance --checkpoint  # PASSIVE (+ gerekirse TRUNCATE)
+    python -m app.services.maintenance --optimize
+    python -m app.services.maintenance --backup [--dest DIZIN]
+    python -m app.services.maintenance --convert     # auto_vacuum=INCREMENTAL'a geçiş (bakım penceresinde)
+"""
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from pathlib import Path
+
+from app.config import settings
+from app.services import db, db_writer, schema
+
+logger = logging.getLogger("autotax.maintenance")
+
+MB = 1024 * 1024
+ANALYSIS_LIMIT = 1000           # ANALYZE'ın index başına incelediği satır üst sınırı
+_MANIFEST = "manifest.json"
+
+# Dosya adı → son checkpoint / optimize sonuçları (stats)
+_state: dict = {}
+_last_backup: dict = {}
+_BACKUP_LOCK = threading.Lock()
+
+
+def _open(pool: db.Pool) -> sqlite3.Connection:
+    c = pool.connect()
+    c.execute(f"PRAGMA busy_timeout={max(0, settings.MAINT_BUSY_MS)}")
+    return c
+
+
+def _wal_bytes(pool: db.Pool) -> int:
+    try:
+        return os.path.getsize(f"{pool.path}-wal")
+    except OSError:
+        return 0
+
+
+def _writes(pool: db.Pool) -> int:
+    """Bu dosyanın group-commit yazıcılarının toplam iş sayısı (yük ölçüsü)."""
+    return sum(w.stats()["jobs"] for w in db_writer._WRITERS if w.pool is pool)
+
+
+def _entry(pool: db.Pool) -> dict:
+    return _state.setdefault(pool.path.name, {
+        "wal_bytes": 0, "log_frames": 0, "checkpointed": 0, "lag_frames": 0, "busy": 0,
+        "passive": 0, "truncate": 0, "failures": 0, "writes_seen": _writes(pool),
+        "last_passive": None, "last_truncate": None, "last_optimize": None,
+        "analyze_ms": None, "vacuumed_pages": 0, "error": None,
+    })
+
+
+# ── WAL checkpoint ────────────────────────────────────────
+def checkpoint_pool(pool: db.Pool) -> dict:
+    """PASSIVE; sakin aralıkta ve WAL büyükse TRUNCATE."""
+    st = _entry(pool)
+    writes = _writes(pool)
+    idle = writes - st["writes_seen"] <= settings.MAINT_IDLE_WRITES
+    st["writes_seen"] = writes
+    c = _open(pool)
+    try:
+        busy, log, done = c.execute("PRAGMA wal_checkpoint(PASSIVE)").fetchone()
+        st.update(passive=st["passive"] + 1, last_passive=datetime.now().isoformat(),
+                  busy=busy, log_frames=max(log, 0), checkpointed=max(done, 0),
+                  lag_frames=max(log - done, 0), error=None)
+        wal = _wal_bytes(pool)
+        if idle and wal > settings.WAL_TRUNCATE_MB * MB:
+            busy, log, done = c.execute("PRAGMA wal_checkpoint(TRUNCATE)").fetchone()
+            if not busy:
+                st.update(truncate=st["truncate"] + 1, last_truncate=datetime.now().isoformat(),
+                          busy=0, log_frames=0, checkpointed=0, lag_frames=0)
+        st["wal_bytes"] = _wal_bytes(pool)
+        if st["wal_bytes"] > 4 * settings.WAL_TRUNCATE_MB * MB and st["lag_frames"]:
+            logger.warning("WAL %s: %.0f MB, %d frame checkpoint edilemedi (uzun okuma?)",
+                           pool.path.name, st["wal_bytes"] / MB, st["lag_frames"])
+    except sqlite3.Error as e:
+        st.update(failures=st["failures"] + 1, error=f"{type(e).__name__}: {e}"[:300])
+        logger.warning("checkpoint %s failed: %s", pool.path.name, type(e).__name__)
+    finally:
+        c.close()
+    return dict(st)
+
+
+def checkpoint() -> list[dict]:
+    return [checkpoint_pool(p) for p in db.pools() if not p.readonly]
+
+
+# ── ANALYZE + incremental vacuum ──────────────────────────
+def optimize_pool(pool: db.Pool) -> dict:
+    """
+    Sınırlı ANALYZE (sqlite_stat1 → planlayıcı istatistikleri) ve serbest sayfaların
+    diske geri verilmesi. PRAGMA optimize sadece aynı bağlantının sorguladığı
+    tabloları ele aldığından burada ANALYZE doğrudan çalıştırılır.
+    """
+    st = _entry(pool)
+    c = _open(pool)
+    try:
+        t0 = time.perf_counter()
+        c.execute(f"PRAGMA analysis_limit={ANALYSIS_LIMIT}")
+        c.execute("ANALYZE")
+        c.commit()
+        st["analyze_ms"] = round((time.perf_counter() - t0) * 1000, 1)
+        if c.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            before = c.execute("PRAGMA freelist_count").fetchone()[0]
+            # execute() pragma'yı tek adım çalıştırır (1 sayfa); executescript sonuna kadar
+            c.executescript(f"PRAGMA incremental_vacuum({max(1, settings.VACUUM_PAGES)});")
+            st["vacuumed_pages"] += before - c.execute("PRAGMA freelist_count").fetchone()[0]
+        st.update(last_optimize=datetime.now().isoformat(), error=None)
+    except sqlite3.Error as e:
+        st.update(failures=st["failures"] + 1, error=f"{type(e).__name__}: {e}"[:300])
+        logger.warning("optimize %s failed: %s", pool.path.name, type(e).__name__)
+    finally:
+        c.close()
+    return dict(st)
+
+
+def optimize() -> list[dict]:
+    return [optimize_pool(p) for p in db.pools() if not p.readonly]
+
+
+def convert_incremental() -> list[dict]:
+    """
+    auto_vacuum=NONE DB'leri INCREMENTAL'a geçir (tam VACUUM — dosya boyunca yazmalar
+    bekler). Fatura shard'larında arama index'i ardından yeniden kurulur.
+    """
+    from app.services import invoice_db as idb
+    shards = {sh.path.resolve(): sh for sh in idb.SHARDS}
+    out = []
+    for pool in db.pools():
+        if pool.readonly:
+            continue
+        c = pool.connect()
+        try:
+            if c.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+                continue
+            sh = shards.get(pool.path.resolve())
+            t0 = time.perf_counter()
+            if sh is not None:
+                with sh.lock:
+                    c.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                    c.execute("VACUUM")
+                if idb.FTS_TOKENIZER:
+                    idb._rebuild_fts(sh)
+            else:
+                c.execute("PRAGMA auto_vacuum=INCREMENTAL")
+                c.execute("VACUUM")
+            out.append({"file": pool.path.name, "ms": round((time.perf_counter() - t0) * 1000),
+                        "auto_vacuum": c.execute("PRAGMA auto_vacuum").fetchone()[0]})
+        finally:
+            c.close()
+    return out
+
+
+# ── Online yedek ──────────────────────────────────────────
+def _signature(path: Path) -> list:
+    """DB + WAL dosyasının boyut / mtime'ı — değişmediyse yedek hard link'lenir."""
+    sig = []
+    for p in (path, Path(f"{path}-wal")):
+        try:
+            s = p.stat()
+            sig += [s.st_size, s.st_mtime_ns]
+        except OSError:
+            sig += [0, 0]
+    return sig
+
+
+def _snapshots(root: Path) -> list[Path]:
+    return sorted(p for p in root.iterdir()
+                  if p.is_dir() and not p.name.startswith(".") and (p / _MANIFEST).exists()) \
+        if root.exists() else []
+
+
+def _copy(pool: db.Pool, target: Path) -> None:
+    src = _open(pool)
+    dst = sqlite3.connect(str(target))
+    try:
+        src.backup(dst)             # tek adım: WAL anlık görüntüsü, yazıcı beklemez
+    finally:
+        dst.close()
+        src.close()
+
+
+def backup(dest: str = None, keep: int = None) -> dict:
+    """
+    Tüm DB dosyalarının tutarlı kopyası → <dest>/<YYYYmmddTHHMMSS>/. Geçici dizine
+    yazılır, manifest ile tamamlanınca yeniden adlandırılır (yarım yedek görünmez).
+    """
+    root = Path(dest or settings.BACKUP_DIR)
+    keep = settings.BACKUP_KEEP if keep is None else keep
+    if not _BACKUP_LOCK.acquire(blocking=False):
+        return dict(_last_backup, running=True)
+    try:
+        root.mkdir(parents=True, exist_ok=True)
+        stamp = datetime.now().strftime("%Y%m%dT%H%M%S")
+        n = 1
+        while (root / stamp).exists():      # aynı saniyede ikinci yedek
+            stamp, n = f"{stamp.split('-')[0]}-{n}", n + 1
+        for stale in root.glob(".*.tmp"):   # yarım kalmış önceki yedekler
+            shutil.rmtree(stale, ignore_errors=True)
+        tmp, target = root / f".{stamp}.tmp", root / stamp
+        tmp.mkdir()
+        prev = _snapshots(root)
+        prev_files = json.loads((prev[-1] / _MANIFEST).read_text())["files"] if prev else {}
+
+        t0 = time.perf_counter()
+        files = {}
+        for pool in db.pools():
+            name, sig = pool.path.name, _signature(pool.path)
+            old = prev_files.get(name)
+            mode = "copied"
+            if old and old["signature"] == sig and (prev[-1] / name).exists():
+                try:
+                    os.link(prev[-1] / name, tmp / name)
+                    mode = "linked"
+                except OSError:             # hard link desteklemeyen dosya sistemi
+                    pass
+            if mode == "copied":
+                _copy(pool, tmp / name)
+            files[name] = {"signature": sig, "mode": mode, "bytes": (tmp / name).stat().st_size}
+        (tmp / _MANIFEST).write_text(json.dumps(
+            {"created_at": datetime.now().isoformat(), "files": files}, indent=2))
+        tmp.rename(target)
+
+        for old in _snapshots(root)[:-max(1, keep)]:
+            shutil.rmtree(old, ignore_errors=True)
+        _last_backup.clear()
+        _last_backup.update(
+            path=str(target), ms=round((time.perf_counter() - t0) * 1000),
+            copied=sum(f["mode"] == "copied" for f in files.values()),
+            linked=sum(f["mode"] == "linked" for f in files.values()),
+            bytes=sum(f["bytes"] for f in files.values() if f["mode"] == "copied"),
+            finished_at=datetime.now().isoformat(), error=None,
+        )
+        logger.info("db backup %s: %d kopya, %d link, %d ms", target.name,
+                    _last_backup["copied"], _last_backup["linked"], _last_backup["ms"])
+    except (OSError, sqlite3.Error) as e:
+        logger.error("db backup failed: %s", type(e).__name__)
+        _last_backup.update(error=f"{type(e).__name__}: {e}"[:300],
+                            finished_at=datetime.now().isoformat())
+    finally:
+        _BACKUP_LOCK.release()
+    return dict(_last_backup)
+
+
+def start_backup() -> None:
+    """backup'ı arka plan thread'inde başlat (admin endpoint'i bloklamaz)."""
+    threading.Thread(target=backup, daemon=True).start()
+
+
+# ── Zamanlama + metrikler ─────────────────────────────────
+def schedule(scheduler) -> None:
+    """Bakım job'larını mevcut APScheduler örneğine ekle (main.py)."""
+    opts = {"max_instances": 1, "coalesce": True}
+    scheduler.add_job(checkpoint, "interval", seconds=max(5, settings.WAL_CHECKPOINT_S), **opts)
+    scheduler.add_job(optimize, "interval", minutes=max(1, settings.OPTIMIZE_INTERVAL_MIN), **opts)
+    scheduler.add_job(backup, "cron", hour=settings.BACKUP_HOUR, minute=30, **opts)
+
+
+def stats() -> dict:
+    """Dosya başına WAL boyutu, checkpoint lag'i, sayfa / boş sayfa sayıları + son yedek."""
+    files = []
+    for pool in db.pools():
+        st = _entry(pool)
+        c = pool.conn()
+        pages, free, av = (c.execute(f"PRAGMA {p}").fetchone()[0]
+                           for p in ("page_count", "freelist_count", "auto_vacuum"))
+        files.append({
+            "file": pool.path.name, **st, "wal_bytes": _wal_bytes(pool),
+            "page_count": pages, "freelist_count": free,
+            "auto_vacuum": {0: "none", 1: "full", 2: "incremental"}.get(av, av),
+            "seconds_since_truncate": round(time.time() - datetime.fromisoformat(
+                st["last_truncate"]).timestamp()) if st["last_truncate"] else None,
+        })
+    return {"files": files, "backup": dict(_last_backup) or None,
+            "backup_dir": settings.BACKUP_DIR}
+
+
+# ── CLI: python -m app.services.maintenance ───────────────
+if __name__ == "__main__":
+    import argparse
+    from app.services import invoice_db, user_db     # noqa: F401 — DB havuzlarını açar
+
+    ap = argparse.ArgumentParser(description="AutoTax SQLite bakımı")
+    ap.add_argument("--checkpoint", action="store_true", help="PASSIVE (+ sakinse TRUNCATE) checkpoint")
+    ap.add_argument("--optimize",   action="store_true", help="ANALYZE + incremental vacuum")
+    ap.add_argument("--backup",     action="store_true", help="Online yedek")
+    ap.add_argument("--dest",       help=f"Yedek dizini (varsayılan {settings.BACKUP_DIR})")
+    ap.add_argument("--convert",    action="store_true",
+                    help="auto_vacuum=INCREMENTAL'a geçiş (tam VACUUM, yazmaları bekletir)")
+    args = ap.parse_args()
+    schema.migrate()
+
+    logging.basicConfig(level=logging.INFO)
+    if args.convert:
+        print(json.dumps(convert_incremental(), indent=2))
+    if args.checkpoint:
+        checkpoint()
+    if args.optimize:
+        optimize()
+    if args.backup:
+        print(json.dumps(backup(args.dest), ensure_ascii=False, indent=2))
+    print(json.dumps(stats(), ensure_ascii=False, indent=2))
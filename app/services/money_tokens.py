@@ -0,0 +1,211 @@
+"""
+AutoTax.cloud — Tek geçişli tutar tokenizer'ı
+OCR metnini bir kez tarar ve tipli tutar token'ları üretir. Toplam, KDV,
+ürün kalemi ve extra çıkarıcıları aynı token akışını kullanır; böylece
+1.234,56 / 1,234.56 ayrımı her yerde aynı kuralla çözülür.
+
+Ondalık ayırıcı çözümü (belge düzeyinde):
+  • Hem "." hem "," varsa sondaki ondalıktır       1.234,56 → 1234.56
+  • Tek ayırıcı + 1-2 hane                          12,5 / 12.50 → ondalık
+  • Tek ayırıcı + 3 hane (belirsiz)                 1,799 / 1.234
+      – belgede bu ayırıcı ondalık olarak görülmüşse → ondalık
+      – diğer ayırıcı ondalıksa veya KRW/JPY gibi kuruşsuz para → binlik
+      – kanıt yoksa → ondalık (eski davranış)
+"""
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+
+# ── Sözlükler ─────────────────────────────────────────────
+KEYWORDS = {
+    "grand_total": ["grand total", "total ttc", "net à payer", "amount due", "amount paid",
+                    "gesamtbetrag", "gesamt", "endbetrag", "zu zahlen",
+                    "genel toplam", "ödenecek", "odenecek",
+                    "المجموع الإجمالي", "الإجمالي المستحق", "총합계", "결제금액", "应付金额", "實付金額"],
+    "total":       ["total", "subtotal", "amount", "summe", "betrag", "brutto", "montant", "payé",
+                    "importe", "toplam", "tutar", "المجموع", "الإجمالي", "합계", "총액", "总计", "合计"],
+    "vat":         ["vat", "kdv", "mwst", "ust", "steuer", "tva", "iva", "gst",
+                    "ضريبة", "부가세", "부가가치세", "增值税", "税额"],
+    "net":         ["netto"],
+    "discount":    ["rabatt", "discount", "gutschrift"],
+    "shipping":    ["versand", "shipping", "porto"],
+    "payment":     ["zahlung"],
+    "extra":       ["extra", "ekstra", "addon", "sos", "sauce", "dip", "ek ürün"],
+}
+
+# Para birimi kodu/sembolü → ISO kodu
+CURRENCIES = {
+    "€": "EUR", "eur": "EUR", "$": "USD", "usd": "USD", "£": "GBP", "gbp": "GBP",
+    "₺": "TRY", "tl": "TRY", "try": "TRY", "₩": "KRW", "krw": "KRW", "원": "KRW",
+    "¥": "CNY", "cny": "CNY", "元": "CNY", "rmb": "CNY", "jpy": "JPY",
+    "sar": "SAR", "﷼": "SAR", "aed": "AED", "egp": "EGP", "chf": "CHF",
+}
+ZERO_DECIMAL = {"KRW", "JPY"}
+
+# OCR harf hataları (invoice_parser.normalize ile aynı düzeltmeler, satır bazında)
+_OCR_FIXES = {"tot a l": "total", "t0tal": "total", "to tal": "total"}
+
+_DIGITS = str.maketrans("٠١٢٣٤٥٦٧٨٩۰۱۲۳۴۵۶۷۸۹٫٬", "01234567890123456789.,")
+
+# Sınırlı token: en fazla 19 karakter, öncesi rakam/ayırıcı, sonrası rakam değil → O(n)
+_NUM_RE = re.compile(r"(?<![\d.,])\d[\d.,]{0,18}(?!\d)")
+_CUR_AFTER  = re.compile(r"\s?(€|\$|£|₺|₩|¥|﷼|원|元|[A-Za-z]{2,3}\b)")
+_CUR_BEFORE = re.compile(r"(€|\$|£|₺|₩|¥|﷼|\b[A-Za-z]{2,3})\s?$")
+
+MAX_TEXT  = 20_000
+MAX_LINE  = 500
+LABEL_LEN = 40
+
+
+@dataclass(frozen=True)
+class AmountToken:
+    value:       float
+    raw:         str
+    kind:        str               # "amount" | "percent" (19% / %19)
+    currency:    str | None
+    line:        int               # satır indeksi (0'dan)
+    column:      int               # satır içi başlangıç
+    end:         int               # satır içi bitiş
+    decimals:    int               # ondalık hane sayısı (0 = tam sayı)
+    decimal_sep: str | None        # çözülmüş ondalık ayırıcı
+    keywords:    frozenset         # satırdaki KEYWORDS grupları
+    label:       str               # token'dan önceki metin (küçük harf, ≤40 karakter)
+    trail:       str               # token'dan sonraki metin (küçük harf, ≤40 karakter)
+
+
+def _seps(raw: str) -> tuple[str, list[str]]:
+    """raw → (sondaki ayırıcılar atılmış raw, ayırıcı listesi sırayla)."""
+    raw = raw.rstrip(".,")
+    return raw, [c for c in raw if c in ".,"]
+
+
+def _resolve(raw: str, dec_hint: str | None, zero_decimal: bool) -> tuple[float, int, str | None] | None:
+    """Tek token'ı sayıya çevir → (değer, ondalık hane, ondalık ayırıcı)."""
+    raw, seps = _seps(raw)
+    if not seps:
+        return float(raw), 0, None
+    kinds = set(seps)
+    if len(kinds) == 2:
+        dec  = seps[-1]
+        head, _, frac = raw.rpartition(dec)
+        groups = head.split("," if dec == "." else ".")
+        if dec in head or any(len(g) != 3 for g in groups[1:]):
+            return None
+        return float("".join(groups) + "." + frac), len(frac), dec
+    sep    = seps[0]
+    groups = raw.split(sep)
+    if len(groups) > 2:
+        if all(len(g) == 3 for g in groups[1:]):
+            return float("".join(groups)), 0, None          # 1.234.567
+        if len(groups[-1]) <= 2 and all(len(g) == 3 for g in groups[1:-1]):
+            return float("".join(groups[:-1]) + "." + groups[-1]), len(groups[-1]), sep
+        return None
+    head, frac = groups
+    if len(frac) == 3:
+        thousands = zero_decimal or (dec_hint is not None and dec_hint != sep)
+        if thousands:
+            return float(head + frac), 0, None
+    return float(head + "." + frac), len(frac), sep
+
+
+def parse_amount(value: str) -> float | None:
+    """Tek bir tutar metnini çöz (belge bağlamı olmadan)."""
+    value = (value or "").strip().translate(_DIGITS).replace(" ", "")
+    m = re.fullmatch(r"\d[\d.,]{0,18}", value)
+    if not m:
+        return None
+    r = _resolve(value, None, False)
+    return r[0] if r else None
+
+
+def _line_keywords(low: str) -> frozenset:
+    return frozenset(g for g, words in KEYWORDS.items() if any(w in low for w in words))
+
+
+def _currency(before: str, after: str) -> str | None:
+    m = _CUR_AFTER.match(after)
+    if m and m.group(1).lower() in CURRENCIES:
+        return CURRENCIES[m.group(1).lower()]
+    m = _CUR_BEFORE.search(before)
+    if m and m.group(1).lower() in CURRENCIES:
+        return CURRENCIES[m.group(1).lower()]
+    return None
+
+
+@lru_cache(maxsize=16)
+def tokenize(text: str) -> tuple[AmountToken, ...]:
+    """
+    Metni bir kez tara → belge sırasıyla AmountToken'lar.
+    Aynı metin için tekrar çağrılar cache'ten döner (tüm çıkarıcılar paylaşır).
+    """
+    lines = (text or "")[:MAX_TEXT].split("\n")
+    raw_tokens = []                 # (line_idx, m, line, low)
+    votes = {".": 0, ",": 0}
+    zero_decimal = False
+    prev_tail = ""
+    for li, line in enumerate(lines):
+        line = line[:MAX_LINE].translate(_DIGITS)
+        low  = line.lower()
+        for w, c in _OCR_FIXES.items():
+            low = low.replace(w, c.ljust(len(w)))       # kolonlar kaymasın
+        for m in _NUM_RE.finditer(line):
+            raw, seps = _seps(m.group(0))
+            if len(set(seps)) == 2:
+                votes[seps[-1]] += 1
+            elif len(seps) == 1 and len(raw) - raw.index(seps[0]) - 1 == 2:
+                votes[seps[0]] += 1
+            cur = _currency(line[max(0, m.start() - 6):m.start()], line[m.end():m.end() + 6])
+            if cur in ZERO_DECIMAL:
+                zero_decimal = True
+            raw_tokens.append((li, m, line, low, cur, prev_tail))
+        if line.strip():
+            prev_tail = low.strip()[-LABEL_LEN:]
+
+    dec_hint = None
+    if votes["."] != votes[","]:
+        dec_hint = "." if votes["."] > votes[","] else ","
+
+    tokens = []
+    kw_cache: dict = {}
+    for li, m, line, low, cur, prev_tail in raw_tokens:
+        resolved = _resolve(m.group(0), dec_hint, zero_decimal or cur in ZERO_DECIMAL)
+        if resolved is None:
+            continue
+        value, decimals, sep = resolved
+        after = line[m.end():]
+        # "19 %" / "19%" ve Türkçe önek yazımı "%19"
+        pct   = after[:2].lstrip()[:1] == "%" or (
+            line[m.start() - 1:m.start()] == "%"
+            and not line[max(0, m.start() - 3):m.start() - 1].strip()[-1:].isdigit())
+        kind  = "percent" if pct else "amount"
+        label = low[:m.start()][-LABEL_LEN:]
+        if not label.strip():
+            label = prev_tail + " "            # satır başı: etiket önceki satırda olabilir
+        if li not in kw_cache:
+            kw_cache[li] = _line_keywords(low)
+        tokens.append(AmountToken(
+            value=value, raw=m.group(0).rstrip(".,"), kind=kind,
+            currency=cur if kind == "amount" else None,
+            line=li, column=m.start(), end=m.start() + len(m.group(0).rstrip(".,")),
+            decimals=decimals, decimal_sep=sep,
+            keywords=kw_cache[li], label=label,
+            trail=low[m.end():m.end() + LABEL_LEN],
+        ))
+    return tuple(tokens)
+
+
+def amounts(text: str) -> list[AmountToken]:
+    """Sadece tutar token'ları (yüzdeler hariç)."""
+    return [t for t in tokenize(text) if t.kind == "amount"]
+
+
+def money(text: str) -> list[AmountToken]:
+    """Para formatındaki tutarlar (tam 2 ondalık hane: 12,99 / 1.299,00)."""
+    return [t for t in tokenize(text) if t.kind == "amount" and t.decimals == 2]
+
+
+def by_line(tokens) -> dict[int, list[AmountToken]]:
+    out: dict = {}
+    for t in tokens:
+        out.setdefault(t.line, []).append(t)
+    return out
@@ -0,0 +1,186 @@
+"""
+AutoTax.cloud — Parser mikro-benchmark'ı
+Temiz, gürültülü ve saldırgan (ReDoS) OCR metinleri üzerinde alan başına
+ayrıştırma süresini ölçer; limit aşılırsa veya baseline'a göre gerilerse
+exit code 1 döner (CI'da çalıştırılır).
+
+Kullanım:
+    python -m app.services.parser_bench                   # rapor + limit kontrolü
+    python -m app.services.parser_bench --save base.json  # baseline kaydet
+    python -m app.services.parser_bench --baseline base.json
+"""
+import json
+import random
+import statistics
+import sys
+import time
+
+from app.services import invoice_parser as ip
+from app.services import money_tokens
+from app.services.amount_parser import extract_total_amount
+from items import extract_items
+from vat   import extract_vat
+
+# Alan başına mutlak limit (ms, medyan) — makineden bağımsız kaba tavan
+LIMIT_MS = {
+    "clean":       5.0,
+    "noisy":       10.0,
+    "adversarial": 50.0,
+}
+# Baseline'a göre izin verilen yavaşlama (oran + sabit ms tolerans)
+REGRESSION_RATIO = 1.5
+REGRESSION_SLACK = 0.5
+
+FIELDS = {
+    "total":          ip.parse_total,
+    "date":           ip.parse_date,
+    "time":           ip.parse_time,
+    "vendor":         ip.parse_vendor,
+    "invoice_number": ip.parse_invoice_number,
+    "vat_rate":       ip.parse_vat_rate,
+    "vat_amount":     ip.parse_vat_amount,
+    "category":       ip.parse_category,
+    "payment_method": ip.parse_payment_method,
+    "amount_total":   extract_total_amount,
+    "items":          extract_items,
+    "vat_lines":      extract_vat,
+}
+
+# ── Korpus ────────────────────────────────────────────────
+CLEAN = {
+    "de": "REWE Markt GmbH\nRechnungsnr: R-2024-0042\nDatum 14.03.2024 12:31\n"
+          "Milch 1,29\nBrot 2,49\nKäse 4,99\nMwSt 7% 0,61\nMwSt 19% 0,80\n"
+          "SUMME EUR 8,77\nGesamtbetrag 8,77 EUR\nGirocard",
+    "en": "STARBUCKS COFFEE\nInvoice No: 55-1203\nDate 2024-03-14 08:02\n"
+          "Latte 4.50\nMuffin 3.25\nVAT 20% 1.29\nGrand Total 7.75 GBP\nVISA",
+    "fr": "CARREFOUR\nFacture: F2024-77\n14 mars 2024\nBaguette 1,10\n"
+          "TVA 5,5% 0,06\nTotal TTC 1,10 €\nCarte",
+    "es": "MERCADONA\nFactura 2024-991\n14 marzo 2024\nPan 0,95\nIVA 10% 0,09\n"
+          "Importe total 0,95 EUR\nEfectivo",
+    "tr": "MIGROS\nFatura No: MG-2024-1\n14.03.2024\nEkmek 12,50\nKDV %10 1,14\n"
+          "GENEL TOPLAM 12,50 TL\nNakit",
+    "ar": "كارفور\nرقم الفاتورة: ١٢٣٤\n١٤ مارس ٢٠٢٤\nخبز ٥٫٠٠\n"
+          "ضريبة القيمة المضافة ٠٫٧٥\nالمجموع الإجمالي ٥٫٧٥ SAR",
+    "ko": "이마트\n영수증 번호: 2024-88\n2024년 3월 14일\n우유 2,500\n부가세 227\n"
+          "결제금액 2,500 KRW\n카드",
+    "zh": "沃尔玛\n发票号码: 2024-66\n2024年3月14日\n牛奶 12.50\n增值税 1.44\n"
+          "应付金额 12.50 CNY\n现金",
+}
+
+
+def _noisy(text: str, seed: int) -> str:
+    """OCR gürültüsü: rastgele karakter bozulması + çöp satırlar."""
+    rnd   = random.Random(seed)
+    junk  = "|/\\_~^`'\";:.,-=+*#@!?1lI0O"
+    chars = [rnd.choice(junk) if c != "\n" and rnd.random() < 0.08 else c for c in text]
+    lines = "".join(chars).split("\n")
+    for _ in range(30):
+        lines.insert(rnd.randrange(len(lines) + 1),
+                     "".join(rnd.choice(junk + "abc123 ") for _ in range(rnd.randint(5, 80))))
+    return "\n".join(lines)
+
+
+ADVERSARIAL = {
+    "digit_run":      "1" * 20_000 + " x",
+    "comma_run":      "1," * 10_000,
+    "thousands_run":  "1" + ".234" * 5_000,
+    "label_spam":     "total " * 4_000,
+    "vat_digits_pct": "vat 1" + "1" * 20_000 + "%",
+    "arabic_digits":  "١" * 20_000,
+    "long_word_date": "1 " + "a" * 20_000 + " 2020",
+    "space_flood":    "SUMME" + " " * 20_000 + "1,00",
+    "percent_flood":  "19 %" * 5_000,
+    "one_long_line":  ("Artikel 1,99 " * 2_000),
+    "cjk_flood":      "合计" * 10_000,
+}
+
+
+def corpus() -> dict:
+    cases = {}
+    for lang, text in CLEAN.items():
+        cases[("clean", lang)] = text
+        cases[("noisy", lang)] = _noisy(text, seed=len(lang) * 7 + ord(lang[0]))
+    for name, text in ADVERSARIAL.items():
+        cases[("adversarial", name)] = text
+    return cases
+
+
+# ── Ölçüm ─────────────────────────────────────────────────
+def _measure(fn, text: str, repeat: int) -> float:
+    times = []
+    for _ in range(repeat):
+        ip.normalize.cache_clear()          # memo ölçümü bozmasın
+        money_tokens.tokenize.cache_clear()
+        t0 = time.perf_counter()
+        fn(text)
+        times.append((time.perf_counter() - t0) * 1000)
+    return statistics.median(times)
+
+
+def run(repeat: int = 5) -> dict:
+    """{"klass/case": {field: ms}} — alan başına medyan süre."""
+    results = {}
+    for (klass, name), text in corpus().items():
+        results[f"{klass}/{name}"] = {
+            field: round(_measure(fn, text, repeat if klass != "adversarial" else 3), 3)
+            for field, fn in FIELDS.items()
+        }
+        # Bütçeli uçtan uca ayrıştırma (pipeline'ın gördüğü süre)
+        results[f"{klass}/{name}"]["parse_ocr_text"] = round(
+            _measure(lambda t: ip.parse_ocr_text(t, budget_ms=0), text, 3), 3)
+    return results
+
+
+def check(results: dict, baseline: dict | None = None) -> list[str]:
+    failures = []
+    for case, fields in results.items():
+        klass = case.split("/", 1)[0]
+        limit = LIMIT_MS[klass]
+        for field, ms in fields.items():
+            # Uçtan uca süre tüm alanların toplamıdır → alan limiti x alan sayısı
+            cap = limit * len(FIELDS) if field == "parse_ocr_text" else limit
+            if ms > cap:
+                failures.append(f"{case} {field}: {ms:.2f} ms > limit {cap:.1f} ms")
+            old = (baseline or {}).get(case, {}).get(field)
+            if old is not None and ms > old * REGRESSION_RATIO + REGRESSION_SLACK:
+                failures.append(f"{case} {field}: {ms:.2f} ms (baseline {old:.2f} ms) regresyon")
+    return failures
+
+
+def _report(results: dict) -> str:
+    cols  = list(next(iter(results.values())).keys())
+    width = max(len(c) for c in results) + 2
+    lines = ["case".ljust(width) + " ".join(f"{c[:10]:>10}" for c in cols)]
+    for case, fields in results.items():
+        lines.append(case.ljust(width) + " ".join(f"{fields[c]:>10.3f}" for c in cols))
+    return "\n".join(lines)
+
+
+def main(argv=None) -> int:
+    import argparse
+    ap = argparse.ArgumentParser(description="AutoTax parser benchmark")
+    ap.add_argument("--repeat",   type=int, default=5)
+    ap.add_argument("--baseline", help="Karşılaştırılacak JSON baseline")
+    ap.add_argument("--save",     help="Sonuçları JSON baseline olarak kaydet")
+    args = ap.parse_args(argv)
+
+    results = run(repeat=args.repeat)
+    print(_report(results))
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+
+    failures = check(results, baseline)
+    for line in failures:
+        print("FAIL", line)
+    print(f"{len(results)} case, {len(failures)} hata")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
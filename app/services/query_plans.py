@@ -0,0 +1,146 @@
+"""
+AutoTax.cloud — Sorgu planı regresyon kontrolü
+Sıcak (tenant bazlı) sorguları gerçek fonksiyonları çağırarak yakalar ve her
+SELECT için EXPLAIN QUERY PLAN çalıştırır. Fatura tablolarında SCAN (tam tarama,
+covering index taraması dahil) görülürse veya beklenen index kullanılmazsa
+exit code 1 döner (CI'da çalıştırılır).
+
+Depoda pytest paketi yok; bu CLI EXPLAIN QUERY PLAN test paketinin yerini tutar.
+Geçici bir depolama dizininde (boş, migrate edilmiş DB'ler) çalışır → prod ortam
+değişkenleriyle çalıştırılsa bile gerçek DB'lere dokunmaz (bkz. sandbox.py).
+
+Kullanım:
+    python -m app.services.query_plans            # rapor + kontrol
+    python -m app.services.query_plans --verbose  # her sorgunun planı
+"""
+import re
+import sys
+
+from app.services.sandbox import isolated_storage
+
+USER = "query-plan-check"
+
+# Tam taramaya izin verilmeyen tablolar
+TABLES = ("invoices", "invoice_items", "invoice_vat_lines", "invoice_rollup")
+_SCAN  = re.compile(r"^SCAN (" + "|".join(TABLES) + r")\b")
+ROLLUP = "invoice_rollup USING PRIMARY KEY"
+
+
+def cases() -> list:
+    """(ad, çağrı, beklenen index öneki) — çağrı sırasında çalışan tüm SELECT'ler kontrol edilir."""
+    from app.services import budget
+    from app.services import invoice_db as idb
+    from app.routes   import tax
+    return [
+        ("find_duplicate/invoice_no",
+         lambda: idb.find_duplicate(None, None, None, invoice_number="R-1", user_id=USER), "idx_u_"),
+        ("find_duplicate/soft",
+         lambda: idb.find_duplicate("REWE", "2024-03-14", 8.77, user_id=USER), "idx_u_vkey"),
+        ("find_recurring",
+         lambda: idb.find_recurring("REWE", 3, user_id=USER), ROLLUP),
+        ("get_invoices_page/first",
+         lambda: idb.get_invoices_page(user_id=USER), "idx_u_ts"),
+        ("get_invoices_page/cursor",
+         lambda: idb.get_invoices_page(
+             user_id=USER, with_count=False,
+             cursor=idb.encode_cursor("next", ["2024-03-14T12:00:00", "x"])), "idx_u_ts"),
+        ("get_invoices_page/vendor",
+         lambda: idb.get_invoices_page(user_id=USER, vendor="rewe"), "idx_u_vkey"),
+        ("get_invoices_page/date",
+         lambda: idb.get_invoices_page(user_id=USER, date_from="2024-01-01", date_to="2024-03-31"), "idx_u_"),
+        ("get_ledger",
+         lambda: idb.get_ledger(user_id=USER, date_from="2024-01-01", date_to="2024-12-31"), ROLLUP),
+        ("get_ledger_page/month",
+         lambda: idb.get_ledger_page(USER, "2024-01-01", "2024-12-31"), ROLLUP),
+        ("get_ledger_page/range",
+         lambda: idb.get_ledger_page(USER, "2024-01-05", "2024-03-20"), "idx_u_"),
+        ("get_review_queue",
+         lambda: idb.get_review_queue(USER,
+                                      cursor=idb.encode_cursor("next", ["2024-03-14T12:00:00", "x"])),
+         "idx_u_review"),
+        ("get_invoice",
+         lambda: idb.get_invoice("x", USER), "sqlite_autoindex_invoices"),
+        ("query_invoices/summary",
+         lambda: idb.query_invoices(USER, include=idb.FACETS), "idx_u_"),
+        ("query_invoices/date",
+         lambda: idb.query_invoices(USER, start="2024-01-01", end="2024-03-31"), "idx_u_"),
+        ("query_invoices/vendor",
+         lambda: idb.query_invoices(USER, vendor="rewe"), "idx_u_vkey"),
+        ("query_invoices/category",
+         lambda: idb.query_invoices(USER, category="Market", payment="Karte"), "idx_u_"),
+        ("tax._build_report/year",    lambda: tax._build_report(USER, 2024),               ROLLUP),
+        ("tax._build_report/quarter", lambda: tax._build_report(USER, 2024, quarter=2),    ROLLUP),
+        ("tax._build_report/month",   lambda: tax._build_report(USER, 2024, month="2024-03"), ROLLUP),
+        ("budget.spent_by_category",  lambda: budget.spent_by_category(USER, "2024-03"),   ROLLUP),
+        ("top_items",                 lambda: idb.top_items(USER, "2024-01-01", "2024-12-31"), "idx_item_user"),
+        ("item_spend",                lambda: idb.item_spend(USER, "Milch"),                "idx_item_user"),
+        ("vat_split",                 lambda: idb.vat_split(USER, "2024-01-01", "2024-12-31"), "idx_vatl_user"),
+    ]
+
+
+def _capture(fn) -> list[str]:
+    """fn çalışırken fatura shard bağlantılarında yürütülen SELECT'ler."""
+    from app.services import invoice_db as idb
+    conns = [sh.conn() for sh in idb.SHARDS]
+    seen: list = []
+    for c in conns:
+        c.set_trace_callback(lambda sql: seen.append(sql))
+    idb._PARALLEL = False            # fan-out bu thread'de → izlenen bağlantılar kullanılır
+    try:
+        fn()
+    finally:
+        idb._PARALLEL = True
+        for c in conns:
+            c.set_trace_callback(None)
+    return [q for q in dict.fromkeys(seen) if q.lstrip().upper().startswith(("SELECT", "WITH"))]
+
+
+def _plan(sql: str) -> list[str]:
+    from app.services import invoice_db as idb
+    # Şema tüm shard'larda aynı → plan da aynı
+    return [r[3] for r in idb._conn().execute("EXPLAIN QUERY PLAN " + sql).fetchall()]
+
+
+def check(verbose: bool = False) -> list[str]:
+    failures = []
+    for name, fn, expect in cases():
+        queries = _capture(fn)
+        if not queries:
+            failures.append(f"{name}: hiç sorgu yakalanmadı")
+            continue
+        used = False
+        for sql in queries:
+            plan = _plan(sql)
+            if verbose:
+                print(f"-- {name}\n{' '.join(sql.split())}")
+                for step in plan:
+                    print("   ", step)
+            for step in plan:
+                if _SCAN.match(step):
+                    failures.append(f"{name}: tam tarama → {step}")
+                if expect in step:
+                    used = True
+        if not used:
+            failures.append(f"{name}: beklenen index {expect}* kullanılmadı")
+    return failures
+
+
+def main(argv=None) -> int:
+    import argparse
+    ap = argparse.ArgumentParser(description="AutoTax EXPLAIN QUERY PLAN kontrolü")
+    ap.add_argument("--verbose", action="store_true", help="Her sorgunun planını yazdır")
+    args = ap.parse_args(argv)
+
+    with isolated_storage("autotax-plans-"):
+        from app.services import schema
+        schema.migrate()
+        n = len(cases())
+        failures = check(verbose=args.verbose)
+    for line in failures:
+        print("FAIL", line)
+    print(f"{n} sorgu grubu, {len(failures)} hata")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
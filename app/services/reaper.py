@@ -0,0 +1,336 @@
+"""
+AutoTax.cloud — Tenant silme (GDPR Md.17, Unutulma Hakkı): tombstone + reaper
+Hesap silme isteği faturaları beklemeden gizler, diskten ve DB'den silme
+arka planda küçük batch'lerle yapılır; tamamlanma deletion_requests'te kanıtlanır.
+
+  • tombstone_tenant: her shard'ın tenant_tombstones tablosuna tek satır → live()
+    koşulu (bkz. invoice_db) tenant'ın tüm satırlarını anında tüm sorgulardan gizler
+  • Reaper tenant'ın faturalarını REAPER_BATCH'lik kilitsiz okumalarla alır,
+    dosyaları DB kilidi dışında retention'ın unlink thread'lerinde siler
+  • Satırlar (fatura + kalem + KDV satırı; blob / FTS / rollup trigger'larla) shard'ın
+    group-commit yazıcısıyla batch başına tek kısa transaction'da silinir
+  • Sıra önce dosya, sonra satır: silinemeyen dosyanın satırı kalır, sonraki
+    çalıştırmada tekrar denenir — diskte sahipsiz dosya kalmaz
+  • Shard'da satır kalmayınca tombstone aynı transaction'da kaldırılır; hiçbir shard'da
+    tombstone'u kalmayan istek "done" + completed_at olur
+  • Arşiv yılları (bkz. app/services/archive.py) da tombstone alır; arşivdeki
+    faturaların dosyası yoktur (retention'dan sonra taşınır) → satırlar batch'lerle silinir
+  • deletion_requests PII içermez: tenant sha256(user_id) ile tutulur (subject)
+
+Kullanım:
+    python -m app.services.reaper                  # bekleyen silmeleri tamamla
+    python -m app.services.reaper --status <id>    # tek isteğin durumu
+"""
+import hashlib
+import json
+import logging
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from app.config import settings
+from app.services import schema
+from app.services.invoice_db import _conn, _LOCK, SHARDS, archives
+from app.services.retention import unlink_uploads
+
+logger = logging.getLogger("autotax.reaper")
+
+_DDL = """
+CREATE TABLE IF NOT EXISTS deletion_requests (
+    id             TEXT PRIMARY KEY,
+    subject        TEXT NOT NULL,
+    status         TEXT NOT NULL,
+    invoices_total INTEGER NOT NULL DEFAULT 0,
+    invoices       INTEGER NOT NULL DEFAULT 0,
+    files          INTEGER NOT NULL DEFAULT 0,
+    missing        INTEGER NOT NULL DEFAULT 0,
+    failed         INTEGER NOT NULL DEFAULT 0,
+    batches        INTEGER NOT NULL DEFAULT 0,
+    requested_at   TEXT NOT NULL,
+    updated_at     TEXT,
+    completed_at   TEXT,
+    error          TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_delreq_subject ON deletion_requests(subject, requested_at);
+"""
+
+_COUNTERS = ("invoices", "files", "missing", "failed", "batches")
+
+_RUN_LOCK = threading.Lock()
+
+
+SCHEMA_VERSION = 1
+
+
+def _init_reaper():
+    with _LOCK:
+        schema.ensure(_conn(), "reaper", SCHEMA_VERSION, lambda c: c.executescript(_DDL))
+
+schema.register("reaper", _init_reaper)
+
+
+def subject(user_id: str) -> str:
+    """Kanıt kaydındaki tenant anahtarı — user_id'nin kendisi saklanmaz."""
+    return hashlib.sha256(user_id.encode()).hexdigest()
+
+
+# ── İstek ─────────────────────────────────────────────────
+def tombstone_tenant(user_id: str) -> dict:
+    """
+    Tenant'ı tüm shard'larda gizle + silme isteği oluştur (senkron, milisaniyeler).
+    Aynı tenant için bekleyen istek varsa o döner. Silmeyi reaper (run / start) yapar.
+    """
+    if not user_id:
+        raise ValueError("user_id gerekli")
+    with _conn() as c:
+        row = c.execute("SELECT request_id FROM tenant_tombstones WHERE user_id=?",
+                        (user_id,)).fetchone()
+    if row:
+        return get_request(row[0])
+
+    request_id = str(uuid.uuid4())
+    now = datetime.now().isoformat()
+    total = 0
+    # Shard 0 en son: isteğin kaydı oradaki tombstone ile aynı transaction'da
+    for sh in reversed(SHARDS):
+        def _mark(c, index=sh.index) -> int:
+            c.execute("INSERT OR IGNORE INTO tenant_tombstones (user_id, request_id, requested_at) "
+                      "VALUES (?,?,?)", (user_id, request_id, now))
+            n = c.execute("SELECT COUNT(*) FROM invoices WHERE user_id=?", (user_id,)).fetchone()[0]
+            if index == 0:
+                c.execute(
+                    "INSERT INTO deletion_requests (id,subject,status,invoices_total,"
+                    "requested_at,updated_at) VALUES (?,?,?,?,?,?)",
+                    (request_id, subject(user_id), "pending", total + n, now, now),
+                )
+            return n
+        total += sh.writer.run(_mark)
+    # Arşiv yılları shard'lardan sonra: arşivleme gizli tenant'ın satırlarını taşımaz
+    archived = 0
+    for a in archives():
+        def _mark_archive(c) -> int:
+            c.execute("INSERT OR IGNORE INTO tenant_tombstones (user_id, request_id, requested_at) "
+                      "VALUES (?,?,?)", (user_id, request_id, now))
+            return c.execute("SELECT COUNT(*) FROM invoices WHERE user_id=?", (user_id,)).fetchone()[0]
+        archived += a.run(_mark_archive)
+    if archived:
+        with _LOCK:
+            with _conn() as c:
+                c.execute("UPDATE deletion_requests SET invoices_total=invoices_total+? WHERE id=?",
+                          (archived, request_id))
+        total += archived
+    logger.info("GDPR tenant tombstoned request=%s invoices=%d", request_id, total)
+    return get_request(request_id)
+
+
+def get_request(request_id: str) -> dict | None:
+    with _conn() as c:
+        row = c.execute("SELECT * FROM deletion_requests WHERE id=?", (request_id,)).fetchone()
+    return _public(row) if row else None
+
+
+def requests_for(user_id: str) -> list[dict]:
+    """Bir tenant'ın silme istekleri (sha256 ile — kayıtta user_id yok)."""
+    with _conn() as c:
+        rows = c.execute("SELECT * FROM deletion_requests WHERE subject=? ORDER BY requested_at",
+                         (subject(user_id),)).fetchall()
+    return [_public(r) for r in rows]
+
+
+def list_requests(limit: int = 50, status: str = None) -> list[dict]:
+    where, params = ("WHERE status=?", [status]) if status else ("", [])
+    with _conn() as c:
+        rows = c.execute(f"SELECT * FROM deletion_requests {where} "
+                         f"ORDER BY requested_at DESC LIMIT ?", params + [limit]).fetchall()
+    return [_public(r) for r in rows]
+
+
+def _public(row) -> dict:
+    d = dict(row)
+    d.pop("subject", None)
+    return d
+
+
+def _update(request_id: str, status: str = None, error: str = None, delta: dict = None):
+    delta = delta or dict.fromkeys(_COUNTERS, 0)
+    now = datetime.now().isoformat()
+    with _LOCK:
+        with _conn() as c:
+            c.execute(
+                "UPDATE deletion_requests SET updated_at=?, error=?, "
+                "status=COALESCE(?, status), "
+                "completed_at=CASE WHEN ?='done' THEN ? ELSE completed_at END, "
+                + ", ".join(f"{k}={k}+?" for k in _COUNTERS) + " WHERE id=?",
+                (now, error, status, status, now, *(delta[k] for k in _COUNTERS), request_id),
+            )
+
+
+# ── Reaper ────────────────────────────────────────────────
+def _reap_batch(sh, user_id: str, rows: list) -> tuple[dict, list]:
+    """Dosyaları sil (kilitsiz), sonra dosyası gitmiş faturaların satırlarını sil."""
+    named   = [r for r in rows if r["filename"]]
+    results = dict(zip((r["id"] for r in named), unlink_uploads([r["filename"] for r in named])))
+    gone    = [r["id"] for r in rows if results.get(r["id"], ("missing", 0))[0] != "failed"]
+    kept    = [r["id"] for r in rows if results.get(r["id"], ("missing", 0))[0] == "failed"]
+
+    def _delete(c) -> int:
+        marks = ",".join("?" * len(gone))
+        c.execute(f"DELETE FROM invoice_items     WHERE invoice_id IN ({marks})", gone)
+        c.execute(f"DELETE FROM invoice_vat_lines WHERE invoice_id IN ({marks})", gone)
+        return c.execute(f"DELETE FROM invoices WHERE user_id=? AND id IN ({marks})",
+                         [user_id, *gone]).rowcount
+
+    delta = dict.fromkeys(_COUNTERS, 0)
+    delta["invoices"] = sh.writer.run(_delete) if gone else 0
+    delta["batches"]  = 1
+    for res, _ in results.values():
+        delta["files" if res == "removed" else res] += 1
+    return delta, kept
+
+
+def _reap_shard(sh, user_id: str, request_id: str) -> bool:
+    """Tenant'ı bu shard'dan sil; True → satır kalmadı, tombstone kaldırıldı."""
+    batch = max(10, min(settings.REAPER_BATCH, 2_000))
+    pause = settings.REAPER_PAUSE_MS / 1000
+    skipped: list = []                  # dosyası silinemeyenler (bu çalıştırmada tekrar alınmaz)
+    while True:
+        rows = sh.conn().execute(
+            "SELECT id, filename FROM invoices WHERE user_id=? "
+            "AND id NOT IN (SELECT value FROM json_each(?)) LIMIT ?",
+            (user_id, json.dumps(skipped), batch),
+        ).fetchall()
+        if not rows:
+            break
+        delta, kept = _reap_batch(sh, user_id, rows)
+        skipped += kept
+        _update(request_id, "running", delta=delta)
+        if pause:
+            time.sleep(pause)           # yüklemelere nefes payı
+    if skipped:
+        _update(request_id, "pending", f"shard {sh.index}: {len(skipped)} dosya silinemedi, "
+                                  f"sonraki çalıştırmada tekrar denenecek")
+        return False
+
+    def _clear(c) -> int:
+        c.execute("DELETE FROM vendor_keys WHERE user_id=?", (user_id,))
+        return c.execute(
+            "DELETE FROM tenant_tombstones WHERE user_id=? "
+            "AND NOT EXISTS (SELECT 1 FROM invoices WHERE user_id=?)", (user_id, user_id),
+        ).rowcount
+    return sh.writer.run(_clear) > 0
+
+
+def _reap_archive(a, user_id: str, request_id: str) -> bool:
+    """Tenant'ı arşiv yılından sil (dosya yok, sadece satırlar); True → tombstone kaldırıldı."""
+    batch = max(10, min(settings.REAPER_BATCH, 2_000))
+    pause = settings.REAPER_PAUSE_MS / 1000
+
+    def _delete(c) -> int:
+        ids = [r[0] for r in c.execute("SELECT id FROM invoices WHERE user_id=? LIMIT ?",
+                                       (user_id, batch))]
+        if ids:
+            marks = ",".join("?" * len(ids))
+            c.execute(f"DELETE FROM invoice_items     WHERE invoice_id IN ({marks})", ids)
+            c.execute(f"DELETE FROM invoice_vat_lines WHERE invoice_id IN ({marks})", ids)
+            c.execute(f"DELETE FROM invoices          WHERE id IN ({marks})", ids)
+        return len(ids)
+
+    while True:
+        n = a.run(_delete)
+        if not n:
+            break
+        _update(request_id, "running", delta={**dict.fromkeys(_COUNTERS, 0),
+                                              "invoices": n, "batches": 1})
+        if pause:
+            time.sleep(pause)
+
+    def _clear(c) -> int:
+        c.execute("DELETE FROM vendor_keys WHERE user_id=?", (user_id,))
+        return c.execute(
+            "DELETE FROM tenant_tombstones WHERE user_id=? "
+            "AND NOT EXISTS (SELECT 1 FROM invoices WHERE user_id=?)", (user_id, user_id),
+        ).rowcount
+    return a.run(_clear) > 0
+
+
+def _finish(request_id: str) -> bool:
+    """Hiçbir shard'da / arşiv yılında tombstone'u kalmadıysa isteği tamamla."""
+    for sh in SHARDS + archives():
+        if sh.conn().execute("SELECT 1 FROM tenant_tombstones WHERE request_id=?",
+                             (request_id,)).fetchone():
+            return False
+    _update(request_id, "done", error=None)
+    req = get_request(request_id)
+    logger.info("GDPR deletion request=%s done invoices=%d files=%d missing=%d",
+                request_id, req["invoices"], req["files"], req["missing"])
+    return True
+
+
+def run() -> dict:
+    """Tüm tombstone'lu tenant'ları sil (senkron, tekrar çağrılabilir — kesilirse sürer)."""
+    if not _RUN_LOCK.acquire(blocking=False):
+        return stats()
+    try:
+        pending = set()
+        for sh in SHARDS:
+            for user_id, request_id in sh.conn().execute(
+                    "SELECT user_id, request_id FROM tenant_tombstones ORDER BY requested_at"
+            ).fetchall():
+                pending.add(request_id)
+                try:
+                    _reap_shard(sh, user_id, request_id)
+                except Exception as e:
+                    logger.error("GDPR deletion request=%s shard=%d failed: %s",
+                                 request_id, sh.index, type(e).__name__)
+                    _update(request_id, "failed", f"{type(e).__name__}: {e}"[:500])
+        for a in archives():
+            for user_id, request_id in a.conn().execute(
+                    "SELECT user_id, request_id FROM tenant_tombstones ORDER BY requested_at"
+            ).fetchall():
+                pending.add(request_id)
+                try:
+                    _reap_archive(a, user_id, request_id)
+                except Exception as e:
+                    logger.error("GDPR deletion request=%s archive=%d failed: %s",
+                                 request_id, a.year, type(e).__name__)
+                    _update(request_id, "failed", f"{type(e).__name__}: {e}"[:500])
+        with _conn() as c:
+            pending.update(r[0] for r in c.execute(
+                "SELECT id FROM deletion_requests WHERE status <> 'done'"))
+        for request_id in pending:
+            _finish(request_id)
+    finally:
+        _RUN_LOCK.release()
+    return stats()
+
+
+def start() -> None:
+    """run'ı arka plan thread'inde başlat (silme isteği bloklanmaz)."""
+    threading.Thread(target=run, daemon=True).start()
+
+
+def stats() -> dict:
+    """Bekleyen istekler + son tamamlanan (izleme)."""
+    with _conn() as c:
+        counts = dict(c.execute("SELECT status, COUNT(*) FROM deletion_requests GROUP BY status"))
+    done = list_requests(1, "done")
+    return {
+        "running":   _RUN_LOCK.locked(),
+        "batch":     settings.REAPER_BATCH,
+        "requests":  counts,
+        "last_done": done[0] if done else None,
+    }
+
+
+# ── CLI: python -m app.services.reaper ────────────────────
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="AutoTax tenant silme reaper'ı (GDPR Md.17)")
+    ap.add_argument("--status", help="Tek silme isteğinin durumu (request id)")
+    args = ap.parse_args()
+    schema.migrate()
+
+    logging.basicConfig(level=logging.INFO)
+    result = get_request(args.status) if args.status else run()
+    print(json.dumps(result, ensure_ascii=False, indent=2))
@@ -0,0 +1,419 @@
+"""
+AutoTax.cloud — Toplu Yeniden Ayrıştırma (re-parse)
+invoice_parser / amount_parser iyileştirmelerini eski faturalara uygular.
+Görsel saklanmadığı için kaynak olarak invoice_blobs.raw_text (zlib) kullanılır.
+
+  • raw_text rowid sırasıyla chunk'lar halinde okunur (RAM sabit, N→∞)
+  • Ayrıştırma process pool'da yapılır (CPU bound); worker'lar forkserver ile
+    başlar — job uvicorn process'inin thread'inde çalışır, çok thread'li process'i
+    fork'lamak kilitli bir mutex'i (logging, sqlite) çocuğa kopyalayabilir
+  • Worker sayısı job kaydında tutulur → devam ettirilen job aynı sayıyla sürer
+  • Sadece değişen alanlar chunk başına tek transaction'da yazılır
+  • Her chunk sonunda checkpoint (shard, last_rowid) kaydedilir — shard 0'da
+    fatura yazmasıyla aynı transaction'da. Diğer shard'larda üç adım: önce shard
+    0'a fark kayıtları + sayaçlar + "chunk bekliyor" işareti (pending_rowid), sonra
+    shard'da fatura yazması, sonra checkpoint. Arada kesilirse devam eden job
+    bekleyen chunk'ı aynı rowid aralığında tekrar uygular ama fark kaydı eklemez
+    → denetim izi ne kaybolur ne çiftlenir
+  • Shard'lar sırayla taranır (rowid'ler shard başına)
+  • dry_run=True → hiçbir şey yazılmaz, sadece fark raporu (reparse_diffs)
+  • Kullanıcının elle düzelttiği alanlar (invoice_edits) ezilmez: farkları
+    skipped=1 ile raporlanır, job'ın skipped sayacına eklenir. needs_review sadece
+    parser'ın kendi koyduğu inceleme (_AUTO_REVIEW) için kapatılır
+  • Uygulama modunda ürün / KDV satırları da yeniden yazılır (eski faturaların backfill'i)
+"""
+import json
+import logging
+import multiprocessing
+import os
+import threading
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+from app.services import schema
+from app.services.invoice_parser import parse_ocr_text
+from app.services.invoice_db     import (
+    _conn, _LOCK, _replace_lines, _bump, _unpack, _cols, encode_fields, day_number, live, SHARDS,
+)
+
+logger = logging.getLogger("autotax.reparse")
+
+# Yeniden hesaplanan alanlar — parse_invoice çıktısıyla aynı isimler
+FIELDS = ("vendor", "date", "time", "total", "vat_rate", "vat_amount",
+          "invoice_number", "category", "payment_method")
+
+# ocr._sanitize_qr_override çıktısındaki alanlar — QR her zaman OCR'yi ezer
+_QR_FIELDS = ("total", "date", "time", "invoice_number", "vendor", "vat_amount", "vat_rate")
+
+# routes/ocr.py _analyze'ın koyduğu inceleme nedenleri — yeni total bunları kapatabilir
+_AUTO_REVIEW = (None, "Toplam tutar bulunamadı", "Ayrıştırma süre limiti aşıldı (kısmi sonuç)")
+
+DEFAULT_CHUNK   = 500
+DEFAULT_WORKERS = max(1, min(4, (os.cpu_count() or 2) - 1))
+_MAX_ROWID      = 2**63 - 1
+
+_DDL = """
+CREATE TABLE IF NOT EXISTS reparse_jobs (
+    id          TEXT PRIMARY KEY,
+    status      TEXT NOT NULL,
+    dry_run     INTEGER NOT NULL DEFAULT 1,
+    chunk       INTEGER NOT NULL DEFAULT 500,
+    workers     INTEGER,
+    shard       INTEGER NOT NULL DEFAULT 0,
+    last_rowid  INTEGER NOT NULL DEFAULT 0,
+    pending_rowid INTEGER,
+    scanned     INTEGER NOT NULL DEFAULT 0,
+    changed     INTEGER NOT NULL DEFAULT 0,
+    skipped     INTEGER NOT NULL DEFAULT 0,
+    created_at  TEXT NOT NULL,
+    updated_at  TEXT,
+    finished_at TEXT,
+    error       TEXT
+);
+CREATE TABLE IF NOT EXISTS reparse_diffs (
+    job_id     TEXT NOT NULL,
+    invoice_id TEXT NOT NULL,
+    field      TEXT NOT NULL,
+    old_value  TEXT,
+    new_value  TEXT,
+    skipped    INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_rpdiff_job ON reparse_diffs(job_id);
+"""
+
+# Bu process'te çalışan job'lar (aynı job iki kez başlatılmasın)
+_ACTIVE: dict = {}
+_ACTIVE_LOCK = threading.Lock()
+
+
+SCHEMA_VERSION = 4
+
+
+def _init_reparse():
+    schema.ensure(_conn(), "reparse", SCHEMA_VERSION, _migrate)
+
+
+def _migrate(c):
+    with c:
+        cols = [r[1] for r in c.execute("PRAGMA table_info(reparse_jobs)").fetchall()]
+        if cols and "shard" not in cols:
+            c.execute("ALTER TABLE reparse_jobs ADD COLUMN shard INTEGER NOT NULL DEFAULT 0")
+        if cols and "pending_rowid" not in cols:
+            c.execute("ALTER TABLE reparse_jobs ADD COLUMN pending_rowid INTEGER")
+        if cols and "workers" not in cols:
+            c.execute("ALTER TABLE reparse_jobs ADD COLUMN workers INTEGER")
+        if cols and "skipped" not in cols:
+            c.execute("ALTER TABLE reparse_jobs ADD COLUMN skipped INTEGER NOT NULL DEFAULT 0")
+        diff_cols = [r[1] for r in c.execute("PRAGMA table_info(reparse_diffs)").fetchall()]
+        if diff_cols and "skipped" not in diff_cols:
+            c.execute("ALTER TABLE reparse_diffs ADD COLUMN skipped INTEGER NOT NULL DEFAULT 0")
+        c.executescript(_DDL)
+
+schema.register("reparse", _init_reparse)
+
+
+# ── Ayrıştırma (process pool worker'ında çalışır) ─────────
+def reparse_text(text: str) -> dict:
+    """OCR pipeline'ıyla aynı kural (invoice_parser.parse_ocr_text)."""
+    return parse_ocr_text(text)
+
+
+def _same(old, new) -> bool:
+    if isinstance(old, (int, float)) and isinstance(new, (int, float)):
+        return round(float(old), 2) == round(float(new), 2)
+    return old == new
+
+
+def _diff(row, parsed: dict) -> tuple[dict, dict]:
+    """
+    (değişen alanlar, atlanan alanlar). Yeni değer None ise eski değer korunur;
+    elle düzeltilmiş alanların (row["manual"]) farkı yazılmaz, atlanan olarak döner.
+    """
+    qr = {}
+    if row["qr_parsed"]:
+        try: qr = json.loads(row["qr_parsed"]) or {}
+        except Exception: qr = {}
+    for key in _QR_FIELDS:
+        if qr.get(key) is not None:
+            parsed[key] = qr[key]
+
+    manual = set((row["manual"] or "").split(","))
+    changes, skipped = {}, {}
+    for field in FIELDS:
+        new = parsed.get(field)
+        if new is None or _same(row[field], new):
+            continue
+        if field == "date" and day_number(new) is None:
+            continue                        # geçersiz tarih eskisini ezmez
+        (skipped if field in manual else changes)[field] = new
+    # Parser'ın "total yok" incelemesi yeni total'le kapanır; kullanıcının veya
+    # başka bir nedenin (geçersiz tarih vb.) incelemesine dokunulmaz
+    if (changes.get("total") and row["needs_review"] and "needs_review" not in manual
+            and row["review_reason"] in _AUTO_REVIEW):
+        changes["needs_review"]  = 0
+        changes["review_reason"] = None
+    return changes, skipped
+
+
+# ── Job yönetimi ──────────────────────────────────────────
+def create_job(dry_run: bool = True, chunk: int = DEFAULT_CHUNK,
+               workers: int = DEFAULT_WORKERS) -> str:
+    job_id = str(uuid.uuid4())
+    now    = datetime.utcnow().isoformat()
+    with _LOCK:
+        with _conn() as c:
+            c.execute(
+                "INSERT INTO reparse_jobs (id,status,dry_run,chunk,workers,created_at,updated_at) "
+                "VALUES (?,?,?,?,?,?,?)",
+                (job_id, "pending", 1 if dry_run else 0, max(10, min(chunk, 5_000)),
+                 max(1, workers), now, now),
+            )
+    return job_id
+
+
+def get_job(job_id: str) -> dict | None:
+    with _conn() as c:
+        row = c.execute("SELECT * FROM reparse_jobs WHERE id=?", (job_id,)).fetchone()
+    if not row:
+        return None
+    job = dict(row)
+    job["dry_run"] = bool(job["dry_run"])
+    job["active"]  = job_id in _ACTIVE
+    return job
+
+
+def list_jobs(limit: int = 20) -> list[dict]:
+    with _conn() as c:
+        rows = c.execute(
+            "SELECT * FROM reparse_jobs ORDER BY created_at DESC LIMIT ?", (limit,)
+        ).fetchall()
+    return [dict(r, dry_run=bool(r["dry_run"]), active=r["id"] in _ACTIVE) for r in rows]
+
+
+def get_diffs(job_id: str, after: int = 0, limit: int = 200) -> dict:
+    """Fark raporu — rowid cursor'ı ile sayfalı (OFFSET yok)."""
+    with _conn() as c:
+        rows = c.execute(
+            "SELECT rowid, invoice_id, field, old_value, new_value, skipped FROM reparse_diffs "
+            "WHERE job_id=? AND rowid > ? ORDER BY rowid LIMIT ?",
+            (job_id, after, limit),
+        ).fetchall()
+    items = [dict(r, skipped=bool(r["skipped"])) for r in rows]
+    return {
+        "job_id": job_id,
+        "diffs":  items,
+        "next":   items[-1]["rowid"] if len(items) == limit else None,
+    }
+
+
+def cancel_job(job_id: str) -> bool:
+    with _LOCK:
+        with _conn() as c:
+            cur = c.execute(
+                "UPDATE reparse_jobs SET status='cancelled', updated_at=? "
+                "WHERE id=? AND status IN ('pending','running')",
+                (datetime.utcnow().isoformat(), job_id),
+            )
+    return cur.rowcount > 0
+
+
+def _set_status(job_id: str, status: str, error: str = None):
+    now = datetime.utcnow().isoformat()
+    with _LOCK:
+        with _conn() as c:
+            c.execute(
+                "UPDATE reparse_jobs SET status=?, error=?, updated_at=?, "
+                "finished_at=CASE WHEN ? IN ('done','failed') THEN ? ELSE finished_at END "
+                "WHERE id=?",
+                (status, error, now, status, now, job_id),
+            )
+
+
+def _status(job_id: str) -> str | None:
+    with _conn() as c:
+        row = c.execute("SELECT status FROM reparse_jobs WHERE id=?", (job_id,)).fetchone()
+    return row[0] if row else None
+
+
+def _apply(c, updates: list, lines: list) -> None:
+    """Değişen alanları + ürün / KDV satırlarını yaz (açık transaction içinde)."""
+    # Aynı kolon kümesini değiştiren satırlar tek executemany'de
+    groups: dict = {}
+    for inv_id, _, changes in updates:
+        enc = encode_fields(c, changes)
+        groups.setdefault(tuple(enc), []).append(list(enc.values()) + [inv_id])
+    for keys, rows in groups.items():
+        cols = ", ".join(f"{k}=?" for k in keys)
+        c.executemany(f"UPDATE invoices SET {cols} WHERE id=?", rows)
+    for line in lines:
+        _replace_lines(c, *line)
+
+
+def _record(c, job_id: str, shard, scanned: int, updates: list, skipped: list) -> None:
+    """Fark kayıtları (yazılan + atlanan) + sayaçlar (shard 0, açık transaction içinde)."""
+    diffs = [
+        (job_id, inv_id, k, None if old.get(k) is None else str(old.get(k)),
+         None if v is None else str(v), flag)
+        for flag, entries in ((0, updates), (1, skipped))
+        for inv_id, old, fields in entries
+        for k, v in fields.items()
+    ]
+    if diffs:
+        c.executemany(
+            "INSERT INTO reparse_diffs (job_id,invoice_id,field,old_value,new_value,skipped) "
+            "VALUES (?,?,?,?,?,?)",
+            diffs,
+        )
+    c.execute("UPDATE reparse_jobs SET shard=?, scanned=scanned+?, changed=changed+?, "
+              "skipped=skipped+? WHERE id=?",
+              (shard.index, scanned, len(updates), len(skipped), job_id))
+
+
+def _checkpoint(c, job_id: str, shard, last_rowid: int) -> None:
+    c.execute(
+        "UPDATE reparse_jobs SET shard=?, last_rowid=?, pending_rowid=NULL, updated_at=? WHERE id=?",
+        (shard.index, last_rowid, datetime.utcnow().isoformat(), job_id),
+    )
+
+
+def _write_chunk(job_id: str, shard, dry_run: bool, last_rowid: int, scanned: int,
+                 updates: list, lines: list, skipped: list = (), pending: bool = False) -> None:
+    """
+    Chunk sonuçlarını + checkpoint'i yaz. Shard 0 (ve dry-run): tek transaction.
+    Diğer shard'lar: farklar + pending_rowid → fatura yazması → checkpoint.
+    pending=True → chunk'ın farkları önceki (kesilen) denemede kaydedildi.
+    """
+    if dry_run or shard.index == 0:
+        with _LOCK:
+            with _conn() as c:
+                if not dry_run:
+                    _apply(c, updates, lines)
+                if not pending:
+                    _record(c, job_id, shard, scanned, updates, skipped)
+                _checkpoint(c, job_id, shard, last_rowid)
+    else:
+        if not pending:
+            with _LOCK:
+                with _conn() as c:
+                    _record(c, job_id, shard, scanned, updates, skipped)
+                    c.execute("UPDATE reparse_jobs SET pending_rowid=?, updated_at=? WHERE id=?",
+                              (last_rowid, datetime.utcnow().isoformat(), job_id))
+        with shard.lock:
+            with shard.conn() as c:
+                _apply(c, updates, lines)
+        with _LOCK:
+            with _conn() as c:
+                _checkpoint(c, job_id, shard, last_rowid)
+    if not dry_run:
+        with _LOCK:
+            _bump()                         # commit sonrası — özet cache'i geçersiz
+
+
+def _set_workers(job_id: str, workers: int) -> None:
+    with _LOCK:
+        with _conn() as c:
+            c.execute("UPDATE reparse_jobs SET workers=? WHERE id=?", (max(1, workers), job_id))
+
+
+def run_job(job_id: str, workers: int = None) -> dict | None:
+    """
+    Job'ı checkpoint'ten itibaren çalıştır (senkron). Kesilirse aynı job_id ile
+    tekrar çağrılması kaldığı yerden devam eder. workers=None → job kaydındaki sayı;
+    verilirse kayda yazılır.
+    """
+    job = get_job(job_id)
+    if not job or job["status"] == "done":
+        return job
+    if workers:
+        _set_workers(job_id, workers)
+    workers = max(1, workers or job["workers"] or DEFAULT_WORKERS)
+    with _ACTIVE_LOCK:
+        if job_id in _ACTIVE:
+            return job
+        _ACTIVE[job_id] = True
+
+    _set_status(job_id, "running")
+    chunk, dry_run = job["chunk"], job["dry_run"]
+    first, last    = job["shard"], job["last_rowid"]
+    pending        = job["pending_rowid"]   # kesilen chunk'ın üst sınırı (farkları kayıtlı)
+    try:
+        with ProcessPoolExecutor(max_workers=workers,
+                                 mp_context=multiprocessing.get_context("forkserver")) as pool:
+            for sh in SHARDS[first:]:
+                while True:
+                    if _status(job_id) == "cancelled":
+                        logger.info("reparse job=%s cancelled at shard=%d rowid=%d",
+                                    job_id, sh.index, last)
+                        return get_job(job_id)
+                    # Kısa okuma — uzun read transaction yok, WAL checkpoint'i bloklamaz
+                    with sh.conn() as c:
+                        rows = c.execute(
+                            f"SELECT i.rowid, i.id, i.user_id, b.raw_text, b.qr_parsed, i.needs_review, "
+                            f"i.review_reason, {_cols(FIELDS, 'i')}, "
+                            f"(SELECT group_concat(field) FROM invoice_edits e "
+                            f"WHERE e.invoice_id = i.id) AS manual "
+                            f"FROM invoices i LEFT JOIN invoice_blobs b ON b.invoice_id = i.id "
+                            f"WHERE i.rowid > ? AND i.rowid <= ? AND {live('i')} "
+                            f"ORDER BY i.rowid LIMIT ?",
+                            (last, _MAX_ROWID if pending is None else pending, chunk),
+                        ).fetchall()
+                    if not rows and pending is not None:
+                        # Bekleyen chunk'ın satırları bu arada silinmiş → sadece checkpoint
+                        _write_chunk(job_id, sh, dry_run, pending, 0, [], [], pending=True)
+                        last, pending = pending, None
+                        continue
+                    if not rows:
+                        break
+                    rows = [{**dict(r), "raw_text": _unpack(r["raw_text"]),
+                             "qr_parsed": _unpack(r["qr_parsed"])} for r in rows]
+                    parsed = pool.map(reparse_text, [r["raw_text"] or "" for r in rows],
+                                      chunksize=max(1, len(rows) // (workers * 4) or 1))
+                    updates, lines, skipped = [], [], []
+                    for row, p in zip(rows, parsed):
+                        if not row["raw_text"]:
+                            continue
+                        changes, kept = _diff(row, p)
+                        if changes:
+                            updates.append((row["id"], row, changes))
+                        if kept:
+                            skipped.append((row["id"], row, kept))
+                        if not {"items", "vat_lines"} & set(p.get("parse_timeout", [])):
+                            lines.append((row["id"], row["user_id"], changes.get("date", row["date"]),
+                                          p.get("items"), p.get("vat_lines")))
+                    last = pending if pending is not None else rows[-1]["rowid"]
+                    _write_chunk(job_id, sh, dry_run, last, len(rows), updates, lines, skipped,
+                                 pending=pending is not None)
+                    pending = None
+                last = 0                    # sonraki shard baştan
+        _set_status(job_id, "done")
+        logger.info("reparse job=%s done dry_run=%s", job_id, dry_run)
+    except Exception as e:
+        logger.error("reparse job=%s failed: %s", job_id, type(e).__name__)
+        _set_status(job_id, "failed", f"{type(e).__name__}: {e}"[:500])
+    finally:
+        with _ACTIVE_LOCK:
+            _ACTIVE.pop(job_id, None)
+    return get_job(job_id)
+
+
+def start_job(job_id: str, workers: int = None) -> None:
+    """run_job'ı arka plan thread'inde başlat (admin endpoint'i bloklamaz)."""
+    threading.Thread(target=run_job, args=(job_id, workers), daemon=True).start()
+
+
+# ── CLI: python -m app.services.reparse [--apply] ────────
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="AutoTax raw_text toplu yeniden ayrıştırma")
+    ap.add_argument("--apply",   action="store_true", help="Değişiklikleri yaz (varsayılan: dry-run)")
+    ap.add_argument("--chunk",   type=int, default=DEFAULT_CHUNK)
+    ap.add_argument("--workers", type=int, help=f"Varsayılan: {DEFAULT_WORKERS} (--resume: job'ın sayısı)")
+    ap.add_argument("--resume",  help="Kesilen job_id'yi kaldığı yerden sürdür")
+    args = ap.parse_args()
+    schema.migrate()
+
+    logging.basicConfig(level=logging.INFO)
+    jid = args.resume or create_job(dry_run=not args.apply, chunk=args.chunk,
+                                    workers=args.workers or DEFAULT_WORKERS)
+    print(json.dumps(run_job(jid, workers=args.workers), ensure_ascii=False, indent=2))
@@ -0,0 +1,297 @@
+"""
+AutoTax.cloud — Fatura dosyası saklama süresi (GDPR veri minimizasyonu, Md.5/1-e)
+Yükleme zamanı (invoices.timestamp) RETENTION_DAYS'ten eski faturaların
+dosyaları diskten silinir, filename NULL'lanır; DB kaydı (tutarlar, OCR metni) kalır.
+
+  • Süresi dolan satırlar (timestamp, rowid) sırasıyla küçük batch'ler halinde
+    okunur — kilitsiz kısa okuma, cursor sayesinde her satır job başına bir kez
+  • Dosyalar DB kilidi dışında, ayrı unlink thread'lerinde silinir
+  • filename=NULL shard'ın group-commit yazıcısıyla batch başına tek kısa
+    transaction'da yazılır → yüklemeler en fazla bir batch UPDATE'i kadar bekler
+  • Sıra önce unlink, sonra DB: kesilirse dosya silinmiş ama kaydı duran satırlar
+    sürdürmede yeniden işlenir (missing_ok) — silinmemiş dosya hiç unutulmaz
+  • Her batch sonunda checkpoint (shard, last_ts, last_rowid) + sayaçlar shard 0'da;
+    yarım kalan job (çökme / hata) bir sonraki çalıştırmada kaldığı yerden sürer
+  • Silinemeyen dosyalar (izin vb.) kaydında kalır, "failed" sayılır; sonraki job tekrar dener
+
+Kullanım:
+    python -m app.services.retention                 # yarım job'ı sürdür / yenisini çalıştır
+    python -m app.services.retention --days 30 --batch 1000
+"""
+import json
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+from app.config import settings
+from app.services import schema
+from app.services.invoice_db import _conn, _LOCK, SHARDS, upload_path
+
+logger = logging.getLogger("autotax.retention")
+
+_DDL = """
+CREATE TABLE IF NOT EXISTS retention_jobs (
+    id          TEXT PRIMARY KEY,
+    status      TEXT NOT NULL,
+    days        INTEGER NOT NULL,
+    cutoff      TEXT NOT NULL,
+    batch       INTEGER NOT NULL DEFAULT 500,
+    shard       INTEGER NOT NULL DEFAULT 0,
+    last_ts     TEXT NOT NULL DEFAULT '',
+    last_rowid  INTEGER NOT NULL DEFAULT 0,
+    scanned     INTEGER NOT NULL DEFAULT 0,
+    removed     INTEGER NOT NULL DEFAULT 0,
+    missing     INTEGER NOT NULL DEFAULT 0,
+    failed      INTEGER NOT NULL DEFAULT 0,
+    bytes       INTEGER NOT NULL DEFAULT 0,
+    batches     INTEGER NOT NULL DEFAULT 0,
+    db_ms       REAL    NOT NULL DEFAULT 0,
+    unlink_ms   REAL    NOT NULL DEFAULT 0,
+    created_at  TEXT NOT NULL,
+    updated_at  TEXT,
+    finished_at TEXT,
+    error       TEXT
+);
+"""
+
+_COUNTERS = ("scanned", "removed", "missing", "failed", "bytes", "batches", "db_ms", "unlink_ms")
+
+# Bu process'te çalışan job'lar (aynı job iki kez başlatılmasın)
+_ACTIVE: dict = {}
+_ACTIVE_LOCK = threading.Lock()
+
+_UNLINK = ThreadPoolExecutor(max_workers=max(1, settings.RETENTION_UNLINK_THREADS),
+                             thread_name_prefix="retention")
+
+
+SCHEMA_VERSION = 1
+
+
+def _init_retention():
+    with _LOCK:
+        schema.ensure(_conn(), "retention", SCHEMA_VERSION, lambda c: c.executescript(_DDL))
+
+schema.register("retention", _init_retention)
+
+
+# ── Job yönetimi ──────────────────────────────────────────
+def create_job(days: int = None, batch: int = None) -> str:
+    """Kesim zamanı job oluşturulurken sabitlenir → sürdürmede aynı satır kümesi."""
+    days   = settings.RETENTION_DAYS if days is None else max(0, days)
+    batch  = max(10, min(batch or settings.RETENTION_BATCH, 5_000))
+    job_id = str(uuid.uuid4())
+    now    = datetime.now()
+    # invoices.timestamp yerel saatle yazılır (datetime.now().isoformat())
+    cutoff = (now - timedelta(days=days)).isoformat()
+    with _LOCK:
+        with _conn() as c:
+            c.execute(
+                "INSERT INTO retention_jobs (id,status,days,cutoff,batch,created_at,updated_at) "
+                "VALUES (?,?,?,?,?,?,?)",
+                (job_id, "pending", days, cutoff, batch, now.isoformat(), now.isoformat()),
+            )
+    return job_id
+
+
+def get_job(job_id: str) -> dict | None:
+    with _conn() as c:
+        row = c.execute("SELECT * FROM retention_jobs WHERE id=?", (job_id,)).fetchone()
+    return dict(row, active=job_id in _ACTIVE) if row else None
+
+
+def list_jobs(limit: int = 20) -> list[dict]:
+    with _conn() as c:
+        rows = c.execute(
+            "SELECT * FROM retention_jobs ORDER BY created_at DESC LIMIT ?", (limit,)
+        ).fetchall()
+    return [dict(r, active=r["id"] in _ACTIVE) for r in rows]
+
+
+def cancel_job(job_id: str) -> bool:
+    with _LOCK:
+        with _conn() as c:
+            cur = c.execute(
+                "UPDATE retention_jobs SET status='cancelled', updated_at=? "
+                "WHERE id=? AND status IN ('pending','running','failed')",
+                (datetime.now().isoformat(), job_id),
+            )
+    return cur.rowcount > 0
+
+
+def _unfinished() -> str | None:
+    """Sürdürülecek son job (çökmüş 'running' veya 'failed' dahil)."""
+    with _conn() as c:
+        row = c.execute(
+            "SELECT id FROM retention_jobs WHERE status IN ('pending','running','failed') "
+            "ORDER BY created_at DESC LIMIT 1"
+        ).fetchone()
+    return row[0] if row else None
+
+
+def _set_status(job_id: str, status: str, error: str = None):
+    now = datetime.now().isoformat()
+    with _LOCK:
+        with _conn() as c:
+            c.execute(
+                "UPDATE retention_jobs SET status=?, error=?, updated_at=?, "
+                "finished_at=CASE WHEN ? IN ('done','failed') THEN ? ELSE finished_at END "
+                "WHERE id=?",
+                (status, error, now, status, now, job_id),
+            )
+
+
+def _status(job_id: str) -> str | None:
+    with _conn() as c:
+        row = c.execute("SELECT status FROM retention_jobs WHERE id=?", (job_id,)).fetchone()
+    return row[0] if row else None
+
+
+def _checkpoint(job_id: str, shard: int, last_ts: str, last_rowid: int, delta: dict):
+    with _LOCK:
+        with _conn() as c:
+            c.execute(
+                "UPDATE retention_jobs SET shard=?, last_ts=?, last_rowid=?, updated_at=?, "
+                + ", ".join(f"{k}={k}+?" for k in _COUNTERS) + " WHERE id=?",
+                (shard, last_ts, last_rowid, datetime.now().isoformat(),
+                 *(delta[k] for k in _COUNTERS), job_id),
+            )
+
+
+# ── Batch ─────────────────────────────────────────────────
+def _unlink(filename: str) -> tuple[str, int]:
+    """→ ("removed" | "missing" | "failed", silinen bayt). Unlink thread'inde çalışır."""
+    path = upload_path(filename)
+    if path is None:
+        return "missing", 0         # upload dizini dışı / bozuk yol — dokunulmaz
+    try:
+        size = path.stat().st_size
+        path.unlink()
+        return "removed", size
+    except FileNotFoundError:
+        return "missing", 0
+    except OSError as e:
+        logger.warning("retention unlink failed: %s", type(e).__name__)
+        return "failed", 0
+
+
+def unlink_uploads(filenames: list) -> list[tuple[str, int]]:
+    """Dosyaları unlink thread'lerinde sil (DB kilidi dışında çağrılır) → _unlink sonuçları."""
+    return list(_UNLINK.map(_unlink, filenames))
+
+
+def _expired(sh, cutoff: str, last_ts: str, last_rowid: int, batch: int) -> list:
+    """Kesimden eski, dosyası olan sonraki batch (idx_ts üzerinden, kilitsiz okuma)."""
+    return sh.conn().execute(
+        "SELECT rowid, timestamp, filename FROM invoices "
+        "WHERE timestamp < ? AND (timestamp, rowid) > (?, ?) "
+        "AND filename IS NOT NULL AND filename <> '' "
+        "ORDER BY timestamp, rowid LIMIT ?",
+        (cutoff, last_ts, last_rowid, batch),
+    ).fetchall()
+
+
+def _purge_batch(sh, rows: list) -> dict:
+    """Dosyaları sil (kilitsiz), sonra silinen / zaten olmayanların filename'ini NULL'la."""
+    t0 = time.perf_counter()
+    results = unlink_uploads([r["filename"] for r in rows])
+    t1 = time.perf_counter()
+    gone = [(r["rowid"], r["filename"]) for r, (res, _) in zip(rows, results) if res != "failed"]
+    if gone:
+        # filename=? → bu arada değişen satıra dokunulmaz
+        sh.writer.run(lambda c: c.executemany(
+            "UPDATE invoices SET filename=NULL WHERE rowid=? AND filename=?", gone))
+    t2 = time.perf_counter()
+    delta = dict.fromkeys(_COUNTERS, 0)
+    for res, size in results:
+        delta[res]    += 1
+        delta["bytes"] += size
+    delta.update(scanned=len(rows), batches=1,
+                 unlink_ms=round((t1 - t0) * 1000, 1), db_ms=round((t2 - t1) * 1000, 1))
+    return delta
+
+
+def run_job(job_id: str) -> dict | None:
+    """
+    Job'ı checkpoint'ten itibaren çalıştır (senkron). Kesilirse aynı job_id ile
+    tekrar çağrılması kaldığı yerden devam eder.
+    """
+    job = get_job(job_id)
+    if not job or job["status"] in ("done", "cancelled"):
+        return job
+    with _ACTIVE_LOCK:
+        if job_id in _ACTIVE:
+            return job
+        _ACTIVE[job_id] = True
+
+    _set_status(job_id, "running")
+    pause = settings.RETENTION_PAUSE_MS / 1000
+    last_ts, last_rowid = job["last_ts"], job["last_rowid"]
+    try:
+        for sh in SHARDS[job["shard"]:]:
+            while True:
+                if _status(job_id) == "cancelled":
+                    logger.info("retention job=%s cancelled at shard=%d", job_id, sh.index)
+                    return get_job(job_id)
+                rows = _expired(sh, job["cutoff"], last_ts, last_rowid, job["batch"])
+                if not rows:
+                    break
+                delta = _purge_batch(sh, rows)
+                last_ts, last_rowid = rows[-1]["timestamp"], rows[-1]["rowid"]
+                _checkpoint(job_id, sh.index, last_ts, last_rowid, delta)
+                if pause:
+                    time.sleep(pause)       # yüklemelere nefes payı
+            last_ts, last_rowid = "", 0     # sonraki shard baştan
+            if sh.index + 1 < len(SHARDS):
+                _checkpoint(job_id, sh.index + 1, "", 0, dict.fromkeys(_COUNTERS, 0))
+        _set_status(job_id, "done")
+        job = get_job(job_id)
+        logger.info("retention job=%s done removed=%d missing=%d failed=%d bytes=%d",
+                    job_id, job["removed"], job["missing"], job["failed"], job["bytes"])
+    except Exception as e:
+        logger.error("retention job=%s failed: %s", job_id, type(e).__name__)
+        _set_status(job_id, "failed", f"{type(e).__name__}: {e}"[:500])
+    finally:
+        with _ACTIVE_LOCK:
+            _ACTIVE.pop(job_id, None)
+    return get_job(job_id)
+
+
+def run(days: int = None, batch: int = None) -> dict:
+    """Gece job'ı: yarım kalan job varsa onu sürdür, yoksa yenisini çalıştır."""
+    return run_job(_unfinished() or create_job(days, batch))
+
+
+def start(days: int = None, batch: int = None) -> dict:
+    """run'ı arka plan thread'inde başlat (admin endpoint'i bloklamaz)."""
+    job_id = _unfinished() or create_job(days, batch)
+    threading.Thread(target=run_job, args=(job_id,), daemon=True).start()
+    return get_job(job_id)
+
+
+def stats() -> dict:
+    """Ayarlar + son job'ın metrikleri (izleme)."""
+    jobs = list_jobs(1)
+    return {
+        "days":   settings.RETENTION_DAYS,
+        "batch":  settings.RETENTION_BATCH,
+        "active": sorted(_ACTIVE),
+        "last":   jobs[0] if jobs else None,
+    }
+
+
+# ── CLI: python -m app.services.retention ─────────────────
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="AutoTax fatura dosyası saklama süresi temizliği")
+    ap.add_argument("--days",   type=int, default=None, help=f"Varsayılan {settings.RETENTION_DAYS}")
+    ap.add_argument("--batch",  type=int, default=None, help=f"Varsayılan {settings.RETENTION_BATCH}")
+    ap.add_argument("--resume", help="Belirli job_id'yi kaldığı yerden sürdür")
+    args = ap.parse_args()
+    schema.migrate()
+
+    logging.basicConfig(level=logging.INFO)
+    result = run_job(args.resume) if args.resume else run(args.days, args.batch)
+    print(json.dumps(result, ensure_ascii=False, indent=2))
@@ -0,0 +1,68 @@
+"""
+AutoTax.cloud — Aylık rollup kontrolü / yeniden kurulum
+invoice_rollup (bkz. invoice_db "AYLIK ROLLUP") trigger'larla güncel tutulur;
+bu araç her shard'da (ve arşiv yılında) rollup'ı invoices'tan hesaplanan gruplarla karşılaştırır.
+Eksik / fazla grup ya da herhangi bir sayı / kuruş farkı hata sayılır
+(exit code 1 — CI / cron'da çalıştırılabilir). --rebuild farkı düzeltir.
+
+Kullanım:
+    python -m app.services.rollup              # doğrula
+    python -m app.services.rollup --rebuild    # baştan kur, sonra doğrula
+"""
+import sys
+
+from app.services import schema
+from app.services import invoice_db as idb
+
+
+
+def _groups(c, sql: str) -> dict:
+    n = len(idb.ROLLUP_KEYS)
+    return {tuple(r[:n]): r for r in c.execute(sql)}
+
+
+def verify_shard(sh) -> list[str]:
+    """Tek shard'ın / arşiv yılının rollup farkları (yazmalar kilitle bekletilir → tutarlı anlık görüntü)."""
+    name = f"arşiv {sh.year}" if isinstance(sh, idb.Archive) else f"shard {sh.index}"
+    with sh.lock:
+        c = sh.conn()
+        expected = _groups(c, idb._ROLLUP_GROUP)
+        actual   = _groups(c, f"SELECT {', '.join(idb.ROLLUP_KEYS + idb.ROLLUP_SUMS)} "
+                              f"FROM invoice_rollup")
+    errors = []
+    for key in expected.keys() - actual.keys():
+        errors.append(f"{name}: eksik grup {key}")
+    for key in actual.keys() - expected.keys():
+        errors.append(f"{name}: fazla grup {key}")
+    for key in expected.keys() & actual.keys():
+        e, a = expected[key], actual[key]
+        diff = [f for f in idb.ROLLUP_SUMS if e[f] != a[f]]   # tamsayı → kesin eşitlik
+        if diff:
+            errors.append(f"{name}: {key} → " +
+                          ", ".join(f"{f} {a[f]} ≠ {e[f]}" for f in diff))
+    return errors
+
+
+def verify() -> list[str]:
+    return [err for sh in idb.SHARDS + idb.archives() for err in verify_shard(sh)]
+
+
+def main(argv=None) -> int:
+    import argparse
+    ap = argparse.ArgumentParser(description="AutoTax aylık rollup kontrolü")
+    ap.add_argument("--rebuild", action="store_true", help="Rollup'ı invoices'tan baştan kur")
+    args = ap.parse_args(argv)
+    schema.migrate()
+
+    if args.rebuild:
+        print(f"{idb.rebuild_rollup()} rollup grubu yeniden kuruldu")
+    errors = verify()
+    for line in errors[:50]:
+        print("FAIL", line)
+    years = len(idb.archives())
+    print(f"{len(idb.SHARDS)} shard{f' + {years} arşiv yılı' if years else ''}, {len(errors)} fark")
+    return 1 if errors else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
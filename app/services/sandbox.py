@@ -0,0 +1,45 @@
+"""
+AutoTax.cloud — Geçici depolama (CI kontrolleri)
+query_plans ve loop_monitor CLI'ları boş DB'ler ve test kullanıcısıyla çalışır;
+tüm depolama yolları (app/config.py) geçici bir dizine yönlendirilir → prod ortam
+değişkenleriyle çalıştırılsalar bile gerçek DB'lere dokunmazlar.
+
+Kullanım (ayarlar henüz okunmamışken):
+    with isolated_storage("autotax-plans-"):
+        from app.services import invoice_db
+        ...
+"""
+import os
+import sys
+import tempfile
+from contextlib import contextmanager
+
+# Depolama ayarları (app/config.py) → geçici dizin altındaki ad ("" = dizinin kendisi)
+STORAGE_ENV = {
+    "STORAGE_PATH":  "",
+    "DB_PATH":       "invoices_db.json",
+    "SQLITE_PATH":   "invoices.db",
+    "USERS_DB_PATH": "users.db",
+    "UPLOAD_DIR":    "uploads",
+    "BACKUP_DIR":    "backups",
+    "ARCHIVE_DIR":   "archive",
+}
+
+
+@contextmanager
+def isolated_storage(prefix: str = "autotax-"):
+    """Ayarlar okunmadan önce tüm depolama yollarını geçici dizine al; çıkışta sil."""
+    if "app.config" in sys.modules:
+        raise RuntimeError("app.config zaten yüklü — kontrol ayrı bir process'te çalıştırılmalı")
+    saved = {key: os.environ.get(key) for key in STORAGE_ENV}
+    with tempfile.TemporaryDirectory(prefix=prefix, ignore_cleanup_errors=True) as base:
+        for key, name in STORAGE_ENV.items():
+            os.environ[key] = os.path.join(base, name) if name else base
+        try:
+            yield base
+        finally:
+            for key, value in saved.items():
+                if value is None:
+                    os.environ.pop(key, None)
+                else:
+                    os.environ[key] = value
@@ -0,0 +1,97 @@
+"""
+AutoTax.cloud — Şema sürümleri + açılış migration'ları
+Modüller import edilirken DB'ye dokunmaz; şema kurulumunu register() ile bildirir,
+migration'lar uygulama açılışında (main.py startup hook'u, CLI'lar) migrate() ile
+process başına bir kez çalışır.
+
+  • schema_version tablosu (her DB dosyasında): component → version
+  • ensure(): kayıtlı sürüm güncelse DDL / PRAGMA table_info çalışmaz — tek SELECT
+  • Sürüm migration başarıyla bitince yazılır → yarıda kalan migration tekrar çalışır
+  • migrate()'ten sonra import edilen modülün kurulumu register() içinde hemen çalışır
+  • Şema değişince modülün SCHEMA_VERSION'ını artır (DDL'ler idempotent kalmalı)
+
+Kullanım:
+    SCHEMA_VERSION = 1
+    def _init():
+        schema.ensure(_conn(), "budget", SCHEMA_VERSION, lambda c: c.executescript(_DDL))
+    schema.register("budget", _init)
+"""
+import logging
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+logger = logging.getLogger("autotax.schema")
+
+_DDL = """
+CREATE TABLE IF NOT EXISTS schema_version (
+    component  TEXT PRIMARY KEY,
+    version    INTEGER NOT NULL,
+    applied_at TEXT NOT NULL
+);
+"""
+
+_REGISTRY: dict = {}            # component → kurulum fonksiyonu (kayıt sırasıyla)
+_TIMINGS:  dict = {}            # component → son kurulum süresi (ms)
+_RLOCK = threading.RLock()
+_DONE = False
+
+
+def register(component: str, init) -> None:
+    """Modül kurulumunu kaydet; migrate() zaten çalıştıysa hemen kur."""
+    with _RLOCK:
+        if component in _REGISTRY:
+            return
+        _REGISTRY[component] = init
+        if _DONE:
+            _run(component, init)
+
+
+def migrate() -> dict:
+    """Kayıtlı tüm kurulumları sırayla çalıştır (tekrar çağrılabilir — ikinci çağrı no-op)."""
+    global _DONE
+    with _RLOCK:
+        if not _DONE:
+            for component, init in list(_REGISTRY.items()):
+                _run(component, init)
+            _DONE = True
+    return dict(_TIMINGS)
+
+
+def _run(component: str, init) -> None:
+    t0 = time.perf_counter()
+    init()
+    _TIMINGS[component] = round((time.perf_counter() - t0) * 1000, 2)
+
+
+def version(c: sqlite3.Connection, component: str) -> int:
+    """Bu DB dosyasında component'in kayıtlı sürümü (kayıt yoksa 0)."""
+    try:
+        row = c.execute("SELECT version FROM schema_version WHERE component=?",
+                        (component,)).fetchone()
+    except sqlite3.OperationalError:            # tablo yok → sürümsüz (eski) kurulum
+        return 0
+    return row[0] if row else 0
+
+
+def ensure(c: sqlite3.Connection, component: str, target: int, migrate_fn) -> bool:
+    """
+    Kayıtlı sürüm < target ise migrate_fn(c) çalışır, sonra sürüm yazılır.
+    True → migration çalıştı. migrate_fn kendi transaction'larını yönetebilir.
+    """
+    current = version(c, component)
+    if current >= target:
+        return False
+    migrate_fn(c)
+    with c:
+        c.executescript(_DDL)
+        c.execute("INSERT OR REPLACE INTO schema_version (component, version, applied_at) "
+                  "VALUES (?,?,?)", (component, target, datetime.now().isoformat()))
+    logger.info("schema %s v%d → v%d", component, current, target)
+    return True
+
+
+def stats() -> dict:
+    """Kayıtlı bileşenler + son açılıştaki kurulum süreleri (izleme)."""
+    return {"migrated": _DONE, "components": list(_REGISTRY), "timings_ms": dict(_TIMINGS)}
@@ -0,0 +1,181 @@
+"""
+AutoTax.cloud — Fatura shard'ları: online taşıma + durum
+INVOICE_SHARDS değişince (bkz. invoice_db "Shard'lar") mevcut tenant'lar
+shard_placement'taki eski yerlerinden okunup yazılmaya devam eder;
+rebalance() onları uygulama çalışırken hedef shard'larına taşır.
+
+  • Tenant başına: kaynak + hedef (+ shard 0) kilitleri altında fatura, blob,
+    kalem ve KDV satırları hedefe kopyalanır, yer kaydı silinir, kaynaktan silinir
+  • Kilitler sadece o tenant'ın kopyası süresince o shard'ların yazmalarını bekletir
+  • Kopya sırasında kuyruğa girip eski shard'a düşen yazmalar son turda süpürülür
+  • Kesilirse kaldığı yerden sürer (kopya idempotent: hedefteki aynı id'ler önce silinir)
+  • Bekleyen tenant kalmayınca dosya sayısı kaydı INVOICE_SHARDS'a iner (boşalan
+    fazla shard dosyaları bir sonraki başlatmada açılmaz, silinebilir)
+
+Kullanım:
+    python -m app.services.sharding              # durum
+    python -m app.services.sharding --rebalance  # taşı
+"""
+import json
+import logging
+import threading
+from contextlib import ExitStack
+from datetime import datetime
+
+from app.services import schema
+from app.services import invoice_db as idb
+
+logger = logging.getLogger("autotax.shards")
+
+COPY_BATCH = 500
+
+_REBALANCE_LOCK = threading.Lock()
+_progress = {"running": False, "tenants": 0, "invoices": 0,
+             "started_at": None, "finished_at": None, "error": None}
+
+
+# ── Kopyalama ─────────────────────────────────────────────
+def _delete(c, ids: list) -> None:
+    """Faturaları sil (trigger'lar blob + FTS satırlarını da siler)."""
+    marks = ",".join("?" * len(ids))
+    c.execute(f"DELETE FROM invoice_items     WHERE invoice_id IN ({marks})", ids)
+    c.execute(f"DELETE FROM invoice_vat_lines WHERE invoice_id IN ({marks})", ids)
+    c.execute(f"DELETE FROM invoices          WHERE id IN ({marks})", ids)
+
+
+def _copy(src, dst, ids: list) -> None:
+    """
+    ids'in tüm satırlarını src bağlantısından dst'ye (dst'nin açık transaction'ında).
+    Kategori / ödeme kodları shard'a özgü → etiketten dst'de yeniden kodlanır.
+    """
+    marks = ",".join("?" * len(ids))
+    cols  = [c for c in idb._COLS if c not in ("cat_code", "pay_code")]
+    rows  = src.execute(f"SELECT {', '.join(cols)}, {idb._cols(('category', 'payment_method'))} "
+                        f"FROM invoices WHERE id IN ({marks})", ids).fetchall()
+    blobs = src.execute(f"SELECT invoice_id, raw_text, qr_raw, qr_parsed FROM invoice_blobs "
+                        f"WHERE invoice_id IN ({marks})", ids).fetchall()
+    items = src.execute(f"SELECT invoice_id, user_id, day, line_no, name, name_key, price_cents "
+                        f"FROM invoice_items WHERE invoice_id IN ({marks})", ids).fetchall()
+    vat   = src.execute(f"SELECT invoice_id, user_id, day, rate, amount_cents "
+                        f"FROM invoice_vat_lines WHERE invoice_id IN ({marks})", ids).fetchall()
+    edits = src.execute(f"SELECT invoice_id, field, edited_at FROM invoice_edits "
+                        f"WHERE invoice_id IN ({marks})", ids).fetchall()
+    _delete(dst, ids)                       # yarım kalmış önceki kopya
+    codes = {"cat_code": lambda r: idb._code(dst, "category", r["category"]),
+             "pay_code": lambda r: idb._code(dst, "payment", r["payment_method"])}
+    dst.executemany(idb._INSERT, [tuple(codes[c](r) if c in codes else r[c] for c in idb._COLS)
+                                  for r in rows])
+    dst.executemany("INSERT INTO invoice_blobs (invoice_id, raw_text, qr_raw, qr_parsed) "
+                    "VALUES (?,?,?,?)", [tuple(b) for b in blobs])
+    if idb.FTS_TOKENIZER:
+        texts = {b["invoice_id"]: b["raw_text"] for b in blobs}
+        dst.executemany(idb._FTS_INSERT, [(idb._unpack(texts.get(r["id"])), r["id"]) for r in rows])
+    dst.executemany(idb._ITEM_INSERT, [tuple(r) for r in items])
+    dst.executemany(idb._VATL_INSERT, [tuple(r) for r in vat])
+    dst.executemany("INSERT INTO invoice_edits (invoice_id, field, edited_at) VALUES (?,?,?)",
+                    [tuple(r) for r in edits])
+
+
+def move_tenant(user_id: str, src: idb.Shard, dst: idb.Shard) -> int:
+    """Tenant'ın src'deki tüm faturalarını dst'ye taşı; taşınan fatura sayısı."""
+    moved = 0
+    while True:
+        with ExitStack() as stack:
+            # Sabit sıra (index) → iki taşıma / yazıcı arasında deadlock yok
+            for i in sorted({0, src.index, dst.index}):
+                stack.enter_context(idb.SHARDS[i].lock)
+            ids = [r[0] for r in src.conn().execute(
+                "SELECT id FROM invoices WHERE user_id=?", (user_id,))]
+            if not ids:
+                break
+            with dst.conn() as dc:
+                for i in range(0, len(ids), COPY_BATCH):
+                    _copy(src.conn(), dc, ids[i:i + COPY_BATCH])
+            # Yer kaydı: bundan sonra okuma / yazma dst'de
+            with idb._conn() as c:
+                if dst.index == idb.home_shard(user_id):
+                    c.execute("DELETE FROM shard_placement WHERE user_id=?", (user_id,))
+                else:
+                    c.execute("INSERT OR REPLACE INTO shard_placement (user_id, shard) VALUES (?,?)",
+                              (user_id, dst.index))
+            if dst.index == idb.home_shard(user_id):
+                idb._PLACEMENT.pop(user_id, None)
+            else:
+                idb._PLACEMENT[user_id] = dst.index
+            with src.conn() as sc:
+                for i in range(0, len(ids), COPY_BATCH):
+                    _delete(sc, ids[i:i + COPY_BATCH])
+            idb._bump()
+        moved += len(ids)
+    return moved
+
+
+def _strays(sh: idb.Shard) -> list[str]:
+    """Bu shard'da olup yeri başka shard olan tenant'lar."""
+    return [uid for (uid,) in sh.conn().execute(
+                "SELECT DISTINCT user_id FROM invoices WHERE user_id IS NOT NULL")
+            if idb.shard_for(uid) is not sh]
+
+
+# ── Taşıma job'ı ──────────────────────────────────────────
+def rebalance() -> dict:
+    """Bekleyen tüm tenant'ları hedef shard'larına taşı (senkron, tekrar çağrılabilir)."""
+    if not _REBALANCE_LOCK.acquire(blocking=False):
+        return status()
+    try:
+        _progress.update(running=True, tenants=0, invoices=0, error=None,
+                         started_at=datetime.utcnow().isoformat(), finished_at=None)
+        for uid, src in list(idb._PLACEMENT.items()):
+            dst = idb.SHARDS[idb.home_shard(uid)]
+            _progress["invoices"] += move_tenant(uid, idb.SHARDS[src], dst)
+            _progress["tenants"]  += 1
+        # Taşıma sırasında eski shard'a commit edilmiş yazmalar
+        for sh in idb.SHARDS:
+            for uid in _strays(sh):
+                _progress["invoices"] += move_tenant(uid, sh, idb.shard_for(uid))
+        if not idb._PLACEMENT:
+            with idb._LOCK:
+                with idb._conn() as c:
+                    c.execute("INSERT OR REPLACE INTO shard_meta (key, value) VALUES ('files', ?)",
+                              (str(idb.SHARD_COUNT),))
+        logger.info("shard rebalance: %d tenant, %d fatura taşındı",
+                    _progress["tenants"], _progress["invoices"])
+    except Exception as e:
+        logger.error("shard rebalance failed: %s", type(e).__name__)
+        _progress["error"] = f"{type(e).__name__}: {e}"[:500]
+    finally:
+        _progress.update(running=False, finished_at=datetime.utcnow().isoformat())
+        _REBALANCE_LOCK.release()
+    return status()
+
+
+def start_rebalance() -> None:
+    """rebalance'ı arka plan thread'inde başlat (admin endpoint'i bloklamaz)."""
+    threading.Thread(target=rebalance, daemon=True).start()
+
+
+def status() -> dict:
+    """Shard dosyaları + fatura sayıları (paralel fan-out) + taşıma durumu."""
+    counts = idb.shard_counts()
+    return {
+        "shards":  idb.SHARD_COUNT,
+        "files": [
+            {"index": sh.index, "path": str(sh.path), "invoices": n,
+             "draining": sh.index >= idb.SHARD_COUNT}
+            for sh, n in zip(idb.SHARDS, counts)
+        ],
+        "total_invoices":  sum(counts),
+        "pending_tenants": len(idb._PLACEMENT),
+        "rebalance":       dict(_progress),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+    ap = argparse.ArgumentParser(description="AutoTax fatura shard'ları")
+    ap.add_argument("--rebalance", action="store_true", help="Bekleyen tenant'ları hedef shard'a taşı")
+    args = ap.parse_args()
+    schema.migrate()
+
+    logging.basicConfig(level=logging.INFO)
+    print(json.dumps(rebalance() if args.rebalance else status(), ensure_ascii=False, indent=2))
@@ -0,0 +1,136 @@
+"""
+AutoTax.cloud — Açılış süresi ölçümü (import time + ilk /api/health)
+`import main` ayrı bir process'te `-X importtime` ile çalıştırılır; çıktı parse
+edilip en pahalı modüller raporlanır. Ağır OCR / scheduler bağımlılıkları (cv2,
+numpy, pytesseract, pdf2image, apscheduler) import'ta yüklenirse, toplam import
+veya uvicorn'un ilk /api/health yanıtına kadar geçen süre bütçeyi aşarsa exit
+code 1 döner (CI'da çalıştırılır → yavaş boot regresyonu merge edilmez).
+
+SQLITE_PATH / USERS_DB_PATH'in gösterdiği DB'ler kullanılır (açılış migration'ları dahil).
+
+Kullanım:
+    python -m app.services.startup_bench                      # rapor + kontrol
+    python -m app.services.startup_bench --top 30 --no-server # sadece import profili
+    python -m app.services.startup_bench --max-import-ms 800 --max-health-ms 2000
+    python -m app.services.startup_bench --path /api/ready --max-health-ms 20000
+"""
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[2]
+
+# İlk kullanımda yüklenmesi gereken (import main'de görülmemesi gereken) paketler
+HEAVY = ("cv2", "numpy", "pytesseract", "pdf2image", "apscheduler")
+
+
+# ── Import profili ────────────────────────────────────────
+def import_profile(module: str = "main") -> list[tuple[str, int, int]]:
+    """`python -X importtime -c 'import <module>'` → [(modül, self µs, cumulative µs)]."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+        cwd=ROOT, capture_output=True, text=True,
+    )
+    if proc.returncode:
+        raise RuntimeError(f"import {module} başarısız:\n{proc.stderr[-2000:]}")
+    rows = []
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue                                    # başlık satırı
+        rows.append((parts[2].strip(), int(parts[0]), int(parts[1])))
+    return rows
+
+
+def summarize(rows: list, module: str = "main", top: int = 15) -> dict:
+    total = next((cum for name, _, cum in rows if name == module), 0)
+    loaded = {name for name, _, _ in rows}
+    return {
+        "total_ms": round(total / 1000, 1),
+        "modules":  len(rows),
+        "heavy":    sorted(h for h in HEAVY if h in loaded),
+        "top":      [(name, round(cum / 1000, 1))
+                     for name, _, cum in sorted(rows, key=lambda r: -r[2])[:top]],
+    }
+
+
+# ── İlk /api/health ───────────────────────────────────────
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def time_to_health(timeout: float = 60, path: str = "/api/health") -> float:
+    """uvicorn'u başlat, path 200 dönene kadar geçen süre (ms). /api/ready → OCR ısınması dahil."""
+    port = _free_port()
+    url  = f"http://127.0.0.1:{port}{path}"
+    t0   = time.perf_counter()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--host", "127.0.0.1",
+         "--port", str(port), "--log-level", "warning"],
+        cwd=ROOT, env=os.environ.copy(),
+        stdout=subprocess.DEVNULL, stderr=subprocess.PIPE,
+    )
+    try:
+        while time.perf_counter() - t0 < timeout:
+            if proc.poll() is not None:
+                raise RuntimeError(f"uvicorn çıktı:\n{proc.stderr.read().decode()[-2000:]}")
+            try:
+                with urllib.request.urlopen(url, timeout=1) as r:
+                    if r.status == 200:
+                        return round((time.perf_counter() - t0) * 1000, 1)
+            except OSError:
+                time.sleep(0.02)
+        raise RuntimeError(f"{path} {timeout:.0f} sn içinde 200 dönmedi")
+    finally:
+        proc.terminate()
+        try:
+            proc.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            proc.kill()
+
+
+# ── CLI: python -m app.services.startup_bench ─────────────
+def main(argv=None) -> int:
+    import argparse
+    ap = argparse.ArgumentParser(description="AutoTax açılış süresi kontrolü")
+    ap.add_argument("--module",        default="main")
+    ap.add_argument("--top",           type=int,   default=15, help="En pahalı N modül")
+    ap.add_argument("--repeat",        type=int,   default=3,  help="Ölçüm tekrarı (en iyisi alınır)")
+    ap.add_argument("--max-import-ms", type=float, default=1500)
+    ap.add_argument("--max-health-ms", type=float, default=4000)
+    ap.add_argument("--path",          default="/api/health", help="Beklenen endpoint (/api/ready → ısınma dahil)")
+    ap.add_argument("--no-server",     action="store_true", help="uvicorn ile endpoint süresini ölçme")
+    args = ap.parse_args(argv)
+
+    runs = [summarize(import_profile(args.module), args.module, args.top)
+            for _ in range(max(1, args.repeat))]
+    best = min(runs, key=lambda r: r["total_ms"])
+    print(f"import {args.module}: {best['total_ms']} ms, {best['modules']} modül")
+    for name, ms in best["top"]:
+        print(f"  {ms:8.1f} ms  {name}")
+
+    failures = [f"ağır bağımlılık import'ta yüklendi: {h}" for h in best["heavy"]]
+    if best["total_ms"] > args.max_import_ms:
+        failures.append(f"import {best['total_ms']} ms > {args.max_import_ms:.0f} ms")
+    if not args.no_server:
+        health = min(time_to_health(path=args.path) for _ in range(max(1, args.repeat)))
+        print(f"ilk {args.path}: {health} ms")
+        if health > args.max_health_ms:
+            failures.append(f"ilk {args.path} {health} ms > {args.max_health_ms:.0f} ms")
+
+    for line in failures:
+        print("FAIL", line)
+    print(f"{len(failures)} hata")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
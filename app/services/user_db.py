@@ -6,10 +6,13 @@ from pathlib import Path
 from threading import Lock
 import os
 
+from app.services import db, schema
+
 _DB_PATH = Path(os.getenv("USERS_DB_PATH", "storage/users.db"))
-_DB_PATH.parent.mkdir(parents=True, exist_ok=True)
 _LOCK    = Lock()
 
+SCHEMA_VERSION = 1      # _DDL / kolon migration'ları değişince artır (bkz. schema.py)
+
 # ── Plan tanımları ────────────────────────────────────────
 PLANS = {
     "free": {
@@ -117,16 +120,16 @@ CREATE TABLE IF NOT EXISTS password_reset_tokens (
 
 
 def _conn() -> sqlite3.Connection:
-    c = sqlite3.connect(str(_DB_PATH), check_same_thread=False, timeout=30)
-    c.row_factory = sqlite3.Row
-    c.execute("PRAGMA journal_mode=WAL")
-    c.execute("PRAGMA synchronous=NORMAL")
-    return c
+    return db.pool(_DB_PATH).conn()
 
 
 def _init():
     _DB_PATH.parent.mkdir(parents=True, exist_ok=True)
-    with _conn() as c:
+    schema.ensure(_conn(), "users", SCHEMA_VERSION, _migrate)
+
+
+def _migrate(c: sqlite3.Connection):
+    with c:
         # Önce mevcut tablo varsa eksik kolonları ekle (migration)
         cols = [r[1] for r in c.execute(
             "PRAGMA table_info(users)"
@@ -470,4 +473,4 @@ def consume_reset_token(token: str, new_password: str) -> bool:
             c.execute("UPDATE password_reset_tokens SET used=1 WHERE token=?", (token,))
     return True
 
-_init()
+schema.register("users", _init)
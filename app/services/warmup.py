@@ -0,0 +1,159 @@
+"""
+AutoTax.cloud — OCR ısınma (warm-up) + hazır olma durumu
+Yeni bir worker'ın ilk OCR isteği ESPCN modelini (_get_sr), tesseract
+traineddata'sını, OpenCV DNN'i ve ilk çağrı maliyetlerini öder → steady-state'in
+3–5 katı sürer. Açılışta tam pipeline sentetik bir fişle çalıştırılır; /api/ready
+ancak bu bittikten sonra 200 döner (docker-compose healthcheck'i / Railway trafiği
+sadece ısınmış worker'lara yönlendirir). /api/health liveness olarak kalır.
+
+  • Sentetik fiş PIL ile bellekte çizilir (binary asset yok): mağaza, tarih, kalemler,
+    KDV satırları, toplam → ayrıştırıcının tüm yolları da ısınır
+  • Adımlar routes/ocr.py'dekiyle aynı: to_raw_png → read_qr → prepare_for_ocr
+    (enhance + super resolution) → run_ocr → parse_ocr_text; her adımın süresi ölçülür
+  • Arka plan thread'inde çalışır → açılış ve /api/health bloklanmaz
+  • Bir adım hata verirse (ör. tesseract kurulu değil) diğerleri yine ısıtılır, durum
+    "failed" olur ama worker hazır sayılır — OCR'sız route'lar trafiksiz kalmasın
+  • OCR_WARMUP=false → ısınma yok, worker hemen hazır
+"""
+import io
+import logging
+import threading
+import time
+from datetime import datetime
+
+from app.config import settings
+
+logger = logging.getLogger("autotax.warmup")
+
+RECEIPT_LINES = (
+    "REWE Markt GmbH",
+    "Musterstrasse 12, 10115 Berlin",
+    "USt-IdNr. DE123456789",
+    "Datum: 14.03.2024  12:31",
+    "Rechnungsnr: R-2024-000123",
+    "",
+    "Vollmilch 1,5%          1,19 B",
+    "Roggenbrot              2,49 B",
+    "Kaffee Bohnen 500g      6,99 A",
+    "",
+    "SUMME EUR              10,67",
+    "MwSt 19%  A  5,87       1,12",
+    "MwSt  7%  B  3,44       0,24",
+    "Kartenzahlung",
+)
+
+_STATE = {
+    "status":      "pending",       # pending | running | ready | failed | disabled
+    "started_at":  None,
+    "finished_at": None,
+    "duration_ms": None,
+    "rounds_ms":   [],
+    "steps":       {},              # adım → ilk turdaki süre (ms)
+    "sr_model":    None,            # ESPCN yüklendi mi
+    "errors":      [],
+}
+_LOCK = threading.Lock()
+_thread = None
+
+
+def synthetic_receipt() -> bytes:
+    """Fiş benzeri PNG (beyaz zemin, siyah metin, ~300 dpi ölçeğinde)."""
+    from PIL import Image, ImageDraw, ImageFont
+    try:
+        font = ImageFont.load_default(size=28)
+    except TypeError:                                   # Pillow < 10.1
+        font = ImageFont.load_default()
+    img  = Image.new("RGB", (720, 60 + 40 * len(RECEIPT_LINES)), "white")
+    draw = ImageDraw.Draw(img)
+    for i, line in enumerate(RECEIPT_LINES):
+        draw.text((40, 30 + 40 * i), line, fill="black", font=font)
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    return buf.getvalue()
+
+
+def _step(name: str, steps: dict, errors: list, fn, *args):
+    t0 = time.perf_counter()
+    try:
+        return fn(*args)
+    except Exception as e:
+        errors.append(f"{name}: {type(e).__name__}: {e}"[:300])
+        return None
+    finally:
+        steps[name] = round((time.perf_counter() - t0) * 1000, 1)
+
+
+def _round(png: bytes) -> tuple[dict, list]:
+    steps, errors = {}, []
+    modules = _step("import", steps, errors, _engines)
+    if modules is None:
+        return steps, errors
+    images, engine, qr, parser = modules
+    sr = _step("sr_model", steps, errors, images._get_sr)
+    with _LOCK:
+        _STATE["sr_model"] = sr is not None
+    raw  = _step("decode", steps, errors, images.to_raw_png, png, "warmup.png") or png
+    code = _step("qr", steps, errors, qr.read_qr, raw)
+    if code:
+        _step("qr_parse", steps, errors, qr.parse_qr, code)
+    ready = _step("enhance", steps, errors, images.prepare_for_ocr, raw) or raw
+    text  = _step("ocr", steps, errors, engine.run_ocr, ready)
+    # OCR yoksa bile ayrıştırıcı (regex'ler, lru_cache'ler) bilinen metinle ısınır
+    _step("parse", steps, errors, parser.parse_ocr_text, text or "\n".join(RECEIPT_LINES))
+    return steps, errors
+
+
+def _engines():
+    from app.services import image_processor, invoice_parser, ocr_engine, qr_reader
+    return image_processor, ocr_engine, qr_reader, invoice_parser
+
+
+def run(rounds: int = None) -> dict:
+    """Pipeline'ı rounds kez çalıştır (senkron); son durumu döndürür."""
+    rounds = max(1, settings.OCR_WARMUP_ROUNDS if rounds is None else rounds)
+    t0 = time.perf_counter()
+    with _LOCK:
+        _STATE.update(status="running", started_at=datetime.now().isoformat(),
+                      finished_at=None, duration_ms=None, rounds_ms=[], steps={}, errors=[])
+    png = synthetic_receipt()
+    for i in range(rounds):
+        r0 = time.perf_counter()
+        steps, errors = _round(png)
+        with _LOCK:
+            _STATE["rounds_ms"].append(round((time.perf_counter() - r0) * 1000, 1))
+            if i == 0:
+                _STATE["steps"]  = steps
+                _STATE["errors"] = errors
+    with _LOCK:
+        _STATE.update(status="failed" if _STATE["errors"] else "ready",
+                      finished_at=datetime.now().isoformat(),
+                      duration_ms=round((time.perf_counter() - t0) * 1000, 1))
+        result = state()
+    if result["errors"]:
+        logger.warning("OCR warm-up %.0f ms, hatalar: %s", result["duration_ms"],
+                       "; ".join(result["errors"]))
+    else:
+        logger.info("OCR warm-up %.0f ms (turlar: %s)", result["duration_ms"], result["rounds_ms"])
+    return result
+
+
+def start() -> None:
+    """Açılışta çağrılır: ısınmayı arka plan thread'inde başlat (bir kez)."""
+    global _thread
+    if not settings.OCR_WARMUP:
+        with _LOCK:
+            _STATE["status"] = "disabled"
+        return
+    if _thread is None:
+        _thread = threading.Thread(target=run, name="ocr-warmup", daemon=True)
+        _thread.start()
+
+
+def is_ready() -> bool:
+    """Isınma bitti (veya kapalı) → worker trafik alabilir."""
+    return _STATE["status"] in ("ready", "failed", "disabled")
+
+
+def state() -> dict:
+    return {**_STATE, "rounds_ms": list(_STATE["rounds_ms"]),
+            "steps": dict(_STATE["steps"]), "errors": list(_STATE["errors"])}
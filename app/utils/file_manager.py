@@ -1,13 +1,19 @@
 import os
 import json
+import threading
 from datetime import datetime
 from PIL import Image
 
+from app.utils.json_stream import iter_json_array
+
 STORAGE_PATH = "storage"
 INCOMING_PATH = "storage/incoming"
 PROCESSED_PATH = "storage/processed"
 FAILED_PATH = "storage/failed"
-DB_FILE = "invoices_db.json"
+DB_FILE = "invoices_db.json"            # eski biçim: tek JSON dizisi (her kayıtta baştan yazılıyordu)
+JOURNAL_FILE = "invoices_db.jsonl"      # satır başına bir kayıt, sadece sona ekleme
+
+_JOURNAL_LOCK = threading.Lock()
 
 
 # ---------------------------------------------------------
@@ -25,7 +31,7 @@ def compress_image(input_path, output_path, quality=75):
 
 
 # ---------------------------------------------------------
-# 2) JSON kayıt ekle
+# 2) Kayıt ekle (JSONL — kayıt başına sabit maliyet)
 # ---------------------------------------------------------
 def save_invoice_record(invoice_id, customer_id, total, status, file_path):
     record = {
@@ -36,18 +42,46 @@ def save_invoice_record(invoice_id, customer_id, total, status, file_path):
         "status": status,
         "file_path": file_path
     }
-
+    line = json.dumps(record, ensure_ascii=False) + "\n"
+
+    _migrate_legacy_records()
+    # Tek write() çağrısı, append modunda → satırlar süreçler arasında da karışmaz
+    with _JOURNAL_LOCK, open(JOURNAL_FILE, "a", encoding="utf-8") as f:
+        f.write(line)
+
+
+def load_invoice_records():
+    """Kayıtları sırayla akışla döndür (sabit bellek). Yarım yazılmış satır atlanır."""
+    _migrate_legacy_records()
+    if not os.path.exists(JOURNAL_FILE):
+        return
+    with open(JOURNAL_FILE, "r", encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                yield json.loads(line)
+            except json.JSONDecodeError:
+                continue
+
+
+def _migrate_legacy_records():
+    """Eski DB_FILE (JSON dizisi) → JOURNAL_FILE, bir kez ve akışla; eski dosya .bak olur."""
     if not os.path.exists(DB_FILE):
-        with open(DB_FILE, "w", encoding="utf-8") as f:
-            json.dump([], f, indent=4)
-
-    with open(DB_FILE, "r", encoding="utf-8") as f:
-        data = json.load(f)
-
-    data.append(record)
-
-    with open(DB_FILE, "w", encoding="utf-8") as f:
-        json.dump(data, f, indent=4)
+        return
+    with _JOURNAL_LOCK:
+        if not os.path.exists(DB_FILE):
+            return
+        tmp = JOURNAL_FILE + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as out:
+            for record, _ in iter_json_array(DB_FILE):
+                out.write(json.dumps(record, ensure_ascii=False) + "\n")
+            if os.path.exists(JOURNAL_FILE):            # geçişten önce eklenmiş satırlar
+                with open(JOURNAL_FILE, "r", encoding="utf-8") as f:
+                    for line in f:
+                        out.write(line)
+        os.replace(tmp, JOURNAL_FILE)
+        os.replace(DB_FILE, DB_FILE + ".bak")
 
 
 # ---------------------------------------------------------
@@ -70,7 +104,7 @@ def process_invoice(filename, success=True, customer_id="UNKNOWN", total=0.0):
     # Sıkıştır ve taşı
     compress_image(input_path, output_path)
 
-    # JSON kayıt ekle
+    # Kayıt ekle
     save_invoice_record(
         invoice_id=invoice_id,
         customer_id=customer_id,
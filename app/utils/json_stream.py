@@ -0,0 +1,122 @@
+"""
+Akışlı JSON dizisi okuyucu — dosya boyutundan bağımsız sabit bellek
+Büyük bir JSON dizisinin ([...] veya {"invoices": [...]}) elemanlarını tek tek
+döndürür; dosya MB'lık parçalarla okunur, tamponda sadece okunmakta olan eleman
+tutulur. Her elemanla birlikte ondan sonraki bayt konumu da döner → okuma
+kesilirse iter_json_array(path, offset=...) ile aynı noktadan sürdürülebilir.
+
+Kullanım:
+    for record, offset in iter_json_array("invoices_db.json", key="invoices"):
+        ...
+"""
+import codecs
+import json
+
+CHUNK = 1 << 20             # okuma parçası (bayt)
+_WS = " \t\r\n"
+_END = _WS + ",]}"           # dizideki bir sayıdan sonra gelebilecekler
+_DECODER = json.JSONDecoder()
+
+
+class _Reader:
+    """UTF-8 dosya → str tamponu; offset tüketilen kısmın bayt konumu."""
+
+    def __init__(self, f, offset: int):
+        self.f      = f
+        self.dec    = codecs.getincrementaldecoder("utf-8")()
+        self.buf    = ""
+        self.pos    = 0
+        self.offset = offset
+        self.eof    = False
+
+    def fill(self) -> bool:
+        if self.eof:
+            return False
+        self.buf, self.pos = self.buf[self.pos:], 0
+        data = self.f.read(CHUNK)
+        if not data:
+            self.eof = True
+            self.buf += self.dec.decode(b"", final=True)
+            return False
+        self.buf += self.dec.decode(data)
+        return True
+
+    def consume(self, end: int) -> None:
+        self.offset += len(self.buf[self.pos:end].encode("utf-8"))
+        self.pos = end
+
+    def peek(self) -> str:
+        """Boşlukları atla, sıradaki karakter ("" = dosya sonu)."""
+        while True:
+            i = self.pos
+            while i < len(self.buf) and self.buf[i] in _WS:
+                i += 1
+            self.consume(i)
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill():
+                return ""
+
+    def value(self):
+        """Sıradaki JSON değerini çöz; tampon ortasında kesilmişse okumaya devam et."""
+        self.peek()
+        while True:
+            try:
+                val, end = _DECODER.raw_decode(self.buf, self.pos)
+                # Sayı parça sınırında kesilmiş olabilir ("12" | "3.5", "-3." → -3)
+                if self.eof or (end < len(self.buf) and (
+                        self.buf[end] in _END or not isinstance(val, (int, float)))):
+                    self.consume(end)
+                    return val
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            self.fill()
+
+    def expect(self, ch: str) -> None:
+        if self.peek() != ch:
+            raise json.JSONDecodeError(f"'{ch}' bekleniyordu", self.buf, self.pos)
+        self.consume(self.pos + 1)
+
+
+def _enter(r: _Reader, key: str) -> bool:
+    """Dizinin '[' sonrasına konumlan: üst düzey dizi veya {key: [...]}."""
+    if r.peek() == "\ufeff":                            # BOM
+        r.consume(r.pos + 1)
+    ch = r.peek()
+    if ch == "[":
+        r.consume(r.pos + 1)
+        return True
+    if ch != "{":
+        return False
+    r.consume(r.pos + 1)
+    while r.peek() not in ("}", ""):
+        name = r.value()
+        r.expect(":")
+        if name == key and r.peek() == "[":
+            r.consume(r.pos + 1)
+            return True
+        r.value()                                       # başka anahtar → atla
+        if r.peek() == ",":
+            r.consume(r.pos + 1)
+    return False
+
+
+def iter_json_array(path, offset: int = 0, key: str = "invoices"):
+    """
+    → (eleman, sonraki_offset). offset > 0 → önceki bir çağrının döndürdüğü konum
+    (dizinin içinde, bir elemandan hemen sonra). Bozuk JSON → json.JSONDecodeError.
+    """
+    with open(path, "rb") as f:
+        f.seek(offset)
+        r = _Reader(f, offset)
+        if offset == 0 and not _enter(r, key):
+            return
+        while True:
+            ch = r.peek()
+            if ch in ("]", ""):
+                return
+            if ch == ",":
+                r.consume(r.pos + 1)
+                continue
+            yield r.value(), r.offset
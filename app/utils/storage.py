@@ -1,4 +1,4 @@
-import re
+from app.services.money_tokens import amounts, by_line
 
 def parse_extras(raw_text: str):
     """
@@ -7,36 +7,23 @@ def parse_extras(raw_text: str):
     """
     extras = []
 
-    # OCR satırlarını al
-    lines = raw_text.split("\n")
-
-    # Extra kelimelerini tanımla (genişletilebilir)
-    extra_keywords = [
-        "extra", "ekstra", "addon", "sos", "sauce", "dip", "ek ürün"
-    ]
-
-    for line in lines:
-        lower = line.lower()
-
+    # Extra kelimeleri money_tokens.KEYWORDS["extra"] içinde (genişletilebilir)
+    for tokens in by_line(amounts(raw_text)).values():
         # Satırda extra kelimesi var mı?
-        if any(keyword in lower for keyword in extra_keywords):
-            price = extract_price(line)
-            if price is not None:
-                extras.append({
-                    "name": "extra",
-                    "qty": 1,
-                    "price": price
-                })
+        if "extra" in tokens[0].keywords:
+            extras.append({
+                "name": "extra",
+                "qty": 1,
+                "price": tokens[0].value
+            })
 
     return extras
 
 
 def extract_price(text: str):
     """
-    Satırdaki fiyatı regex ile yakalar.
-    Örnek: 8.0, 32.50, 40,50, 12 TL, vb.
+    Satırdaki ilk fiyatı yakalar.
+    Örnek: 8.0, 32.50, 40,50, 12 TL, 1.234,50 vb.
     """
-    match = re.search(r"(\d+[.,]?\d*)", text)
-    if match:
-        return float(match.group(1).replace(",", "."))
-    return None
+    tokens = amounts(text)
+    return tokens[0].value if tokens else None
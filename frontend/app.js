@@ -10,6 +10,7 @@ let filtered     = [];
 let currentPage  = 1;
 let totalPages   = 1;
 let serverTotal  = 0;
+let pageCursor   = { next: null, prev: null };   // keyset sayfalama (OFFSET yok)
 let sortCol      = "date";
 let sortAsc      = false;
 let chartMonthly   = null;
@@ -119,26 +120,41 @@ function setupTheme() {
   });
 }
 
+// Tablo sadece bu alanları gösterir → API düz satır döner (data iç içe değil)
+const LIST_FIELDS = "timestamp,filename,vendor,date,time,total,vat_rate,vat_amount," +
+                    "invoice_number,category,payment_method,needs_review,has_qr";
+
 // â”€â”€ SERVER-SIDE SAYFALAMA â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€
-async function loadPage(page, params = buildFilterParams()) {
+async function loadPage(page, params = buildFilterParams(), cursor = null) {
   setStatus("load", "YÃ¼kleniyorâ€¦");
   try {
-    params.set("page",     page);
     params.set("per_page", PER_PAGE);
+    params.set("fields",   LIST_FIELDS);
+    if (cursor) {
+      // Sonraki/önceki sayfa: cursor ile, sayım ve özetler tekrar hesaplanmaz
+      params.set("cursor",     cursor);
+      params.set("with_count", "false");
+    } else {
+      params.set("page",    page);
+      params.set("include", "vendors,categories");   // facet'ler sadece sayım yapılan istekte
+    }
     const r    = await authFetch(`${API}/api/stats/summary?${params}`);
     if (!r.ok) throw new Error(r.status);
     const body = await r.json();
 
     allInvoices = (body.invoices || []).map(norm);
     filtered    = [...allInvoices];
-    currentPage = body.page  || page;
-    totalPages  = body.pages || 1;
-    serverTotal = body.count || allInvoices.length;
+    currentPage = cursor ? page : (body.page || page);
+    pageCursor  = { next: body.next_cursor || null, prev: body.prev_cursor || null };
+    if (body.count != null) {
+      totalPages  = body.pages || 1;
+      serverTotal = body.count;
+    }
 
     renderTable(filtered);
-    renderSummary(body);
+    if (body.count != null) renderSummary(body);
     renderPagination();
-    renderDashboard(body);
+    if (body.count != null) renderDashboard(body);
     updateExcelFooter();
     updateReviewBadge(allInvoices.filter(i => i.needs_review).length);
     setStatus("ok", "BaÄŸlÄ±");
@@ -183,6 +199,7 @@ function norm(inv) {
     qr_raw:         (d.qr_raw     || inv.qr_raw  || "").slice(0, 500),
     qr_parsed:      d.qr_parsed   || inv.qr_parsed || null,
     raw_text:       (d.raw_text   || inv.raw_text || "").slice(0, 5000),
+    has_qr:         !!(inv.has_qr || d.qr_raw || inv.qr_raw),
     needs_review:   !!inv.needs_review,
     review_reason:  inv.review_reason || d.review_reason || "",
   };
@@ -385,7 +402,7 @@ function renderTable(data) {
         ? `<span class="cat-badge cat-${esc(inv.category)}">${esc(CAT_LABELS[inv.category] || inv.category)}</span>`
         : "â€”"}</td>
       <td>${esc(inv.payment_method) || "â€”"}</td>
-      <td>${inv.qr_raw ? '<span class="qr-badge">QR</span>' : "â€”"}</td>
+      <td>${inv.has_qr ? '<span class="qr-badge">QR</span>' : "â€”"}</td>
       <td style="display:flex;gap:4px">
         <button class="btn btn-ghost detail-btn" style="height:26px;padding:0 8px;font-size:11px" data-i="${i}">Detay</button>
         <button class="btn btn-sm ${inv.needs_review ? 'btn-warning' : 'btn-outline'} edit-btn" style="height:26px;padding:0 8px;font-size:11px" data-id="${esc(inv._id)}" title="${inv.needs_review ? 'Manuel giriÅŸ gerekli!' : 'DÃ¼zenle'}">
@@ -413,18 +430,20 @@ function renderSummary(body) {
 // â”€â”€ PAGÄ°NATION â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€
 function renderPagination() {
   const el = document.getElementById("pagination");
-  if (totalPages <= 1) { el.innerHTML = ""; return; }
-  const range = [];
-  for (let p = Math.max(1, currentPage - 2); p <= Math.min(totalPages, currentPage + 2); p++) range.push(p);
+  if (totalPages <= 1 && !pageCursor.next && !pageCursor.prev) { el.innerHTML = ""; return; }
+  // Keyset: ilk sayfa + önceki/sonraki cursor (derin OFFSET taraması yok)
   el.innerHTML = `
-    <button class="pg-btn" ${currentPage <= 1 ? "disabled" : ""} data-p="1">Â«</button>
-    <button class="pg-btn" ${currentPage <= 1 ? "disabled" : ""} data-p="${currentPage - 1}">â€¹</button>
-    ${range.map(p => `<button class="pg-btn ${p === currentPage ? "pg-active" : ""}" data-p="${p}">${p}</button>`).join("")}
-    <button class="pg-btn" ${currentPage >= totalPages ? "disabled" : ""} data-p="${currentPage + 1}">â€º</button>
-    <button class="pg-btn" ${currentPage >= totalPages ? "disabled" : ""} data-p="${totalPages}">Â»</button>
-    <span class="pg-info">${currentPage} / ${totalPages} Â· ${serverTotal.toLocaleString("tr-TR")} kayÄ±t</span>`;
+    <button class="pg-btn" ${currentPage <= 1 ? "disabled" : ""} data-nav="first">&laquo;</button>
+    <button class="pg-btn" ${pageCursor.prev ? "" : "disabled"} data-nav="prev">&lsaquo;</button>
+    <button class="pg-btn pg-active" disabled>${currentPage}</button>
+    <button class="pg-btn" ${pageCursor.next ? "" : "disabled"} data-nav="next">&rsaquo;</button>
+    <span class="pg-info">${currentPage} / ${totalPages} &middot; ${serverTotal.toLocaleString("tr-TR")} kayıt</span>`;
   el.querySelectorAll(".pg-btn:not([disabled])").forEach(b =>
-    b.addEventListener("click", () => loadPage(+b.dataset.p)));
+    b.addEventListener("click", () => {
+      if (b.dataset.nav === "first") loadPage(1);
+      else if (b.dataset.nav === "prev") loadPage(currentPage - 1, buildFilterParams(), pageCursor.prev);
+      else if (b.dataset.nav === "next") loadPage(currentPage + 1, buildFilterParams(), pageCursor.next);
+    }));
 }
 
 // â”€â”€ EXCEL-LIKE FOOTER â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€
@@ -581,7 +600,7 @@ function exportExcel() {
     "Fatura No": inv.invoice_no,
     "Kategori": CAT_LABELS[inv.category] || inv.category,
     "Ã–deme": inv.payment_method,
-    "QR": inv.qr_raw,
+    "QR": inv.qr_raw || (inv.has_qr ? "QR" : ""),
     "Ä°nceleme": inv.needs_review ? "Evet" : "HayÄ±r",
     "Timestamp": inv._ts,
   }));
@@ -631,7 +650,14 @@ function setupModal() {
   });
 }
 
-function openModal(inv) {
+async function openModal(inv) {
+  // Liste satırları OCR / QR metnini taşımaz → detaydan yükle
+  if (inv._id && !inv.raw_text) {
+    try {
+      const r = await authFetch(`${API}/api/ocr/invoice/${encodeURIComponent(inv._id)}`);
+      if (r.ok) inv = norm(await r.json());
+    } catch (e) { console.error("detay hata:", e); }
+  }
   document.getElementById("modalTitle").textContent = inv.filename || "Fatura";
   let qrText = "QR / Barkod bulunamadÄ±";
   if (inv.qr_raw) {
@@ -812,11 +838,17 @@ function closeEditModal() {
 }
 
 // â”€â”€ Ä°NCELEME KUYRUÄžU â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€
-async function loadReviewQueue(page = 1) {
+let rqPage   = 1;
+let rqCount  = 0;
+
+async function loadReviewQueue(page = 1, cursor = null) {
   try {
-    const r    = await authFetch(`${API}/api/ocr/review-queue?page=${page}&per_page=20`);
+    const q    = cursor ? `cursor=${encodeURIComponent(cursor)}&with_count=false` : `page=${page}`;
+    const r    = await authFetch(`${API}/api/ocr/review-queue?${q}&per_page=20`);
     const body = await r.json();
-    const count = body.count || 0;
+    if (body.count != null) { rqCount = body.count; body.pages = body.pages || 1; }
+    rqPage = page;
+    const count = rqCount;
 
     document.getElementById("rqCount").textContent = `${count} bekliyor`;
     updateReviewBadge(count);
@@ -872,7 +904,7 @@ function renderReviewList(invs) {
           ${rqField("KDV%",     d.vat_rate ? d.vat_rate + "%" : null)}
           ${rqField("Fatura No",d.invoice_number)}
         </div>
-        <div class="rqc-raw">${esc((d.raw_text || "").slice(0, 200))}${(d.raw_text||"").length > 200 ? "â€¦" : ""}</div>
+        <div class="rqc-raw">${esc(d.raw_excerpt || (d.raw_text || "").slice(0, 200))}${!d.raw_excerpt && (d.raw_text||"").length > 200 ? "â€¦" : ""}</div>
         <div class="rqc-actions">
           <button class="btn btn-primary" onclick="openEditModalById('${esc(inv.id)}')">
             âœ DÃ¼zenle / Gir
@@ -908,12 +940,16 @@ async function skipFromQueue(invId) {
 
 function renderRQPagination(body) {
   const el = document.getElementById("rqPagination");
-  if (!el || body.pages <= 1) { if (el) el.innerHTML = ""; return; }
-  el.innerHTML = Array.from({length: body.pages}, (_, i) => i + 1).map(p =>
-    `<button class="pg-btn ${p === body.page ? 'pg-active' : ''}" data-p="${p}">${p}</button>`
-  ).join("") + `<span class="pg-info">${body.page}/${body.pages} Â· ${body.count} bekliyor</span>`;
-  el.querySelectorAll(".pg-btn").forEach(b =>
-    b.addEventListener("click", () => loadReviewQueue(+b.dataset.p)));
+  if (!el) return;
+  if (!body.next_cursor && !body.prev_cursor) { el.innerHTML = ""; return; }
+  const pages = Math.max(1, Math.ceil(rqCount / (body.per_page || 20)));
+  el.innerHTML =
+    `<button class="pg-btn" ${body.prev_cursor ? "" : "disabled"} data-c="${esc(body.prev_cursor || "")}" data-p="${rqPage - 1}">&lsaquo;</button>` +
+    `<button class="pg-btn pg-active" disabled>${rqPage}</button>` +
+    `<button class="pg-btn" ${body.next_cursor ? "" : "disabled"} data-c="${esc(body.next_cursor || "")}" data-p="${rqPage + 1}">&rsaquo;</button>` +
+    `<span class="pg-info">${rqPage}/${pages} &middot; ${rqCount} bekliyor</span>`;
+  el.querySelectorAll(".pg-btn:not([disabled])").forEach(b =>
+    b.addEventListener("click", () => loadReviewQueue(+b.dataset.p, b.dataset.c)));
 }
 
 // â”€â”€ Ä°STATÄ°STÄ°K â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€â”€
@@ -936,6 +972,7 @@ async function runStats() {
   if (mn)  p.set("min_amount", mn);
   if (mx)  p.set("max_amount", mx);
   p.set("per_page", "1");
+  p.set("include",  "vendors,categories");
 
   const el = document.getElementById("statsResult");
   el.innerHTML = `<div class="log-item log-info">SorgulanÄ±yorâ€¦</div>`;
@@ -1026,15 +1063,17 @@ function dl(content, filename, mime) {
 
 // ── Muhasebe Defteri ─────────────────────────────────────────────────────────
 let _ldgPage = 1;
+let _ldgCursor = null;   // keyset cursor (null = ilk sayfa)
+let _ldgLast   = null;   // son sayım/özet — cursor sayfalarında tekrar hesaplanmaz
 const _ldgPerPage = 50;
 
 function initLedger() {
-  document.getElementById("ldgFilter")?.addEventListener("click", () => { _ldgPage = 1; loadLedger(); });
+  document.getElementById("ldgFilter")?.addEventListener("click", () => { _ldgPage = 1; _ldgCursor = null; loadLedger(); });
   document.getElementById("ldgReset")?.addEventListener("click", () => {
     document.getElementById("ldgStart").value = "";
     document.getElementById("ldgEnd").value = "";
     document.getElementById("ldgVendor").value = "";
-    _ldgPage = 1; loadLedger();
+    _ldgPage = 1; _ldgCursor = null; loadLedger();
   });
 }
 
@@ -1043,7 +1082,9 @@ async function loadLedger() {
   const end    = document.getElementById("ldgEnd")?.value    || "";
   const vendor = document.getElementById("ldgVendor")?.value || "";
 
-  let url = `/api/stats/ledger?page=${_ldgPage}&per_page=${_ldgPerPage}`;
+  let url = _ldgCursor
+    ? `/api/stats/ledger?cursor=${encodeURIComponent(_ldgCursor)}&with_count=false&per_page=${_ldgPerPage}`
+    : `/api/stats/ledger?page=1&per_page=${_ldgPerPage}`;
   if (start)  url += `&start=${start}`;
   if (end)    url += `&end=${end}`;
   if (vendor) url += `&vendor=${encodeURIComponent(vendor)}`;
@@ -1058,7 +1099,11 @@ async function loadLedger() {
 
   const res = await authFetch(url);
   if (!res || !res.ok) return;
-  const d = await res.json();
+  let d = await res.json();
+  if (d && d.count == null && _ldgLast) {
+    d = { ..._ldgLast, ...d, count: _ldgLast.count, pages: _ldgLast.pages, monthly: _ldgLast.monthly };
+  }
+  _ldgLast = d;
 
   // Boş veri kontrolü
   const tbody = document.getElementById("ldgTbody");
@@ -1125,19 +1170,19 @@ async function loadLedger() {
 
   // Sayfa bilgisi
   const pi = document.getElementById("ldgPageInfo");
-  if (pi) pi.textContent = `Sayfa ${d.page}/${d.pages} — ${d.count} kayıt`;
+  if (pi) pi.textContent = `Sayfa ${_ldgPage}/${d.pages} — ${d.count} kayıt`;
 
   // Pagination
   const pg = document.getElementById("ldgPagination");
   if (pg) {
     let html = "";
-    if (_ldgPage > 1)       html += `<button class="btn btn-ghost btn-sm" onclick="ldgGoPage(${_ldgPage-1})">← Önceki</button>`;
-    if (_ldgPage < d.pages) html += `<button class="btn btn-ghost btn-sm" onclick="ldgGoPage(${_ldgPage+1})">Sonraki →</button>`;
+    if (d.prev_cursor) html += `<button class="btn btn-ghost btn-sm" onclick="ldgGoPage(-1, '${d.prev_cursor}')">← Önceki</button>`;
+    if (d.next_cursor) html += `<button class="btn btn-ghost btn-sm" onclick="ldgGoPage(1, '${d.next_cursor}')">Sonraki →</button>`;
     pg.innerHTML = html;
   }
 }
 
-window.ldgGoPage = (p) => { _ldgPage = p; loadLedger(); };
+window.ldgGoPage = (step, cursor) => { _ldgPage += step; _ldgCursor = cursor; loadLedger(); };
 
 // ── Plan widget ──────────────────────────────────────────────────────────────
 async function loadPlanWidget() {
@@ -1,4 +1,4 @@
-import re
+from app.services.money_tokens import by_line, money
 
 def extract_items(text: str) -> list:
     """
@@ -9,48 +9,26 @@ def extract_items(text: str) -> list:
     lines = text.split("\n")
     items = []
 
-    # Para formatı (12,99 / 12.99 / 1.299,00)
-    price_pattern = r"\d{1,3}(?:[.,]\d{3})*(?:[.,]\d{2})"
-
-    # Ürün olmayan satırları elemek için kara liste
-    blacklist = [
-        "summe", "total", "betrag", "brutto", "netto",
-        "mwst", "ust", "steuer", "rabatt", "discount",
-        "zahlung", "versand", "shipping"
-    ]
-
-    for line in lines:
-        clean = line.strip().lower()
+    # Ürün olmayan satırları elemek için kara liste (money_tokens.KEYWORDS grupları:
+    # summe, total, betrag, brutto, netto, mwst, ust, steuer, rabatt, discount,
+    # zahlung, versand, shipping …)
+    blacklist = {"total", "grand_total", "net", "vat", "discount", "payment", "shipping"}
 
+    # Para formatındaki token'lar (12,99 / 12.99 / 1.299,00), satır satır
+    for li, prices in by_line(money(text)).items():
         # Kara liste kontrolü
-        if any(word in clean for word in blacklist):
-            continue
-
-        # Fiyatları bul
-        prices = re.findall(price_pattern, clean)
-        if not prices:
+        if prices[0].keywords & blacklist:
             continue
 
         # Son fiyat genelde ürün fiyatıdır
-        raw_price = prices[-1]
-
-        # Normalize et
-        normalized = raw_price.replace(".", "").replace(",", ".")
-        try:
-            price = float(normalized)
-        except:
-            continue
-
-        # Negatif fiyatları alma
-        if price < 0:
-            continue
-
-        # Ürün adı: satırdan fiyatı çıkar
-        name = line.replace(raw_price, "").strip()
-
-        # Ürün adı içindeki diğer fiyatları da temizle
-        for p in prices[:-1]:
-            name = name.replace(p, "").strip()
+        price = prices[-1].value
+
+        # Ürün adı: satırdan tüm fiyatları çıkar
+        line = lines[li][:500]
+        name = line
+        for p in reversed(prices):
+            name = name[:p.column] + name[p.end:]
+        name = name.strip()
 
         # Çok kısa isimleri alma
         if len(name) < 2:
@@ -35,23 +35,73 @@ app = FastAPI(
     openapi_url="/api/openapi.json",
 )
 
+# ── Açılış: şema migration'ları + scheduler ──────────────
+# Import hafif kalır (DB'ye dokunmaz, scheduler başlatmaz) → worker boot'u ve
+# `import main` hızlı; migration'lar schema_version'a göre process başına bir kez.
+@app.on_event("startup")
+def _startup():
+    from app.services import schema
+    timings = schema.migrate()
+    logger.info("schema ready (%s ms)", ", ".join(f"{k}={v}" for k, v in timings.items()))
+    _start_scheduler()
+    # OCR modelleri arka planda ısınır; /api/ready o zamana kadar 503 (bkz. app/services/warmup.py)
+    from app.services import warmup
+    warmup.start()
+
+
 # ── GDPR: 90 Günlük Otomatik Dosya Temizliği ─────────────
 # privacy.html taahhüdünü gerçekleştiren scheduler
-try:
-    from apscheduler.schedulers.background import BackgroundScheduler
-    _scheduler = BackgroundScheduler()
+_scheduler = None
+
+
+def _gdpr_purge_job():
+    # Batch'li, sürdürülebilir (bkz. app/services/retention.py); yarım kalan job'ı sürdürür
+    from app.services import retention
+    job = retention.run()
+    if job and job["status"] != "done":
+        logger.warning("GDPR retention job=%s status=%s", job["id"], job["status"])
+
+
+def _gdpr_reaper_job():
+    # Yarım kalan / dosyası silinemeyen hesap silmelerini sürdürür (bkz. app/services/reaper.py)
+    from app.services import reaper
+    reaper.run()
+
 
-    def _gdpr_purge_job():
-        from app.services.invoice_db import purge_old_invoice_files
-        count = purge_old_invoice_files(days=90)
-        if count:
-            logger.info("GDPR purge_old_files removed=%d", count)
+def _archive_job():
+    # Sıcak yıllardan eskileri yıl bazlı arşiv dosyalarına taşır (bkz. app/services/archive.py)
+    from app.services import archive
+    archive.run()
 
-    _scheduler.add_job(_gdpr_purge_job, "cron", hour=3, minute=0)  # her gece 03:00
+
+def _start_scheduler():
+    global _scheduler
+    try:
+        from apscheduler.schedulers.background import BackgroundScheduler
+    except ImportError:
+        logger.warning("apscheduler not installed — GDPR file retention purge disabled")
+        return
+    from app.config import settings
+    from app.services import maintenance
+    _scheduler = BackgroundScheduler()
+    _scheduler.add_job(_gdpr_purge_job, "cron", hour=3, minute=0,  # her gece 03:00
+                       max_instances=1, coalesce=True)
+    _scheduler.add_job(_gdpr_reaper_job, "interval", minutes=max(1, settings.REAPER_INTERVAL_MIN),
+                       max_instances=1, coalesce=True)
+    _scheduler.add_job(_archive_job, "cron", day=1, hour=2, minute=0,  # her ayın 1'i 02:00
+                       max_instances=1, coalesce=True)
+    # WAL checkpoint / ANALYZE + incremental vacuum / gece yedeği (bkz. app/services/maintenance.py)
+    maintenance.schedule(_scheduler)
     _scheduler.start()
-    logger.info("GDPR scheduler started (daily 03:00 purge)")
-except ImportError:
-    logger.warning("apscheduler not installed — GDPR 90-day purge disabled")
+    logger.info("GDPR scheduler started (daily 03:00 purge, reaper every %d min)",
+                settings.REAPER_INTERVAL_MIN)
+
+
+@app.on_event("shutdown")
+def _stop_scheduler():
+    if _scheduler:
+        _scheduler.shutdown(wait=False)
+
 
 app.add_middleware(
     CORSMiddleware,
@@ -71,6 +121,26 @@ async def validation_handler(request: Request, exc: RequestValidationError):
     )
 
 
+from app.services.invoice_db import CursorError, FieldError, TenantError
+
+@app.exception_handler(CursorError)
+@app.exception_handler(FieldError)
+async def bad_query_handler(request: Request, exc: ValueError):
+    return JSONResponse(
+        status_code=400,
+        content={"status": "error", "message": str(exc)},
+    )
+
+
+@app.exception_handler(TenantError)
+async def tenant_handler(request: Request, exc: TenantError):
+    # Tenant'sız fatura okuması hiçbir zaman tüm tenant'lara düşmez
+    return JSONResponse(
+        status_code=401,
+        content={"status": "error", "message": "Oturum açmanız gerekiyor."},
+    )
+
+
 @app.exception_handler(Exception)
 async def global_handler(request: Request, exc: Exception):
     return JSONResponse(
@@ -79,6 +149,13 @@ async def global_handler(request: Request, exc: Exception):
     )
 
 
+# ── Event loop gecikme izleme ─────────────────────────────
+@app.on_event("startup")
+async def _start_loop_monitor():
+    from app.services import loop_monitor
+    loop_monitor.start()
+
+
 @app.middleware("http")
 async def inject_user(request: Request, call_next):
     """JWT varsa user'ı request.state'e ekle (plan kontrolü için)."""
@@ -87,8 +164,8 @@ async def inject_user(request: Request, call_next):
     if auth.startswith("Bearer "):
         try:
             payload = decode_access(auth.split(" ", 1)[1])
-            from app.services.user_db import get_user_by_id
-            user = get_user_by_id(payload.get("sub", ""))
+            from app.services import db_async
+            user = await db_async.get_user_by_id(payload.get("sub", ""))
             request.state.user = user
         except Exception:
             request.state.user = None
@@ -120,6 +197,15 @@ def health():
     return {"status": "ok", "version": "4.0.0"}
 
 
+@app.get("/api/ready")
+def ready():
+    """Readiness: OCR ısınması bitene kadar 503 — trafik sadece ısınmış worker'lara."""
+    from app.services import warmup
+    if not warmup.is_ready():
+        return JSONResponse(status_code=503, content={"status": "warming", "warmup": warmup.state()})
+    return {"status": "ready", "warmup": warmup.state()}
+
+
 # ── GDPR: Hesap Silme Endpoint'i ─────────────────────────
 from fastapi import HTTPException
 
@@ -127,21 +213,37 @@ from fastapi import HTTPException
 async def delete_account(current_user: dict = Depends(get_current_user)):
     """
     Kullanıcının tüm verilerini (hesap + faturalar) kalıcı siler.
-    GDPR Madde 17 — Unutulma Hakkı.
+    GDPR Madde 17 — Unutulma Hakkı. Faturalar anında gizlenir, dosya ve satırları
+    arka planda reaper siler; ilerleme /api/user/deletion/{request_id}'den izlenir.
     """
-    from app.services.user_db     import delete_user
-    from app.services.invoice_db  import delete_user_invoices
+    from app.services import db_async, reaper
     user_id = current_user["id"]
     try:
-        inv_count = delete_user_invoices(user_id)
-        delete_user(user_id)
-        logger.info("GDPR account_deleted invoices=%d", inv_count)  # PII yok
-        return {"status": "deleted", "invoices_removed": inv_count}
+        req = await db_async.tombstone_tenant(user_id)
+        await db_async.delete_user(user_id)
+        reaper.start()
+        logger.info("GDPR account_deleted request=%s invoices=%d",     # PII yok
+                    req["id"], req["invoices_total"])
+        return {"status": "deleted", "deletion_request": req["id"],
+                "invoices_pending": req["invoices_total"]}
     except Exception as e:
         logger.error("GDPR delete_account failed: %s", type(e).__name__)
         raise HTTPException(status_code=500, detail="Hesap silinemedi. Lütfen tekrar deneyin.")
 
 
+@app.get("/api/user/deletion/{request_id}", summary="GDPR silme isteği durumu")
+async def deletion_status(request_id: str):
+    """
+    Hesap silindikten sonra da sorgulanabilir (JWT gerekmez): tahmin edilemez
+    istek id'si ile sadece durum + sayılar döner, tenant bilgisi yok.
+    """
+    from app.services import db_async, reaper
+    req = await db_async.run(reaper.get_request, request_id)
+    if not req:
+        raise HTTPException(status_code=404, detail="Silme isteği bulunamadı.")
+    return req
+
+
 # PWA dosyaları root'ta erişilebilir olmalı (service worker scope için)
 from fastapi.responses import FileResponse
 
@@ -1,4 +1,4 @@
-import re
+from app.services.money_tokens import by_line, tokenize
 
 def extract_vat(text: str) -> list:
     """
@@ -6,59 +6,31 @@ def extract_vat(text: str) -> list:
     Her satır: {"rate": ..., "amount": ...}
     """
 
-    lines = text.split("\n")
     vat_items = []
 
-    # KDV oranı (7%, 19%, 20%, 8%, 1.5% vs.)
-    rate_pattern = r"\d{1,2}(?:[.,]\d{1,2})?\s*%"
-
-    # Para formatı
-    money_pattern = r"\d{1,3}(?:[.,]\d{3})*(?:[.,]\d{2})"
-
-    # KDV olmayan satırları elemek için kara liste
-    blacklist = [
-        "rabatt", "discount", "gutschrift",
-        "versand", "shipping", "porto"
-    ]
-
-    for line in lines:
-        clean = line.strip().lower()
+    # KDV olmayan satırları elemek için kara liste (rabatt, discount, gutschrift,
+    # versand, shipping, porto)
+    blacklist = {"discount", "shipping"}
 
+    for tokens in by_line(tokenize(text)).values():
         # Kara liste kontrolü
-        if any(word in clean for word in blacklist):
+        if tokens[0].keywords & blacklist:
             continue
 
-        # Oranı bul
-        rate_match = re.search(rate_pattern, clean)
-        if not rate_match:
+        # Oranı bul (7%, 19%, 20%, 8%, 1.5% vs.)
+        rates = [t for t in tokens if t.kind == "percent" and t.value < 100]
+        if not rates:
             continue
 
-        # Satırdaki tüm para değerlerini bul
-        amounts = re.findall(money_pattern, clean)
+        # Satırdaki tüm para değerleri (yüzdeler hariç)
+        amounts = [t for t in tokens if t.kind == "amount" and t.decimals == 2]
         if not amounts:
             continue
 
         # Son para değeri genelde KDV tutarıdır
-        raw_amount = amounts[-1]
-
-        # Normalize et
-        raw_rate = rate_match.group()
-        rate = raw_rate.replace("%", "").replace(",", ".").strip()
-        amount = raw_amount.replace(".", "").replace(",", ".")
-
-        try:
-            rate_val = float(rate)
-            amount_val = float(amount)
-        except:
-            continue
-
-        # Negatif KDV olmaz
-        if amount_val < 0:
-            continue
-
         vat_items.append({
-            "rate": rate_val,
-            "amount": amount_val
+            "rate": rates[0].value,
+            "amount": amounts[-1].value
         })
 
     return vat_items